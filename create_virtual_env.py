@@ -6,9 +6,6 @@ import subprocess
 import sys
 import logging
 import shlex
-import apt
-import apt_inst
-import apt_pkg
 
 
 def create_ipython_wrapper(base_dir):
@@ -36,15 +33,6 @@ def main():
     base_dir = work_space + '/.venv'
     cmds = ['virtualenv {0}'.format(base_dir)]
 
-    # Link the apt libraries in the virtual environment
-    sitepkgs = "{0}/lib/python2.7/site-packages/".format(base_dir)
-    apt_libs = [os.path.dirname(apt.__file__)]
-    apt_libs.append( apt_inst.__file__)
-    apt_libs.append(apt_pkg.__file__)
-
-    for apt_file in apt_libs:
-        cmds.append("ln -s {0} {1}".format(apt_file, sitepkgs))
-
     cmds.append('{0}/bin/pip install --no-cache-dir -q -r requirements.txt -e {1}'.format(base_dir, work_space))
 
     for cmd in cmds:
@@ -7,6 +7,7 @@ setup(name='pydotsim',
       author_email='kyin98@yahoo.com',
       packages=find_packages(),
       install_requires=["pydot==1.2.2",
+                        "pyparsing==2.4.7",
                         "ipython==4.2.1",
                         "ipdb==0.9.3",
                         "ipaddress==1.0.22"],
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import asyncio
+import functools
+import logging
+from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.AsyncLauncher import AsyncLauncher, async_request
+from simulator.utilities.PrivHelper import PrivHelperError
+from simulator.utilities.SimState import read_state, update_state
+from simulator.utilities.LaunchJournal import replay_journal
+from simulator.utilities.BootOrder import ssh_port_index
+from simulator.utilities.TopoStream import unquote_name, attribute_is_set
+from simulator.utilities.SerialConsole import iter_console_results, serial_port_index
+
+log = getLogger(__name__)
+
+
+
+async def _in_thread_(func, *args, **kwargs):
+    # Parts that only exist as blocking code (pydot, the port files, YAML)
+    # run in the default executor, so the event loop keeps running
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+async def _host_daemon_(sim, socket_path=None):
+    if not sim.use_host_daemon:
+        return None
+
+    from simulator.utilities.HostDaemon import host_daemon_socket
+
+    socket_path = socket_path or sim.host_daemon_socket or host_daemon_socket
+    if not os.path.exists(socket_path):
+        return None
+
+    try:
+        await async_request(socket_path, [{'op': 'ping'}])
+    except (OSError, PrivHelperError):
+        return None
+
+    return socket_path
+
+
+async def run_async(sim):
+    """
+    Function Name:      run_async
+
+    Parameters:         sim
+                         - DotSimulator (and DotTopo) to start
+
+    Description:        Start a simulation without blocking the event loop.
+                        If this is cancelled, the nodes that were already
+                        started are stopped and their ports are released
+                        before the cancellation is passed on.
+    """
+    daemon = await _host_daemon_(sim)
+    if daemon:
+        from simulator.utilities.HostDaemon import topology_to_dict
+
+        topology = await _in_thread_(topology_to_dict, sim)
+        run = asyncio.ensure_future(async_request(daemon, [{'op': 'run', 'topology': topology,
+                                                            'sim_dir': sim.sim_dir,
+                                                            'image_depot': sim.image_depot_dir,
+                                                            'boot': sim.get_boot_settings()}]))
+        try:
+            results = await asyncio.shield(run)
+        except asyncio.CancelledError:
+            log.warn('Starting {0} was interrupted, stopping it in the host daemon'.format(sim.sim_dir))
+            await asyncio.shield(_stop_in_daemon_(daemon, sim, run))
+            raise
+
+        if results[0].get('error'):
+            raise PrivHelperError(results[0]['error'])
+
+        for name, node_state in results[0]['state']['nodes'].items():
+            node = sim.get_node_from_name(name)
+            if node:
+                node.set('pid', node_state['pid'])
+                node.set('udp_ports', node_state['udp_ports'])
+        return
+
+    builder = await _in_thread_(lambda: sim.builder)
+    if not hasattr(builder, 'get_launch_requests'):
+        # Builders without separate launch steps are run as a whole
+        await _in_thread_(sim.run)
+        return
+
+    launcher = AsyncLauncher(sim.sim_dir)
+    prepare = asyncio.ensure_future(_in_thread_(builder.prepare_launch))
+    plan = None
+    requests = None
+    pids = []
+
+    try:
+        with sim.tracer.span('run'):
+            plan = await asyncio.shield(prepare)
+            await launcher.start()
+
+            if hasattr(builder, 'prepare_config_media'):
+                await _in_thread_(builder.prepare_config_media, plan)
+
+            if hasattr(builder, 'prepare_golden_images'):
+                await _in_thread_(builder.prepare_golden_images, plan)
+
+            if hasattr(builder, 'prepare_namespaces'):
+                await _in_thread_(builder.prepare_namespaces, plan)
+
+            requests = builder.get_launch_requests(plan)
+            with sim.tracer.span('create_overlays', count=len(requests['overlays'])):
+                returncodes = await launcher.create_overlays(requests['overlays'])
+            await _in_thread_(builder.record_overlays, requests['overlays'], returncodes)
+
+            names = requests['names']
+            pids = requests['pids']
+            stages = requests['stages']
+
+            for i, stage in enumerate(stages):
+                with sim.tracer.span('spawn', count=len(stage), stage=i):
+                    stage_pids = await launcher.spawn([requests['argv_list'][j] for j in stage],
+                                                      logs_list=[requests['logs_list'][j] for j in stage],
+                                                      supervise_list=[requests['supervise_list'][j] for j in stage])
+
+                for j, pid in zip(stage, stage_pids):
+                    pids[j] = pid
+
+                await _in_thread_(builder.record_launch, pids, i == len(stages) - 1)
+
+                stage_names = [names[j] for j in stage]
+                sim.tracer.emit('stage_started', {'stage': i, 'nodes': stage_names})
+
+                if len(stages) > 1:
+                    await _wait_stage_ready_(sim, builder, plan, i, stage_names)
+    except BaseException:
+        log.warn('Starting {0} was interrupted, stopping the nodes that were started'.format(sim.sim_dir))
+
+        if plan is None:
+            # The ports are allocated in the thread, wait for it to finish.
+            # If compiling the plan failed, its error is raised here.
+            plan = await prepare
+
+        await asyncio.shield(_stop_partial_(builder, launcher, plan, pids, requests))
+        raise
+
+    if sim.sample_interval or sim.metrics_port:
+        await _in_thread_(sim.start_sampler, sim.sample_interval or 1.0, sim.metrics_port)
+
+
+async def _stop_in_daemon_(daemon, sim, run):
+    # The daemon keeps starting the simulation when the client goes away,
+    # and it refuses to stop a simulation that it is still starting
+    try:
+        await run
+    except (OSError, PrivHelperError) as e:
+        log.warn('Starting {0} in the host daemon failed: {1}'.format(sim.sim_dir, e))
+
+    results = await async_request(daemon, [{'op': 'stop', 'sim_dir': sim.sim_dir}])
+    if results[0].get('error'):
+        log.error('Stopping {0} in the host daemon failed: {1}'.format(sim.sim_dir, results[0]['error']))
+
+
+async def _wait_stage_ready_(sim, builder, plan, stage, names):
+    start = time.time()
+
+    async def wait_node(name):
+        port = plan.nodes[name]['ports'][ssh_port_index]
+        while not await probe_ssh(port, 4.0):
+            await asyncio.sleep(2.0)
+        return name
+
+    # Nodes in network namespaces are ready as soon as they are started
+    waiting = [name for name in names if not plan.nodes[name].get('netns')]
+
+    with sim.tracer.span('stage_ready_wait', count=len(names), stage=stage):
+        done, pending = set(), set()
+        if waiting:
+            done, pending = await asyncio.wait([asyncio.ensure_future(wait_node(name)) for name in waiting],
+                                               timeout=builder.boot_stage_timeout)
+        for task in pending:
+            task.cancel()
+
+    ready = sorted([task.result() for task in done] + [name for name in names if name not in waiting])
+    if len(ready) < len(names):
+        log.warn('{0} of the {1} nodes of stage {2} weren\'t ready after {3} seconds'.format(
+                 len(names) - len(ready), len(names), stage, builder.boot_stage_timeout))
+
+    sim.tracer.emit('stage_ready', {'stage': stage, 'nodes': names, 'ready': ready,
+                                    'seconds': time.time() - start})
+
+
+async def _stop_partial_(builder, launcher, plan, pids, requests=None):
+    names = requests['names'] if requests else list(plan.nodes)
+    nodes = dict((name, {'pid': None, 'udp_ports': plan.nodes[name]['ports']}) for name in names)
+
+    # The spawn request may have been sent without the reply arriving, so
+    # every process that the helper of the simulation started is stopped
+    for pid, rc in (await launcher.status()).items():
+        if rc is None:
+            nodes[str(pid)] = {'pid': pid}
+
+    for name, pid in zip(names, pids):
+        nodes[name]['pid'] = pid
+
+    kill_pids = await _in_thread_(builder.prepare_stop, True, nodes)
+    await launcher.kill(kill_pids)
+    await launcher.shutdown()
+
+    # Everything that was started is stopped again, there is nothing to
+    # resume
+    if hasattr(builder, 'clear_journal'):
+        await _in_thread_(builder.clear_journal)
+
+
+async def stop_async(sim):
+    """
+    Function Name:      stop_async
+
+    Parameters:         sim
+                         - DotSimulator to stop
+
+    Description:        Stop a simulation without blocking the event loop
+    """
+    state = await _in_thread_(read_state, sim.sim_dir) or await _in_thread_(replay_journal, sim.sim_dir)
+
+    if state and state.get('host_daemon'):
+        daemon = await _host_daemon_(sim, state['host_daemon'])
+        if daemon:
+            results = await async_request(daemon, [{'op': 'stop', 'sim_dir': sim.sim_dir}])
+            if results[0].get('error'):
+                raise PrivHelperError(results[0]['error'])
+            return
+
+    sim._set_builder_from_state_(state)
+    builder = await _in_thread_(lambda: sim.builder)
+
+    with sim.tracer.span('stop'):
+        if not hasattr(builder, 'prepare_stop'):
+            await _in_thread_(builder.stop)
+            return
+
+        kill_pids = await _in_thread_(builder.prepare_stop, True)
+
+        launcher = AsyncLauncher(sim.sim_dir)
+        await launcher.kill(kill_pids)
+        await launcher.shutdown()
+
+        if hasattr(builder, 'clear_journal'):
+            await _in_thread_(builder.clear_journal)
+
+
+async def probe_ssh(port, timeout=5.0):
+    """
+    Function Name:      probe_ssh
+
+    Parameters:         port
+                         - Local port that is forwarded to the node's SSH port
+                        timeout
+                         - Seconds to wait for the SSH banner
+
+    Description:        Check if a node is ready.  QEMU accepts connections on
+                        a forwarded port before the guest is up, so the node
+                        is only ready once the SSH server sends its banner.
+
+    Returns:            Boolean
+    """
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+    try:
+        banner = await asyncio.wait_for(reader.readline(), timeout)
+    except (OSError, asyncio.TimeoutError):
+        banner = b''
+    finally:
+        writer.close()
+
+    return banner.startswith(b'SSH-')
+
+
+async def wait_ready_async(sim, timeout=600, nodes=None, interval=2.0):
+    """
+    Function Name:      wait_ready_async
+
+    Parameters:         sim
+                         - Running DotSimulator
+                        timeout
+                         - Seconds to wait for all of the nodes
+                        nodes
+                         - Names of the nodes to wait for, all by default
+                        interval
+                         - Seconds between checks of a node
+
+    Description:        Wait until every node answers on its forwarded SSH
+                        port.  A 'node_ready' event is emitted on the
+                        simulator's tracer for every node.  asyncio.TimeoutError
+                        is raised if the nodes aren't ready in time.
+
+    Returns:            dict
+                         - {node name: seconds until the node was ready}
+    """
+    state = await _in_thread_(read_state, sim.sim_dir)
+    if not state:
+        raise PrivHelperError('{0} isn\'t running'.format(sim.sim_dir))
+
+    start = time.time()
+    ready = {}
+
+    async def wait_node(name):
+        port = state['nodes'][name]['udp_ports'][ssh_port_index]
+        while not await probe_ssh(port, min(interval * 2, timeout)):
+            await asyncio.sleep(interval)
+
+        ready[name] = time.time() - start
+        sim.tracer.emit('node_ready', {'node': name, 'seconds': ready[name]})
+
+    names = nodes if nodes is not None else sorted(state['nodes'])
+    await asyncio.wait_for(asyncio.gather(*[wait_node(name) for name in names]), timeout)
+
+    return ready
+
+
+async def console_async(sim, commands, nodes=None, vm_type=None, limit=32, timeout=60.0):
+    """
+    Function Name:      console_async
+
+    Parameters:         sim
+                         - Running DotSimulator (and DotTopo)
+                        commands
+                         - Commands to run one after the other on every node
+                        nodes
+                         - Names of the nodes to run them on, all by default
+                        vm_type
+                         - Only run them on the nodes of this VM type
+                        limit
+                         - Most serial consoles that are open at the same time
+                        timeout
+                         - Seconds to wait for a login or command prompt
+
+    Description:        Run commands on the serial consoles of the nodes
+                        concurrently (see SerialConsole).  The login and
+                        prompts of every node come from its 'vm_type'.  Nodes
+                        whose console is captured by 'log_serial' are
+                        skipped, QEMU only lets one client connect to it.
+
+    Returns:            async generator
+                         - ConsoleResult of every command, as they arrive
+    """
+    state = await _in_thread_(read_state, sim.sim_dir)
+    if not state:
+        raise PrivHelperError('{0} isn\'t running'.format(sim.sim_dir))
+
+    vm_types = await _in_thread_(sim.get_attribute_column, 'vm_type')
+    log_serial = await _in_thread_(sim.get_attribute_column, 'log_serial')
+
+    targets = []
+    for name in (nodes if nodes is not None else sorted(state['nodes'])):
+        node_type = str(vm_types.get(name) or 'default').strip('"')
+        if vm_type and node_type != vm_type:
+            continue
+
+        if attribute_is_set(log_serial.get(name)):
+            log.warn('The serial console of {0} is logged, skipping it'.format(name))
+            continue
+
+        targets.append((name, state['nodes'][name]['udp_ports'][serial_port_index], node_type))
+
+    async for result in iter_console_results(targets, commands, limit, timeout):
+        yield result
+
+
+async def log_console_results(results):
+    """
+    Function Name:      log_console_results
+
+    Parameters:         results
+                         - ConsoleResults from 'console_async'
+
+    Description:        Log the results of the consoles as they arrive
+
+    Returns:            int
+                         - Number of nodes that failed
+    """
+    failed = 0
+    async for result in results:
+        if result.error:
+            failed += 1
+            log.error('{0}: {1}'.format(result.node, result.error))
+        else:
+            log.info('{0}: {1} ({2:.1f}s)\n{3}'.format(result.node, result.command, result.seconds,
+                                                       result.output.rstrip()))
+
+    return failed
+
+
+async def apply_async(sim):
+    """
+    Function Name:      apply_async
+
+    Parameters:         sim
+                         - DotSimulator (and DotTopo) to apply
+
+    Description:        Make the simulation in 'sim_dir' match the topology.
+                        Calling it again without changes does nothing.
+
+    Returns:            dict
+                         - 'action' is 'started', 'restarted', 'repaired' or
+                           'unchanged' and 'nodes' has the names of the nodes
+                           that were started
+    """
+    from simulator.utilities.LaunchPlan import LaunchPlan, topology_hash
+    from simulator.utilities.LogPump import get_log_paths
+
+    state = await _in_thread_(read_state, sim.sim_dir)
+    if not state:
+        await run_async(sim)
+        return {'action': 'started', 'nodes': [unquote_name(node.get_name()) for node in sim.get_nodes()]}
+
+    topo_hash = await _in_thread_(topology_hash, sim)
+    if state.get('topology_hash') != topo_hash:
+        log.info('The topology of {0} changed, restarting it'.format(sim.sim_dir))
+        await stop_async(sim)
+        await run_async(sim)
+        return {'action': 'restarted', 'nodes': [unquote_name(node.get_name()) for node in sim.get_nodes()]}
+
+    def find_exited():
+        import psutil
+        return [name for name, node in sorted(state['nodes'].items())
+                if not (node.get('pid') and psutil.pid_exists(node['pid']))]
+
+    exited = await _in_thread_(find_exited)
+    if not exited:
+        return {'action': 'unchanged', 'nodes': []}
+
+    # Start the nodes again from the launch plan, reusing their overlays
+    # and ports
+    plan = await _in_thread_(LaunchPlan.load, os.path.join(sim.sim_dir, 'plan.yaml'))
+    launcher = AsyncLauncher(sim.sim_dir, socket_path=state.get('host_daemon'))
+    await launcher.start()
+
+    logs_list = []
+    for name in exited:
+        logs = get_log_paths(sim.sim_dir, name)
+        del logs['serial']
+        logs_list.append(logs)
+
+    supervise_list = None
+    builder = await _in_thread_(lambda: sim.builder)
+    if hasattr(builder, 'get_supervise_settings'):
+        supervise_list = [builder.get_supervise_settings(sim.get_node_from_name(name), plan) for name in exited]
+
+    pids = await launcher.spawn([plan.get_restart_argv(name) for name in exited], logs_list=logs_list,
+                                supervise_list=supervise_list)
+
+    def set_pids(current):
+        for name, pid in zip(exited, pids):
+            current['nodes'][name]['pid'] = pid
+        return current
+
+    for name, pid in zip(exited, pids):
+        log.info('Started {0} again with PID {1}'.format(name, pid))
+    await _in_thread_(update_state, sim.sim_dir, set_pids)
+
+    return {'action': 'repaired', 'nodes': exited}
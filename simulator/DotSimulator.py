@@ -2,39 +2,31 @@
 # Written by Ken Yin
 
 import os
-import pydot
-import psutil
-import subprocess
-import importlib
-import pkgutil
-import inspect
-import apt
 import argparse
 import random
 import string
-from simulator.builders import BuilderBase, BuilderSelector
-from simulator.utilities.ImageDepot import ImageDepot
 from collections import OrderedDict
 #from logging import getLogger
 import logging
 import sys
 from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.Tracer import get_tracer
 
 log = getLogger(__name__)
 
 
 class DotSimulator(object):
+    """
+    Class Name:     DotSimulator
+    Description:    Starts and stops the simulation of a topology.  The
+                    simulation directory, image depot and builder are only
+                    created when a command needs them, so commands like
+                    '--info' and '--stop' start quickly.
+    """
     def __init__(self, **kwargs):
-        # Set the simulation directory
-        if 'sim_dir' in kwargs:
-            self.sim_dir = kwargs['sim_dir']
-        else:
-            unique_id = "".join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(5))
-            if not os.path.exists('/tmp/{0}'.format(os.getlogin())):
-                os.mkdir('/tmp/{0}'.format(os.getlogin()))
-
-            self.sim_dir = '/tmp/{0}/{1}-{2}/'.format(os.getlogin(), self.__class__.__name__, unique_id)
-            os.mkdir(self.sim_dir)
+        # Set the simulation directory.  If none is given, a new one is
+        # created the first time it is used.
+        self._sim_dir = kwargs.get('sim_dir')
 
         # Set the Image Depot directory
         if 'image_depot' in kwargs:
@@ -42,31 +34,370 @@ class DotSimulator(object):
         else:
             self.image_depot_dir = '/media/psf/image_depot'
 
-        self.image_depot = ImageDepot(self.image_depot_dir)
+        self._image_depot = None
+        self._builder = None
+
+        # Sample the resources used by the VMs every 'sample_interval'
+        # seconds once the simulation is running.  The samples are also
+        # served in the Prometheus text format if 'metrics_port' is set.
+        self.sample_interval = kwargs.get('sample_interval')
+        self.metrics_port = kwargs.get('metrics_port')
+
+        # Staged bring-up of the nodes, see BootOrder.  The node attributes
+        # 'boot_priority' and 'boot_root' are used if no strategy is given.
+        self.boot_strategy = kwargs.get('boot_strategy')
+        self.boot_roots = kwargs.get('boot_roots')
+        self.boot_stage_timeout = kwargs.get('boot_stage_timeout', 300)
+
+        # Use the per-host daemon if it is running.  Otherwise, everything
+        # is done in this process.
+        self.use_host_daemon = kwargs.get('use_host_daemon', True)
+        self.host_daemon_socket = kwargs.get('host_daemon_socket')
+
+        # Timed spans of every phase.  Use 'self.tracer.subscribe' to get
+        # the span events.
+        self.tracer = kwargs.get('tracer') or get_tracer()
+
+    @property
+    def sim_dir(self):
+        if not self._sim_dir:
+            unique_id = "".join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(5))
+            if not os.path.exists('/tmp/{0}'.format(os.getlogin())):
+                os.mkdir('/tmp/{0}'.format(os.getlogin()))
 
-        # The class inheriting DotSimulator should also be
-        # inheriting from DotTopo.  This is where self.graph
-        # is defined.
-        self.builder = BuilderSelector(self, self.sim_dir, self.image_depot).builder
+            self._sim_dir = '/tmp/{0}/{1}-{2}/'.format(os.getlogin(), self.__class__.__name__, unique_id)
+            os.mkdir(self._sim_dir)
+
+        return self._sim_dir
+
+    @sim_dir.setter
+    def sim_dir(self, sim_dir):
+        self._sim_dir = sim_dir
+
+        if self._builder:
+            self._builder.sim_dir = sim_dir
+
+    @property
+    def image_depot(self):
+        if self._image_depot is None:
+            from simulator.utilities.ImageDepot import ImageDepot
+
+            with self.tracer.span('image_depot_scan'):
+                self._image_depot = ImageDepot(self.image_depot_dir)
+
+        return self._image_depot
+
+    @property
+    def builder(self):
+        if self._builder is None:
+            from simulator.builders import BuilderSelector
+
+            # The class inheriting DotSimulator should also be
+            # inheriting from DotTopo.  This is where self.graph
+            # is defined.
+            image_depot = self.image_depot
+            with self.tracer.span('builder_select'):
+                self._builder = BuilderSelector(self, self.sim_dir, image_depot).builder
+            self._builder.tracer = self.tracer
+            self._apply_boot_settings_(self._builder)
+
+        return self._builder
 
     def configure(self):
         pass
 
-    def run(self):
-        self.builder.run()
+    def get_boot_settings(self):
+        return {'strategy': self.boot_strategy,
+                'roots': self.boot_roots,
+                'stage_timeout': self.boot_stage_timeout}
+
+    def _apply_boot_settings_(self, builder):
+        settings = self.get_boot_settings()
+        builder.boot_strategy = settings['strategy']
+        builder.boot_roots = settings['roots']
+        builder.boot_stage_timeout = settings['stage_timeout']
+
+    def plan(self):
+        with self.tracer.span('plan'):
+            return self.builder.plan()
+
+    def validate(self):
+        """
+        Method Name:    validate
+
+        Parameters:     None
+
+        Description:    Check the topology without starting it.  'run' and
+                        'plan' do the same checks and raise a
+                        TopologyValidationError with every problem.
+
+        Returns:        list
+                          - Problem for everything that is wrong with the
+                            topology, empty if it can be started
+        """
+        if not hasattr(self.builder, 'validate'):
+            return []
+
+        return self.builder.validate()
+
+    def write_trace(self):
+        """
+        Method Name:    write_trace
+
+        Parameters:     None
+
+        Description:    Write the collected spans as a Chrome trace into
+                        'trace.json' in the simulation directory and log a
+                        summary table of the phases.
+        """
+        self.tracer.export_chrome_trace(os.path.join(self.sim_dir, 'trace.json'))
+        log.info('Time spent in every phase:\n{0}'.format(self.tracer.summary()))
+
+    def _host_daemon_(self, socket_path=None):
+        """
+        Method Name:    _host_daemon_
+
+        Parameters:     socket_path
+                          - Socket of the daemon, if not the default one
+
+        Description:    Get a client for the host daemon
+
+        Returns:        HostDaemonClient
+                          - None if the daemon isn't used or isn't running
+        """
+        if not self.use_host_daemon:
+            return None
+
+        from simulator.utilities.HostDaemon import HostDaemonClient, host_daemon_socket
+
+        client = HostDaemonClient(socket_path or self.host_daemon_socket or host_daemon_socket)
+        return client if client.is_alive() else None
+
+    def run(self, resume=False):
+        """
+        Method Name:    run
+
+        Parameters:     resume
+                          - Continue a start of the simulation in 'sim_dir'
+                            that was interrupted, using its launch journal.
+                            The host daemon isn't used to resume.
+
+        Description:    Start the simulation
+        """
+        daemon = None if resume else self._host_daemon_()
+
+        with self.tracer.span('run'):
+            if resume:
+                self.builder.run(resume=True)
+            elif daemon:
+                log.debug('Starting the simulation with the host daemon {0}'.format(daemon.socket_path))
+                state = daemon.run(self, self.sim_dir, self.image_depot_dir, self.get_boot_settings())
+
+                for name, node_state in state['nodes'].items():
+                    node = self.graph.get_node(name)
+                    if node:
+                        node[0].set('pid', node_state['pid'])
+                        node[0].set('udp_ports', node_state['udp_ports'])
+            else:
+                self.builder.run()
+
+        if self.sample_interval or self.metrics_port:
+            self.start_sampler(self.sample_interval or 1.0, self.metrics_port)
+
+    def start_sampler(self, interval=1.0, port=None):
+        """
+        Method Name:    start_sampler
+
+        Parameters:     interval
+                          - Seconds between samples
+                        port
+                          - Local port to serve the samples on in the
+                            Prometheus text format, if any
+
+        Description:    Start sampling the CPU, RSS, disk I/O and context
+                        switches of every VM in the background.  The
+                        sampler stops by itself when the simulation is
+                        stopped.
+        """
+        from simulator.utilities.ResourceSampler import start_sampler_process
+
+        with self.tracer.span('sampler_start'):
+            start_sampler_process(self.sim_dir, interval, port)
+
+    def stats(self, history=False):
+        """
+        Method Name:    stats
+
+        Parameters:     history
+                          - Return every sample in the ring buffer instead
+                            of only the latest sample of every node
+
+        Description:    Get the resources used by the VMs of the simulation
+
+        Returns:        dict or list
+                          - {node name: sample} of the latest samples, or
+                            the list of all samples, oldest first.  A sample
+                            has the keys 'time', 'node', 'pid', 'cpu_percent',
+                            'rss', 'read_bytes', 'write_bytes' and
+                            'ctx_switches'.
+        """
+        from simulator.utilities.ResourceSampler import RingBuffer, latest_stats
+
+        if history:
+            return RingBuffer.read(self.sim_dir)
+
+        return latest_stats(self.sim_dir)
 
     def stop(self):
-        self.builder.stop()
+        """
+        Method Name:    stop
+
+        Parameters:     None
+
+        Description:    Stop the simulation in 'sim_dir'.  If the simulation
+                        was started by another process, the builder named in
+                        the state file is used without scanning the image
+                        depot or choosing a builder.  Simulations started by
+                        the host daemon are stopped by the daemon.
+        """
+        if self._builder is None:
+            from simulator.utilities.SimState import read_state
+            from simulator.utilities.LaunchJournal import replay_journal
+
+            # A start that was interrupted before the state file was
+            # written only has its journal
+            state = read_state(self.sim_dir) or replay_journal(self.sim_dir)
+
+            # Simulations started by the host daemon are stopped by it
+            daemon = self._host_daemon_(state['host_daemon']) if state and state.get('host_daemon') else None
+            if daemon:
+                with self.tracer.span('stop'):
+                    daemon.stop(self.sim_dir)
+                return
+
+            self._set_builder_from_state_(state)
+
+        with self.tracer.span('stop'):
+            self.builder.stop()
+
+    def _set_builder_from_state_(self, state):
+        # Use the builder that started the simulation, without scanning the
+        # image depot or choosing a builder
+        if self._builder is None and state and state.get('builder'):
+            from simulator.builders import get_builder_class
+
+            self._builder = get_builder_class(state['builder'])(self, self.sim_dir, None)
+            self._builder.tracer = self.tracer
+
+    def run_async(self):
+        """
+        Method Name:    run_async
+
+        Parameters:     None
+
+        Description:    Same as 'run' for asyncio (Python 3 only).  If the
+                        coroutine is cancelled, the nodes that were already
+                        started are stopped again.
+
+        Returns:        coroutine
+        """
+        from simulator.AsyncSimulator import run_async
+        return run_async(self)
+
+    def stop_async(self):
+        """
+        Method Name:    stop_async
+
+        Parameters:     None
+
+        Description:    Same as 'stop' for asyncio (Python 3 only)
+
+        Returns:        coroutine
+        """
+        from simulator.AsyncSimulator import stop_async
+        return stop_async(self)
+
+    def wait_ready_async(self, timeout=600, nodes=None, interval=2.0):
+        """
+        Method Name:    wait_ready_async
+
+        Parameters:     timeout
+                          - Seconds to wait for all of the nodes
+                        nodes
+                          - Names of the nodes to wait for, all by default
+                        interval
+                          - Seconds between checks of a node
+
+        Description:    Wait until the nodes answer on their forwarded SSH
+                        port (Python 3 only)
+
+        Returns:        coroutine
+                          - Resolves to {node name: seconds until ready}
+        """
+        from simulator.AsyncSimulator import wait_ready_async
+        return wait_ready_async(self, timeout, nodes, interval)
+
+    def console_async(self, commands, nodes=None, vm_type=None, limit=32, timeout=60.0):
+        """
+        Method Name:    console_async
+
+        Parameters:     commands
+                          - Commands to run one after the other on every node
+                        nodes
+                          - Names of the nodes to run them on, all by default
+                        vm_type
+                          - Only run them on the nodes of this VM type
+                        limit
+                          - Most serial consoles that are open at the same
+                            time
+                        timeout
+                          - Seconds to wait for a login or command prompt
+
+        Description:    Run commands on the serial consoles of the running
+                        nodes concurrently (Python 3 only)
+
+        Returns:        async generator
+                          - ConsoleResult of every command, as they arrive
+        """
+        from simulator.AsyncSimulator import console_async
+        return console_async(self, commands, nodes, vm_type, limit, timeout)
+
+    def apply_async(self):
+        """
+        Method Name:    apply_async
+
+        Parameters:     None
+
+        Description:    Make the simulation match the topology (Python 3
+                        only).  A simulation that isn't running is started,
+                        one whose topology changed is restarted and nodes
+                        whose VM exited are started again.
+
+        Returns:        coroutine
+                          - Resolves to {'action': ..., 'nodes': [names]}
+        """
+        from simulator.AsyncSimulator import apply_async
+        return apply_async(self)
 
     def run_from_cmdline(self):
         parser = argparse.ArgumentParser(description='Start/Stop PyDotSimulator')
 
         parser.add_argument('--info', action='store_true', help='Display the PyDot topology', default=None)
         parser.add_argument('--start', action='store_true', help='Start the PyDot topology', default=None)
+        parser.add_argument('--plan', action='store_true', help='Compile the launch plan without starting any VMs', default=None)
         parser.add_argument('--stop', action='store_true', help='Stop the PyDot topology', default=None)
+        parser.add_argument('--resume', action='store_true', help='With --start and --dir, continue a start that was interrupted', default=None)
+        parser.add_argument('--validate', action='store_true', help='Check the PyDot topology without starting it', default=None)
+        parser.add_argument('--stats', action='store_true', help='Show the resources used by the VMs of a running topology', default=None)
+        parser.add_argument('--sample-interval', help='Sample the resources used by the VMs every N seconds', type=float, default=None)
+        parser.add_argument('--metrics-port', help='Serve the resource samples in the Prometheus text format on this local port', type=int, default=None)
         parser.add_argument('--loglevel', help='Set the logging level of the output', choices=['DEBUG', 'INFO', 'WARN', 'ERROR'], default='INFO')
         parser.add_argument('--dir', help='Directory that the simulation run/stores info', default=None)
         parser.add_argument('--image-depot', help='Directory that stores all the base VM images', default=None)
+        parser.add_argument('--console', action='append', help='With --dir, run this command on the serial consoles of the nodes (Python 3 only, can be given more than once)', default=None)
+        parser.add_argument('--console-limit', help='Most serial consoles that --console opens at the same time', type=int, default=32)
+        parser.add_argument('--disk-profile', help='Disk profile of every node, e.g. \'ci\' for throwaway labs (see kvm_builder.disk_profiles)', default=None)
+        parser.add_argument('--no-host-daemon', action='store_true', help='Don\'t use the host daemon even if it is running', default=None)
 
         args = parser.parse_args()
 
@@ -86,24 +417,76 @@ class DotSimulator(object):
 
         if args.image_depot:
             if os.path.exists(args.image_depot):
-                self.image_depot = args.image_depot
+                self.image_depot_dir = args.image_depot
+                self._image_depot = None
             else:
                 log.info('The image depot {0} isn\'t a directory'.format(args.image_depot))
                 sys.exit(1)
 
+        if args.no_host_daemon:
+            self.use_host_daemon = False
+
+        if args.disk_profile:
+            self.set_attribute_column('disk_profile', args.disk_profile)
+
+        if args.sample_interval:
+            self.sample_interval = args.sample_interval
+
+        if args.metrics_port:
+            self.metrics_port = args.metrics_port
+
         if args.info:
-            log.info(self.show())
+            self.show()
+
+        if args.validate:
+            problems = self.validate()
+            for problem in problems:
+                log.error(problem.message)
+
+            if problems:
+                sys.exit(1)
+            log.info('The topology is valid')
+
+        if args.plan and (not args.start) and (not args.stop):
+            log.debug("Compiling the launch plan in the directory: {0}".format(self.sim_dir))
+            log.info(self.plan().dump())
+        elif args.start and (not args.stop):
+            if args.resume:
+                if not args.dir:
+                    log.info('--resume needs the --dir of the simulation to resume')
+                    sys.exit(1)
+
+                self.sim_dir = args.dir if args.dir.endswith('/') else args.dir + '/'
 
-        if args.start and (not args.stop):
             log.debug("Starting Simulation in the directory: {0}".format(self.sim_dir))
-            self.run()
+            self.run(resume=bool(args.resume))
+            self.write_trace()
         elif args.stop and (not args.start) and args.dir:
             log.debug('Stopping Simultion in {0}'.format(args.dir))
-            self.sim_dir = args.dir
+            sim_dir = args.dir
 
             # Check if the simulation directory ends with '/'
-            if not self.sim_dir.endswith('/'):
-                self.sim_dir += '/'
+            if not sim_dir.endswith('/'):
+                sim_dir += '/'
 
-            self.builder.sim_dir = self.sim_dir
+            self.sim_dir = sim_dir
             self.stop()
+            self.write_trace()
+        elif args.stats and args.dir:
+            self.sim_dir = args.dir
+            for node, sample in sorted(self.stats().items()):
+                log.info('{0:24s} pid {1:7d} cpu {2:6.1f}% rss {3:8.1f} MB read {4} B written {5} B ctx switches {6}'.format(
+                         node, sample['pid'], sample['cpu_percent'], sample['rss'] / 1048576.0,
+                         sample['read_bytes'], sample['write_bytes'], sample['ctx_switches']))
+        elif args.console and args.dir:
+            self.sim_dir = args.dir if args.dir.endswith('/') else args.dir + '/'
+            if sys.version_info[0] < 3:
+                log.info('--console needs Python 3')
+                sys.exit(1)
+
+            import asyncio
+            from simulator.AsyncSimulator import log_console_results
+
+            results = self.console_async(args.console, limit=args.console_limit)
+            if asyncio.get_event_loop().run_until_complete(log_console_results(results)):
+                sys.exit(1)
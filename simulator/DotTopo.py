@@ -3,11 +3,15 @@
 
 import pydot
 import os
+import sys
 import argparse
 from collections import OrderedDict
 #from logging import getLogger
 import logging
 from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.Tracer import get_tracer
+from simulator.utilities.TopoStream import write_topology, read_topology, iter_nodes, iter_edges, default_statements, \
+                                           unquote_end
 
 log = getLogger(__name__)
 
@@ -15,10 +19,13 @@ known_node_attributes = set(['vm_type', 'bridge', 'bond'])
 
 class DotTopo(object):
     def __init__(self, graph=None):
+        self._query_ = None
+
         if graph and isinstance(graph, pydot.Dot):
             self.graph = graph
         elif graph and isinstance(graph, str):
-            self.graph = pydot.graph_from_dot_data(graph)
+            with get_tracer().span('dot_parse'):
+                self.graph = pydot.graph_from_dot_data(graph)
             if self.graph:
                 self.graph = self.graph[0]
 
@@ -89,6 +96,10 @@ class DotTopo(object):
         not_set = 0
         for node in nodes:
             node_id = node.get('id')
+            if isinstance(node_id, str) and node_id.isdigit():
+                # IDs read from a DOT string are strings
+                node_id = int(node_id)
+
             if ((node_id == 0) or node_id) and (node_id >= idx):
                 idx = node_id + 1
             elif node_id == None:
@@ -176,7 +187,8 @@ class DotTopo(object):
             for edge in edges:
                 src = edge.get_source()
                 dst = edge.get_destination()
-                if (node.get_name() in src) or (node.get_name in dst):
+                if (node.get_name() == src.split(':')[0]) or \
+                   (node.get_name() == dst.split(':')[0]):
                     self.graph.del_edge(src, dst)
 
         return self.graph.del_node(node_name)
@@ -203,6 +215,7 @@ class DotTopo(object):
         if not labels:
             labels = intf_name
         else:
+            labels = labels.strip('"')
             intfs = labels.split('|')
             if intf_name not in intfs:
                 # Add this label to the node
@@ -263,7 +276,11 @@ class DotTopo(object):
         node = nodes[0]
         labels = node.get_label()
 
-        return labels.split('|')
+        if not labels:
+            return []
+
+        # pydot quotes labels with '|' in them when they are parsed
+        return labels.strip('"').split('|')
 
     def add_link(self, local_node, local_intf, remote_node, remote_intf, 
                  **kwargs):
@@ -285,6 +302,10 @@ class DotTopo(object):
         # TODO: Find the edge in all the associated nodes and remove the edge
         edge = self.get_links(local_node, local_intf, remote_node, remote_intf)
         if edge:
+            # Deleting one of several parallel links doesn't change the
+            # signature of the graph
+            self.invalidate_query()
+
             # Delete edge from the graph
             return self.graph.del_edge('{0}:{1}'.format(local_node, local_intf),
                                        dst='{0}:{1}'.format(remote_node, remote_intf))
@@ -332,9 +353,266 @@ class DotTopo(object):
 
         return links
 
+    def _select_nodes_(self, select=None, vm_type=None):
+        # (name, attributes) of the selected nodes, in the order of the graph
+        for name, attributes in iter_nodes(self.graph):
+            if name in default_statements:
+                continue
+
+            if vm_type is not None and str(attributes.get('vm_type', '')).strip('"') != vm_type:
+                continue
+
+            if select is not None and not select(name, attributes):
+                continue
+
+            yield name, attributes
+
+    def _select_links_(self, select=None):
+        for source, destination, attributes in iter_edges(self.graph):
+            if select is None or select(source, destination, attributes):
+                yield (source, destination), attributes
+
+    def _set_column_(self, rows, name, values, kind):
+        # 'rows' are (key, attributes) of the selected nodes or links.  The
+        # values are written straight into the attribute dictionaries of the
+        # graph, which is where pydot itself keeps them.
+        count = 0
+
+        if isinstance(values, dict):
+            # Parallel links have the same key
+            selected = {}
+            for key, attributes in rows:
+                selected.setdefault(key, []).append(attributes)
+
+            unknown = [key for key in values if key not in selected]
+            if unknown:
+                raise ValueError('No selected {0} for {1}'.format(kind, ', '.join(str(key) for key in unknown[:5])))
+
+            for key, value in values.items():
+                for attributes in selected[key]:
+                    attributes[name] = value
+                    count += 1
+        elif isinstance(values, (list, tuple)):
+            rows = list(rows)
+            if len(rows) != len(values):
+                raise ValueError('{0} values were given for {1} selected {2}s'.format(len(values), len(rows), kind))
+
+            for (_, attributes), value in zip(rows, values):
+                attributes[name] = value
+                count += 1
+        else:
+            for _, attributes in rows:
+                attributes[name] = values
+                count += 1
+
+        return count
+
+    def get_attribute_column(self, name, default=None, select=None, vm_type=None):
+        """
+        Method Name:    get_attribute_column
+                          - Get one attribute of many nodes at once
+
+        Parameters:     name
+                          - Name of the attribute
+                        default
+                          - Value for the nodes that don't have the attribute
+                        select
+                          - Function that is called with the name and the
+                            attributes of every node, only the nodes that it
+                            returns True for are selected
+                        vm_type
+                          - Only select the nodes with this vm_type
+
+        Description:    The attributes are read from the graph without
+                        creating a pydot.Node for every node, so it is much
+                        faster than calling 'get' on every node.  Values that
+                        were parsed from a DOT string are strings and may be
+                        quoted, the same as 'get' returns them.
+
+        Returns:        OrderedDict
+                          - {node name: value} in the order of the graph
+        """
+        return OrderedDict((node, attributes.get(name, default))
+                           for node, attributes in self._select_nodes_(select, vm_type))
+
+    def set_attribute_column(self, name, values, select=None, vm_type=None):
+        """
+        Method Name:    set_attribute_column
+                          - Set one attribute of many nodes at once
+
+        Parameters:     name
+                          - Name of the attribute
+                        values
+                          - {node name: value}, a list with a value for every
+                            selected node (in the order of the graph) or one
+                            value for all of them
+                        select
+                          - See 'get_attribute_column'
+                        vm_type
+                          - See 'get_attribute_column'
+
+        Returns:        int
+                          - Number of nodes that were set
+        """
+        return self._set_column_(self._select_nodes_(select, vm_type), name, values, 'node')
+
+    def get_link_attribute_column(self, name, default=None, select=None):
+        """
+        Method Name:    get_link_attribute_column
+                          - Get one attribute of many links at once
+
+        Parameters:     name
+                          - Name of the attribute
+                        default
+                          - Value for the links that don't have the attribute
+                        select
+                          - Function that is called with the source,
+                            destination and attributes of every link, only
+                            the links that it returns True for are selected
+
+        Returns:        OrderedDict
+                          - {('node:interface', 'node:interface'): value} in
+                            the order of the graph, the names are without
+                            quotes.  Parallel links have the same key, the
+                            value of the last one is returned.
+        """
+        return OrderedDict((link, attributes.get(name, default))
+                           for link, attributes in self._select_links_(select))
+
+    def set_link_attribute_column(self, name, values, select=None):
+        """
+        Method Name:    set_link_attribute_column
+                          - Set one attribute of many links at once
+
+        Parameters:     name
+                          - Name of the attribute
+                        values
+                          - {(source, destination): value}, a list with a
+                            value for every selected link or one value for
+                            all of them.  The ends may be quoted the way
+                            'edge.get_source()' has them.
+                        select
+                          - See 'get_link_attribute_column'
+
+        Returns:        int
+                          - Number of links that were set
+        """
+        if isinstance(values, dict):
+            values = dict(((unquote_end(source), unquote_end(destination)), value)
+                          for (source, destination), value in values.items())
+
+        return self._set_column_(self._select_links_(select), name, values, 'link')
+
+    def add_template_instance(self, template, prefix, id_offset=None, index=0, boundary=None):
+        """
+        Method Name:    add_template_instance
+                          - Add one instance of a TopoTemplate
+
+        Parameters:     template
+                          - TopoTemplate to add
+                        prefix
+                          - Prefix of the node names of the instance
+                        id_offset
+                          - ID of the first node of the instance.  The next
+                            unused node ID by default.
+                        index
+                          - Index of the instance, used to format the
+                            boundary links
+                        boundary
+                          - Boundary links, the template's by default
+
+        Returns:        dict
+                          - {template node name: instance node name}
+        """
+        if id_offset is None:
+            id_offset = self.get_next_node_id()
+
+        with get_tracer().span('template_instance', template=template.name):
+            return template.instantiate(self, prefix, id_offset, index, boundary)
+
+    def replicate_template(self, template, count, prefix=None, id_offset=None, start=0, boundary=None):
+        """
+        Method Name:    replicate_template
+                          - Add 'count' instances of a TopoTemplate
+
+        Parameters:     template
+                          - TopoTemplate to add
+                        count
+                          - Number of instances
+                        prefix
+                          - Format of the prefix of the node names, with
+                            'name' (of the template) and 'index'.  By default
+                            the names of instance 3 of the template 'pod'
+                            start with 'pod3_'.
+                        id_offset
+                          - ID of the first node of the first instance.  The
+                            next unused node ID by default.
+                        start
+                          - Index of the first instance
+                        boundary
+                          - Boundary links, the template's by default
+
+        Returns:        list
+                          - {template node name: instance node name} of every
+                            instance
+        """
+        if id_offset is None:
+            id_offset = self.get_next_node_id()
+
+        instances = []
+        with get_tracer().span('replicate_template', template=template.name, count=count):
+            for index in range(start, start + count):
+                if prefix is None:
+                    instance_prefix = template.get_prefix(index)
+                else:
+                    instance_prefix = prefix.format(name=template.name, index=index)
+
+                instances.append(template.instantiate(self, instance_prefix, id_offset, index, boundary))
+                id_offset += template.id_span
+
+        return instances
+
+    @property
+    def query(self):
+        """
+        Method Name:    query
+                          - GraphQuery of the current graph
+
+        Parameters:     None
+
+        Description:    The adjacency is only built the first time it is
+                        needed and is reused until nodes or links are added
+                        or deleted (or the graph is replaced), so it is cheap
+                        to use in loops over the nodes, e.g.
+
+                            for node in names:
+                                topo.query.neighbors(node)
+
+        Returns:        GraphQuery
+        """
+        # Only the commands that query the graph pay for importing it
+        from simulator.utilities.GraphQuery import GraphQuery, graph_signature
+
+        signature = graph_signature(self.graph)
+        cached = getattr(self, '_query_', None)
+
+        if not cached or cached[0] is not self.graph or cached[1] != signature:
+            with get_tracer().span('graph_query_index'):
+                cached = self._query_ = (self.graph, signature, GraphQuery(self.graph))
+
+        return cached[2]
+
+    def invalidate_query(self):
+        self._query_ = None
+
     def get_node_from_name(self, node_name):
         nodes = self.graph.get_node(node_name)
 
+        # The builders name the nodes without the quotes that pydot may
+        # have kept from the DOT file
+        if not nodes and not node_name.startswith('"'):
+            nodes = self.graph.get_node('"{0}"'.format(node_name))
+
         if nodes:
             return nodes[0]
         else:
@@ -343,8 +621,39 @@ class DotTopo(object):
     def get_nodes(self):
         return self.graph.get_nodes()
 
-    def write_to_file(self):
-        pass
+    def write_to_file(self, path, fmt=None, compress=None):
+        """
+        Method Name:    write_to_file
+                          - Write the topology a node and an edge at a time
+
+        Parameters:     path
+                          - File name or binary file object
+                        fmt
+                          - 'dot', 'jsonl' or 'bin'.  By default it is worked
+                            out from the file name (e.g. 'fabric.jsonl.gz').
+                        compress
+                          - gzip the output.  By default only file names
+                            that end with '.gz' are.
+        """
+        with get_tracer().span('write_topology'):
+            write_topology(self, path, fmt, compress)
+
+    def read_from_file(self, path, fmt=None, compress=None):
+        """
+        Method Name:    read_from_file
+                          - Replace the graph with one that 'write_to_file'
+                            wrote
+
+        Parameters:     path
+                          - File name or binary file object
+                        fmt
+                          - 'dot', 'jsonl' or 'bin', see 'write_to_file'
+                        compress
+                          - The input is gzipped, see 'write_to_file'
+        """
+        with get_tracer().span('read_topology'):
+            self.graph = read_topology(path, fmt, compress).graph
 
-    def show(self):
-        print self.graph.to_string()
+    def show(self, fmt='dot'):
+        sys.stdout.flush()
+        write_topology(self, getattr(sys.stdout, 'buffer', sys.stdout), fmt, compress=False)
@@ -0,0 +1,8 @@
+#!/usr/bin/env python
+# Example of running the benchmarks:
+#     python -m simulator.benchmarks --sizes 100,1000 --baseline bench_baseline.json
+
+import sys
+from simulator.benchmarks.suite import main
+
+sys.exit(main())
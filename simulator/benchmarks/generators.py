@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import os
+import random
+import shutil
+import tempfile
+import logging
+from simulator.utilities.LogWrapper import getLogger
+
+log = getLogger(__name__)
+
+default_vm_types = ['cumulus', 'arista', 'cisco']
+
+
+def generate_topology_str(num_nodes, degree=4, seed=0, vm_types=None):
+    """
+    Function Name:      generate_topology_str
+
+    Parameters:         num_nodes
+                         - Number of nodes in the generated topology
+                        degree
+                         - Average number of links per node
+                        seed
+                         - Seed for the random generator so that the
+                           same topology is produced on every run
+                        vm_types
+                         - List of VM types to spread over the nodes
+
+    Description:        Build a synthetic pydot topology string.  Every node
+                        is first chained to the previous one so the graph is
+                        connected, then random links are added until the
+                        average degree is reached.  The interfaces of every
+                        node are written into its label the same way a user
+                        topology would have them.
+
+    Returns:            str
+                         - The DOT formatted topology
+    """
+    rand = random.Random(seed)
+    vm_types = vm_types or default_vm_types
+
+    intfs = [[] for _ in range(num_nodes)]
+    edges = []
+
+    def _link(a, b):
+        a_intf = 'swp{0}'.format(len(intfs[a]) + 1)
+        b_intf = 'swp{0}'.format(len(intfs[b]) + 1)
+        intfs[a].append(a_intf)
+        intfs[b].append(b_intf)
+        edges.append('n{0}:{1} -- n{2}:{3};'.format(a, a_intf, b, b_intf))
+
+    for i in range(1, num_nodes):
+        _link(rand.randrange(max(0, i - degree), i), i)
+
+    num_edges = (num_nodes * degree) // 2
+    while num_nodes > 1 and len(edges) < num_edges:
+        a = rand.randrange(num_nodes)
+        b = rand.randrange(num_nodes)
+        if a != b:
+            _link(a, b)
+
+    lines = ['graph G {']
+    for i in range(num_nodes):
+        lines.append('n{0} [label="{1}", id={2}, vm_type={3}];'.format(
+                     i, '|'.join(intfs[i]), i + 1, vm_types[i % len(vm_types)]))
+    lines += edges
+    lines.append('}')
+
+    return '\n'.join(lines)
+
+
+def generate_topology(num_nodes, degree=4, seed=0, vm_types=None):
+    """
+    Function Name:      generate_topology
+
+    Parameters:         See generate_topology_str
+
+    Description:        Build a synthetic DotTopo instance
+
+    Returns:            DotTopo
+    """
+    from simulator.DotTopo import DotTopo
+
+    return DotTopo(graph=generate_topology_str(num_nodes, degree, seed, vm_types))
+
+
+class FakeImageDepot(object):
+    """
+    Class Name:         FakeImageDepot
+    Description:        Creates an image depot tree in a temporary directory
+                        with the same layout as a real depot
+                        (<depot>/<vm type>/<version>/<image>.qcow2).  The
+                        images are empty files, which is all the ImageDepot
+                        scans need.  Can be used as a context manager, the
+                        tree is removed on exit.
+    """
+    def __init__(self, vm_types=None, versions=3, extra_files=10):
+        self.vm_types = vm_types or default_vm_types
+        self.versions = versions
+        self.extra_files = extra_files
+        self.depot = None
+
+    def create(self):
+        self.depot = tempfile.mkdtemp(prefix='pydotsim-depot-')
+
+        for vm_type in self.vm_types:
+            for v in range(self.versions):
+                version_dir = os.path.join(self.depot, vm_type, '1.0.{0}'.format(v))
+                os.makedirs(version_dir)
+
+                # Files that aren't images make the scans do some real work
+                for i in range(self.extra_files):
+                    open(os.path.join(version_dir, 'notes{0}.txt'.format(i)), 'w').close()
+
+                open(os.path.join(version_dir, '{0}.qcow2'.format(vm_type)), 'w').close()
+
+        log.debug('Created fake image depot in {0}'.format(self.depot))
+        return self.depot
+
+    def images(self):
+        return ['{0}-1.0.{1}'.format(vm_type, v)
+                for vm_type in self.vm_types for v in range(self.versions)]
+
+    def remove(self):
+        if self.depot and os.path.exists(self.depot):
+            shutil.rmtree(self.depot)
+        self.depot = None
+
+    def __enter__(self):
+        self.create()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.remove()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import shutil
+import timeit
+import platform
+import argparse
+import tempfile
+import logging
+from simulator.benchmarks.generators import generate_topology_str, FakeImageDepot
+from simulator.utilities.LogWrapper import getLogger
+
+log = getLogger(__name__)
+
+default_sizes = [100, 1000, 10000]
+default_degree = 4
+
+
+def time_call(func, repeat=5, setup=None):
+    """
+    Function Name:      time_call
+
+    Parameters:         func
+                         - Callable to be timed.  It is passed the value
+                           returned by 'setup'
+                        repeat
+                         - Number of times to run 'func'
+                        setup
+                         - Optional callable run (untimed) before every call
+
+    Description:        Time a callable a number of times and return the
+                        statistics of the runs in seconds
+
+    Returns:            dict
+                         - 'min', 'median', 'mean', 'max' and 'repeat'
+    """
+    samples = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = timeit.default_timer()
+        func(arg)
+        samples.append(timeit.default_timer() - start)
+
+    samples.sort()
+    return {'min': samples[0],
+            'median': samples[len(samples) // 2],
+            'mean': sum(samples) / len(samples),
+            'max': samples[-1],
+            'repeat': repeat}
+
+
+class BenchmarkSuite(object):
+    """
+    Class Name:         BenchmarkSuite
+    Description:        Micro-benchmarks for the hot paths of the simulator:
+                        DOT parsing, topology mutation, link queries, UDP port
+                        allocation, image depot scans and KVM command line
+                        generation.  Synthetic topologies are generated for
+                        every size in 'sizes' so scale regressions show up
+                        as well.
+    """
+    def __init__(self, sizes=None, degree=default_degree, repeat=5):
+        self.sizes = sizes or default_sizes
+        self.degree = degree
+        self.repeat = repeat
+        self.results = {}
+        self.work_dir = None
+
+    def record(self, name, stats):
+        log.info('{0:40s} median {1:10.6f}s  min {2:10.6f}s'.format(name, stats['median'], stats['min']))
+        self.results[name] = stats
+
+    def bench_topology(self, size):
+        from simulator.DotTopo import DotTopo
+
+        topo_str = generate_topology_str(size, self.degree)
+        self.record('parse.{0}'.format(size),
+                    time_call(lambda _: DotTopo(graph=topo_str), repeat=self.repeat))
+
+        topo = DotTopo(graph=topo_str)
+        names = [node.get_name() for node in topo.get_nodes()]
+        probe = names[::max(1, len(names) // 20)]
+
+        self.record('get_links_for_node.{0}'.format(size),
+                    time_call(lambda _: [topo.get_links_for_node(n) for n in probe],
+                              repeat=self.repeat))
+        self.record('get_links.{0}'.format(size),
+                    time_call(lambda _: [topo.get_links(a, b) for a, b in zip(probe, probe[1:])],
+                              repeat=self.repeat))
+        self.record('get_interfaces.{0}'.format(size),
+                    time_call(lambda _: [topo.get_interfaces(n) for n in probe],
+                              repeat=self.repeat))
+
+        def _mutate(_):
+            for i in range(10):
+                name = 'bench{0}'.format(i)
+                topo.add_node(name)
+                topo.add_interface(name, 'swp1')
+                topo.add_interface(names[i], 'bench{0}'.format(i))
+                topo.add_link(name, 'swp1', names[i], 'bench{0}'.format(i))
+
+            for i in range(10):
+                topo.delete_interface(names[i], 'bench{0}'.format(i))
+                topo.delete_link('bench{0}'.format(i), 'swp1', names[i], 'bench{0}'.format(i))
+                topo.delete_node('bench{0}'.format(i))
+
+        self.record('mutation.{0}'.format(size), time_call(_mutate, repeat=self.repeat))
+
+        return topo
+
+    def bench_ports(self, size):
+        from simulator.utilities.PortResourceCheck import PortResourceCheck
+
+        port_dir = os.path.join(self.work_dir, 'port_check_{0}'.format(size))
+        start = 40000
+
+        def _setup():
+            if os.path.exists(port_dir):
+                shutil.rmtree(port_dir)
+
+        self.record('ports.scan_new.{0}'.format(size),
+                    time_call(lambda _: PortResourceCheck(start, start + size - 1, directory=port_dir).scan(),
+                              repeat=self.repeat, setup=_setup))
+        self.record('ports.scan_existing.{0}'.format(size),
+                    time_call(lambda _: PortResourceCheck(start, start + size - 1, directory=port_dir).scan(),
+                              repeat=self.repeat))
+
+        port_check = PortResourceCheck(start, start + size - 1, directory=port_dir)
+        sim_dir = os.path.join(self.work_dir, 'sim')
+
+        def _alloc_release(_):
+            ports = port_check.get_free_ports(size // 2, sim_dir=sim_dir)
+            port_check.release_port(ports, sim_dir=sim_dir)
+
+        self.record('ports.alloc_release.{0}'.format(size),
+                    time_call(_alloc_release, repeat=self.repeat))
+
+    def bench_image_depot(self):
+        from simulator.utilities.ImageDepot import ImageDepot
+
+        with FakeImageDepot(vm_types=['type{0}'.format(i) for i in range(20)]) as fake:
+            self.record('image_depot.scan',
+                        time_call(lambda _: ImageDepot(fake.depot), repeat=self.repeat))
+
+            depot = ImageDepot(fake.depot)
+            images = fake.images()
+            self.record('image_depot.get_qcow2_image',
+                        time_call(lambda _: [depot.get_qcow2_image(i) for i in images],
+                                  repeat=self.repeat))
+
+    def bench_kvm_cmdline(self, topo, size):
+        from simulator.builders import kvm_builder
+
+        sim_dir = os.path.join(self.work_dir, 'cmdline_{0}'.format(size))
+        os.mkdir(sim_dir)
+        nodes = topo.get_nodes()[:100]
+
+        def _build(_):
+            port = 1
+            for node in nodes:
+                links = topo.get_links_for_node(node.get_name())
+                num_ports = len(links) + kvm_builder.base_ports
+                vm = kvm_builder.CumulusVmType(ports=list(range(port, port + num_ports)),
+                                               links=links,
+                                               name=node.get_name(),
+                                               node_id=int(str(node.get('id')).strip('"')),
+                                               base_sim_dir=sim_dir,
+                                               base_image='/dev/null')
+                vm.build_kvm_cmdline()
+                port += num_ports
+
+        self.record('kvm_cmdline.{0}'.format(size), time_call(_build, repeat=self.repeat))
+
+    def run(self):
+        self.work_dir = tempfile.mkdtemp(prefix='pydotsim-bench-')
+        try:
+            self.bench_image_depot()
+            for size in self.sizes:
+                topo = self.bench_topology(size)
+                self.bench_ports(size)
+                self.bench_kvm_cmdline(topo, size)
+        finally:
+            shutil.rmtree(self.work_dir)
+            self.work_dir = None
+
+        return self.results
+
+    def to_dict(self):
+        return {'meta': {'python': platform.python_version(),
+                         'platform': platform.platform(),
+                         'timestamp': time.time(),
+                         'sizes': self.sizes,
+                         'degree': self.degree,
+                         'repeat': self.repeat},
+                'results': self.results}
+
+    def write_results(self, path):
+        with open(path, 'w') as stream:
+            json.dump(self.to_dict(), stream, indent=2, sort_keys=True)
+
+
+def compare_to_baseline(results, baseline, threshold=0.2):
+    """
+    Function Name:      compare_to_baseline
+
+    Parameters:         results
+                         - The 'results' dictionary of the current run
+                        baseline
+                         - The 'results' dictionary of the stored baseline
+                        threshold
+                         - Allowed slowdown as a fraction of the baseline
+                           median (0.2 == 20% slower)
+
+    Description:        Compare the medians of the current run against the
+                        baseline.  Benchmarks that are missing in either run
+                        are ignored.
+
+    Returns:            list
+                         - (name, baseline median, current median, ratio) for
+                           every benchmark that regressed
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+
+        base = baseline[name]['median']
+        current = results[name]['median']
+        if base > 0 and current > base * (1 + threshold):
+            regressions.append((name, base, current, current / base))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the PyDotSimulator micro-benchmarks')
+    parser.add_argument('--sizes', help='Comma separated list of topology sizes',
+                        default=','.join(str(s) for s in default_sizes))
+    parser.add_argument('--degree', help='Average number of links per node', type=int, default=default_degree)
+    parser.add_argument('--repeat', help='Number of times to run every benchmark', type=int, default=5)
+    parser.add_argument('--output', help='File to write the JSON results to', default='bench_output.json')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare against', default=None)
+    parser.add_argument('--threshold', help='Allowed slowdown against the baseline (0.2 == 20%%)',
+                        type=float, default=0.2)
+    parser.add_argument('--loglevel', help='Set the logging level of the output',
+                        choices=['DEBUG', 'INFO', 'WARN', 'ERROR'], default='INFO')
+
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(getattr(logging, args.loglevel))
+
+    suite = BenchmarkSuite(sizes=[int(s) for s in args.sizes.split(',')],
+                           degree=args.degree, repeat=args.repeat)
+    suite.run()
+    suite.write_results(args.output)
+    log.info('Results written to {0}'.format(args.output))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as stream:
+            baseline = json.load(stream)['results']
+
+        regressions = compare_to_baseline(suite.results, baseline, args.threshold)
+        for name, base, current, ratio in regressions:
+            log.error('{0} regressed: {1:.6f}s -> {2:.6f}s ({3:.2f}x)'.format(name, base, current, ratio))
+
+        if regressions:
+            return 1
+
+        log.info('No regressions against {0}'.format(args.baseline))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,17 +1,52 @@
 #!/usr/bin/env python
 
 import os
-import pkgutil
-import inspect
-import apt
-import subprocess
+import json
+import time
+import socket
+import tempfile
+import platform
 import importlib
+import logging
+from simulator.utilities.LogWrapper import getLogger
+
+log = getLogger(__name__)
+
+# Registry of the VM builders.  The builder modules are only imported when
+# they are needed, so every builder has to be listed here.  The builder that
+# has the lowest preference and is supported will be the one that is chosen.
+#
+# A node asks for a builder with its 'builder' attribute, or with a
+# 'vm_type' in the 'vm_types' of a builder.  Then only the builders that
+# can run every node that asked for one are chosen from, a builder runs its
+# own nodes and the nodes of the builders in its 'runs'.
+builder_registry = [
+    {'name':        'kvm',
+     'module':      'simulator.builders.kvm_builder',
+     'class':       'KvmBuilder',
+     'preference':  10},
+    {'name':        'netns',
+     'module':      'simulator.builders.netns_builder',
+     'class':       'NetnsBuilder',
+     'preference':  20,
+     'vm_types':    ['host', 'netns'],
+     'runs':        ['kvm']},
+]
+
+# Results of 'is_builder_supported' are cached per host in this file.  Every
+# user has their own, the host daemon runs as root.
+support_cache_file = '/tmp/builder_support-{0}.json'.format(os.getuid())
+support_cache_ttl = 24 * 60 * 60
 
 
 class NoBuildersSupported(Exception):
     pass
 
 
+class UnknownBuilder(Exception):
+    pass
+
+
 class BuilderBase(object):
     """
     Class:          BuilderBase
@@ -28,46 +63,161 @@ class BuilderBase(object):
         raise NotImplemented('"is_builder_supported" wasn\'t implemented!')
 
 
+def get_builder_class(name):
+    """
+    Function Name:      get_builder_class
+
+    Parameters:         name
+                         - Name of the builder in the 'builder_registry'
+
+    Description:        Import the module of a single builder and return
+                        the builder class
+
+    Returns:            BuilderBase sub-class
+    """
+    for entry in builder_registry:
+        if entry['name'] == name:
+            return getattr(importlib.import_module(entry['module']), entry['class'])
+
+    raise UnknownBuilder('No builder named {0} is registered'.format(name))
+
+
+def get_requested_builders(graph):
+    """
+    Function Name:      get_requested_builders
+
+    Parameters:         graph
+                         - Topology (DotTopo)
+
+    Description:        Builders that the nodes of the topology ask for,
+                        with their 'builder' attribute or their 'vm_type'
+
+    Returns:            set
+                         - Names of the builders
+    """
+    vm_type_builders = {}
+    for entry in builder_registry:
+        for vm_type in entry.get('vm_types', []):
+            vm_type_builders[vm_type] = entry['name']
+
+    vm_types = graph.get_attribute_column('vm_type')
+    requested = set()
+
+    for name, builder in graph.get_attribute_column('builder').items():
+        if builder is not None:
+            requested.add(str(builder).strip('"'))
+        elif vm_types[name] is not None and str(vm_types[name]).strip('"') in vm_type_builders:
+            requested.add(vm_type_builders[str(vm_types[name]).strip('"')])
+
+    known = set(entry['name'] for entry in builder_registry)
+    if requested - known:
+        raise UnknownBuilder('The topology asks for the unknown builder(s) {0}'.format(
+                             ', '.join(sorted(requested - known))))
+
+    return requested
+
+
+def select_builder_class(graph, use_cache=True):
+    """
+    Function Name:      select_builder_class
+
+    Parameters:         graph
+                         - Topology (DotTopo)
+                        use_cache
+                         - Use the cached results of 'is_builder_supported'
+
+    Description:        Pick the supported builder with the lowest preference
+                        that can run every node of the topology
+
+    Returns:            BuilderBase sub-class
+    """
+    cache = BuilderSupportCache() if use_cache else None
+    requested = get_requested_builders(graph)
+
+    for entry in sorted(builder_registry, key=lambda _entry: _entry['preference']):
+        if requested - set([entry['name']] + entry.get('runs', [])):
+            continue
+
+        supported = cache.get(entry['name']) if cache else None
+        if supported is False:
+            log.debug('Builder {0} is cached as not supported'.format(entry['name']))
+            continue
+
+        builder = get_builder_class(entry['name'])
+        if supported is None:
+            supported = bool(builder.is_builder_supported())
+            if cache:
+                cache.set(entry['name'], supported)
+
+        if supported:
+            return builder
+
+    if requested:
+        raise NoBuildersSupported('Couldn\'t find a builder for the {0} nodes of the topology that '
+                                  'is supported on this device'.format(', '.join(sorted(requested))))
+
+    raise NoBuildersSupported('Couldn\'t find any builders that are '
+                              'supported on this device')
+
+
+class BuilderSupportCache(object):
+    """
+    Class:          BuilderSupportCache
+    Description:    Stores the result of 'is_builder_supported' for every
+                    builder on this host, so the builders that aren't
+                    supported don't have to be imported on every run.
+                    Entries expire after 'ttl' seconds.
+    """
+    def __init__(self, path=support_cache_file, ttl=support_cache_ttl):
+        self.path = path
+        self.ttl = ttl
+        self.host = '{0}-{1}'.format(socket.gethostname(), platform.release())
+        self.entries = {}
+
+        try:
+            with open(self.path, 'r') as stream:
+                self.entries = json.load(stream).get(self.host, {})
+        except (IOError, OSError, ValueError, AttributeError):
+            self.entries = {}
+
+    def get(self, name):
+        entry = self.entries.get(name)
+        if entry and (time.time() - entry['time']) < self.ttl:
+            return entry['supported']
+
+        return None
+
+    def set(self, name, supported):
+        self.entries[name] = {'supported': supported, 'time': time.time()}
+
+        try:
+            with open(self.path, 'r') as stream:
+                data = json.load(stream)
+        except (IOError, OSError, ValueError):
+            data = {}
+
+        data[self.host] = self.entries
+
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix='{0}.'.format(os.path.basename(self.path)),
+                                            dir=os.path.dirname(self.path))
+            with os.fdopen(fd, 'w') as stream:
+                json.dump(data, stream)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            log.debug('Couldn\'t write the builder support cache: {0}'.format(e))
+
+
 class BuilderSelector(object):
     """
     Class:          BuildSelector
-    Description:    This class will go through all of the supported VM builders
+    Description:    This class will go through all of the registered VM builders
                     and determine which one it will use on the current system.
                     The VM builder that has the lowest prefernce and is supported
-                    will be the one that is chosen.
+                    will be the one that is chosen (see 'select_builder_class').
+                    Only the modules of the builders that have to be checked are
+                    imported.
     """
-    def __init__(self, graph, sim_dir, image_depot):
+    def __init__(self, graph, sim_dir, image_depot, use_cache=True):
         self.graph = graph
-
-        current_path = os.path.dirname(os.path.realpath(__file__))
-        imp_mod = importlib.import_module
-
-        # Get all of the user defined modules for the underlying
-        # simulation support
-        sim_blocks = [imp_mod('simulator.builders.{0}'.format(modname)) for _, modname, _
-                      in pkgutil.iter_modules([current_path])
-                      if not modname.startswith('_')]
-
-        builders = []
-        for builder_mod in sim_blocks:
-            #builders = [builder for _, builder in inspect.getmembers(builder_mod)
-            #            if isinstance(builder, type) and builder != BuilderBase
-            #            and issubclass(builder, BuilderBase)]
-
-            for _, builder in inspect.getmembers(builder_mod):
-                if isinstance(builder, type) and (builder != BuilderBase) and \
-                   issubclass(builder, BuilderBase):
-                    builders.append(builder)
-
-        preference_check = apt.apt_pkg.version_compare
-
-        # Pick the builder with the lowest preference
-        builders.sort(preference_check, key=lambda _builder: _builder.preference)
-
-        for builder in builders:
-            if builder.is_builder_supported():
-                self.builder = builder(self.graph, sim_dir, image_depot)
-                break
-        else:
-            raise NoBuildersSupported('Couldn\'t find any builders that are '
-                                      'supported on this device')
+        self.builder = select_builder_class(graph, use_cache)(self.graph, sim_dir, image_depot)
@@ -2,11 +2,25 @@
 # Written by Ken Yin
 
 import os
+import json
+import time
 import subprocess
-import yaml
-import psutil
+from collections import OrderedDict
 from simulator.builders import BuilderBase
 from simulator.utilities.PortResourceCheck import PortResourceCheck
+from simulator.utilities.LaunchPlan import LaunchPlan, PlanCache, topology_hash, image_state_hash
+from simulator.utilities.PrivHelper import PrivLauncher
+from simulator.utilities.LogPump import get_log_paths
+from simulator.utilities.BootOrder import BootOrder, wait_nodes_ready, ssh_port_index
+from simulator.utilities.AddressAllocator import AddressAllocator, NoMorePciSlots
+from simulator.utilities.TopologyValidator import TopologyValidator
+from simulator.utilities.TopoStream import unquote_name, split_end, attribute_is_set
+from simulator.utilities.SimState import read_state, update_state
+from simulator.utilities.LaunchJournal import LaunchJournal, LaunchJournalError, pid_alive
+from simulator.utilities.GoldenImage import GoldenImage, GoldenImageError, save_vm_state, format_identity, shell_quote
+from simulator.utilities.UserDirs import make_private_dir
+from simulator.utilities.ConfigMedia import get_media_job, build_all_media
+from simulator.utilities.Tracer import get_tracer
 #from logging import getLogger
 import logging
 from simulator.utilities.LogWrapper import getLogger
@@ -21,20 +35,110 @@ kvm_options = { 'serial':   '-serial telnet::{0},server,nowait',
                 'nic':      '-net nic,vlan=10,macaddr={0},model=virtio',
                 'fwd_ports':',hostfwd=tcp::{0}-:{1}',
                 'links':    '-netdev socket,udp={daddr}:{dport},localaddr={saddr}:{sport},id=dev{dev} ' + \
-                            '-device virtio-net-pci,mac={mac},addr={slot}.{function},multifunction={multifunction},netdev=dev{dev},id={name}',
+                            '-device virtio-net-pci,mac={mac},{bus}addr={addr},multifunction={multifunction},netdev=dev{dev},id={name}',
                 'image':    '-drive file={0},if=virtio,werror=report',
                 'cores':    '-smp {0}',
                 'ram':      '-m {0}'}
 
 
-class NoMorePciSlots(Exception):
-    pass
+kvm_binary = '/usr/bin/kvm'
+
+# Disk settings of the VMs, selected with the 'disk_profile' of the VM type
+# or node.  'cache', 'aio', 'discard' and 'detect-zeroes' are '-drive'
+# options, 'iothread' gives a virtio disk its own I/O thread.  'direct'
+# bypasses the host page cache, which many VMs booting from the same
+# backing file share.  'ci' is for throwaway labs: the writes of the guests
+# are never flushed, so a host crash loses them.
+disk_profiles = {'default': {},
+                 'direct':  {'cache': 'none', 'aio': 'native', 'iothread': True, 'discard': 'unmap'},
+                 'ci':      {'cache': 'unsafe', 'aio': 'io_uring', 'iothread': True, 'discard': 'unmap',
+                             'detect-zeroes': 'unmap'}}
+disk_option_values = OrderedDict([('cache', ['none', 'writeback', 'writethrough', 'directsync', 'unsafe']),
+                                  ('aio', ['threads', 'native', 'io_uring']),
+                                  ('discard', ['ignore', 'unmap']),
+                                  ('detect-zeroes', ['off', 'on', 'unmap'])])
+
+
+def kvm_option(template, *args, **kwargs):
+    """
+    Function Name:      kvm_option
+
+    Parameters:         template
+                         - One of the 'kvm_options' templates
+                        args/kwargs
+                         - Values to format the template with
+
+    Description:        Split a template into argv tokens before formatting
+                        it, so values with spaces (e.g. image paths) stay a
+                        single argument.
+
+    Returns:            list
+                         - argv tokens for the option
+    """
+    return [token.format(*args, **kwargs) for token in template.split()]
+
+
+def dot_string(value):
+    """
+    Function Name:      dot_string
+
+    Parameters:         value
+                         - Attribute value as pydot returns it
+
+    Description:        Undo the quoting of a DOT string, so a multi-line
+                        attribute like a startup config can be written as
+                        startup_config="hostname leaf1\\n..." in the topology.
+
+    Returns:            str
+    """
+    value = str(value)
+    if len(value) > 1 and value[0] == value[-1] == '"':
+        value = value[1:-1]
+
+    return value.replace('\\n', '\n').replace('\\"', '"')
 
 
 class NoSimDir(Exception):
     pass
 
 
+class DiskProfileError(Exception):
+    pass
+
+
+def get_disk_profile(name, overrides=None):
+    """
+    Function Name:      get_disk_profile
+
+    Parameters:         name
+                         - One of 'disk_profiles'
+                        overrides
+                         - Settings that replace the ones of the profile
+
+    Description:        Look up and check the disk settings of a node
+
+    Returns:            dict
+    """
+    if name not in disk_profiles:
+        raise DiskProfileError('Unknown disk profile {0}, use one of {1}'.format(name, sorted(disk_profiles)))
+
+    profile = dict(disk_profiles[name])
+    profile.update(overrides or {})
+
+    for option, values in disk_option_values.items():
+        if option in profile and profile[option] not in values:
+            raise DiskProfileError('{0}={1} isn\'t a disk option, use one of {2}'.format(option, profile[option], values))
+
+    # The native AIO of Linux only works on files opened with O_DIRECT
+    if profile.get('aio') == 'native' and profile.get('cache') not in ['none', 'directsync']:
+        raise DiskProfileError('aio=native needs cache=none or cache=directsync')
+
+    if profile.get('detect-zeroes') == 'unmap' and profile.get('discard') != 'unmap':
+        raise DiskProfileError('detect-zeroes=unmap needs discard=unmap')
+
+    return profile
+
+
 class NoQcow2Image(Exception):
     pass
 
@@ -46,6 +150,7 @@ class KvmBuilder(BuilderBase):
                         The VMs are brought up by using the raw '/usr/bin/kvm' command
                         found in the system.
     """
+    name = 'kvm'
     preference = 10
 
     def __init__(self, graph, sim_dir, image_depot):
@@ -54,58 +159,856 @@ class KvmBuilder(BuilderBase):
         self.image_depot = image_depot
         self.nodes = {}
         self.port_check = PortResourceCheck()
+        self.plan_cache = PlanCache()
+        self.launch_plan = None
+        self._base_images_ = {}
+        self._boot_files_ = {}
+        self.addresses = None
+        self.tracer = get_tracer()
+
+        # Launcher for the privileged requests.  By default a PrivLauncher
+        # for the simulation is used, the host daemon sets its own.
+        self.launcher = None
+
+        # Journal of the start (see LaunchJournal).  '_resumed_' is the
+        # replayed journal when an interrupted start is resumed.
+        self._journaled_pids_ = {}
+        self._resumed_ = None
+
+        # Staged bring-up (see BootOrder).  When there is more than one
+        # stage, every stage has 'boot_stage_timeout' seconds to be ready
+        # before the next one is started.
+        self.boot_strategy = None
+        self.boot_roots = None
+        self.boot_stage_timeout = 300
         log.debug('KvmBuilder')
 
+    def _get_vm_class_(self, node):
+        return self._get_vm_type_class_(node.get('vm_type'), node.get('builder'))
+
+    def _get_vm_types_(self):
+        return vm_type_map
+
+    def _get_vm_type_class_(self, vm_type, builder=None):
+        # 'builder' is the node attribute that asks for a builder other
+        # than KVM for the node (see NetnsBuilder), every node is a VM here
+        if vm_type:
+            return vm_type_map[str(vm_type).strip('"')]
+        else:
+            # TODO: Unrecognized VM Type.  Use default type
+            return CumulusVmType
+
+    def _get_launcher_(self):
+        if self.launcher is None:
+            self.launcher = PrivLauncher(self.sim_dir)
+
+        return self.launcher
+
+    def _get_journal_(self):
+        return LaunchJournal(self.sim_dir)
+
+    def _get_image_name_(self, node):
+        if node.get('image'):
+            return str(node.get('image')).strip('"')
+        else:
+            return self._get_vm_class_(node).image
+
+    def _get_node_columns_(self):
+        # The attributes that the VMs are built from, read for all of the
+        # nodes at once
+        return dict((name, self.topology.get_attribute_column(name))
+                    for name in ['vm_type', 'builder', 'id', 'image', 'label', 'golden_boot',
+                                 'direct_boot', 'config_media', 'startup_config', 'disk_profile', 'disk_cache',
+                                 'disk_aio', 'disk_iothread', 'disk_discard'])
+
+    def _get_disk_request_(self, columns, name, class_vm_type):
+        # The node attribute 'disk_profile' overrides the profile of the VM
+        # type, and 'disk_cache', 'disk_aio', 'disk_iothread' and
+        # 'disk_discard' override single settings of the profile
+        profile = columns['disk_profile'][name]
+        overrides = {}
+        for option in ['cache', 'aio', 'discard']:
+            value = columns['disk_' + option][name]
+            if value is not None:
+                overrides[option] = str(value).strip('"')
+
+        iothread = columns['disk_iothread'][name]
+        if iothread is not None:
+            overrides['iothread'] = attribute_is_set(iothread)
+
+        return (str(profile).strip('"') if profile is not None else class_vm_type.disk_profile), overrides
+
+    def _get_node_disk_(self, columns, name, class_vm_type):
+        try:
+            return get_disk_profile(*self._get_disk_request_(columns, name, class_vm_type))
+        except DiskProfileError as e:
+            raise DiskProfileError('{0}: {1}'.format(name, e))
+
+    def _check_node_disk_(self, node):
+        # The disk settings of a single node, for the TopologyValidator
+        name = unquote_name(node.get_name())
+        columns = dict((column, {name: node.get(column)})
+                       for column in ['disk_profile', 'disk_cache', 'disk_aio', 'disk_iothread', 'disk_discard'])
+
+        return get_disk_profile(*self._get_disk_request_(columns, name, self._get_vm_class_(node)))
+
+    def _find_image_(self, vm_image):
+        if not vm_image:
+            # The node isn't a VM
+            return None
+
+        if vm_image not in self._base_images_:
+            with self.tracer.span('image_lookup', image=vm_image):
+                self._base_images_[vm_image] = self.image_depot.get_qcow2_image(vm_image)
+
+        return self._base_images_[vm_image]
+
+    def _find_boot_files_(self, class_vm_type, vm_image, direct_boot=None):
+        """
+        Method Name:        _find_boot_files_
+
+        Parameters:         class_vm_type
+                             - VM type class of the node
+                            vm_image
+                             - Name of the node's image
+                            direct_boot
+                             - The node attribute 'direct_boot', which
+                               overrides the VM type
+
+        Description:        The kernel, initrd and command line that the node
+                            is booted from directly (see DirectBootVmType).
+                            The depot is only looked at once for every image
+                            name.
+
+        Returns:            dict
+                             - None if the node boots its image's firmware
+                               and boot loader
+        """
+        if direct_boot is None:
+            direct_boot = class_vm_type.direct_boot
+        else:
+            direct_boot = attribute_is_set(direct_boot)
+
+        if not direct_boot or class_vm_type.namespace or not vm_image:
+            return None
+
+        if vm_image not in self._boot_files_:
+            self._boot_files_[vm_image] = self.image_depot.get_boot_files(vm_image)
+
+        return self._boot_files_[vm_image]
+
+    def _get_image_files_(self, node):
+        # Every file of the depot that the node is started from
+        class_vm_type = self._get_vm_class_(node)
+        boot_files = self._find_boot_files_(class_vm_type, self._get_image_name_(node), node.get('direct_boot')) or {}
+
+        return [self._get_base_image_(node)] + [path for _, path in sorted(boot_files.items())]
+
+    def _get_base_image_(self, node):
+        """
+        Method Name:        _get_base_image_
+
+        Parameters:         node
+                             - pydot.Node to find the base image for
+
+        Description:        Find the QCOW2 image in the image depot for a node.
+                            The depot is only walked once for every image name.
+        """
+        return self._find_image_(self._get_image_name_(node))
+
+    def _get_validator_(self, check_ports=True):
+        if check_ports:
+            if not self.port_check.scanned:
+                self.port_check.scan()
+            free_ports = len(self.port_check.free_ports)
+        else:
+            free_ports = None
+
+        return TopologyValidator(self.topology, vm_types=self._get_vm_types_(), get_image_name=self._get_image_name_,
+                                 find_image=self._find_image_, free_ports=free_ports,
+                                 ports_per_node=base_ports, get_disk=self._check_node_disk_)
+
+    def validate(self, check_ports=True):
+        """
+        Method Name:        validate
+
+        Parameters:         check_ports
+                             - Check that there are enough free UDP ports
+
+        Description:        Check the topology without starting anything
+                            (see TopologyValidator)
+
+        Returns:            list
+                             - Problem for everything that is wrong with the
+                               topology
+        """
+        with self.tracer.span('validate'):
+            return self._get_validator_(check_ports).validate()
+
+    def _get_links_by_node_(self):
+        """
+        Method Name:        _get_links_by_node_
+
+        Parameters:         None
+
+        Description:        Group the links of the topology by node with a
+                            single pass over the edges.  The links of every
+                            node are in the same order as 'get_links_for_node'
+                            returns them.
+
+        Returns:            dict
+                             - {node name: list of pydot.Edge}
+        """
+        links = {}
+
+        for edge in self.topology.graph.get_edges():
+            src = split_end(edge.get_source())[0]
+            dst = split_end(edge.get_destination())[0]
+
+            links.setdefault(src, []).append(edge)
+            if dst != src:
+                links.setdefault(dst, []).append(edge)
+
+        return links
+
     def _construct_vms_(self):
         total_ports = 0
-        for node in self.topology.get_nodes():
-            if node.get('vm_type'):
-                class_vm_type = vm_type_map[node.get('vm_type')]
-            else:
-                # TODO: Unrecognized VM Type.  Use default type
-                class_vm_type = CumulusVmType
 
-            if node.get('image'):
-                vm_image = node.get('image')
-            else:
-                vm_image = class_vm_type.image
-
-            ports_needed = len(self.topology.get_interfaces(node.get_name())) + base_ports
-            log.debug('{0} needs {1} UDP ports'.format(node.get_name(), ports_needed))
-            ports = self.port_check.get_free_ports(ports_needed, sim_dir=self.sim_dir)
-            node.set('udp_ports', ports)
+        # The links and the PCI/MAC addresses of all of the nodes are worked
+        # out once for the topology, not for every node
+        with self.tracer.span('link_lookup'):
+            links_by_node = self._get_links_by_node_()
+        self.addresses = AddressAllocator()
+
+        with self.tracer.span('attribute_columns'):
+            columns = self._get_node_columns_()
+        udp_ports = {}
+
+        for name, vm_type in columns['vm_type'].items():
+            class_vm_type = self._get_vm_type_class_(vm_type, columns['builder'][name])
+            vm_image = str(columns['image'][name]).strip('"') if columns['image'][name] else class_vm_type.image
+
+            # Linux images with a kernel in the depot boot it directly on a
+            # minimal machine, the node attribute 'direct_boot' overrides
+            # the VM type
+            boot_files = self._find_boot_files_(class_vm_type, vm_image, columns['direct_boot'][name])
+            if boot_files:
+                class_vm_type = DirectBootVmType
+
+            # pydot quotes labels with '|' in them when they are parsed
+            label = columns['label'][name]
+            ports_needed = len(label.strip('"').split('|') if label else []) + base_ports
+            log.debug('{0} needs {1} UDP ports'.format(name, ports_needed))
+            with self.tracer.span('port_allocation', node=name):
+                ports = self.port_check.get_free_ports(ports_needed, sim_dir=self.sim_dir)
+            udp_ports[name] = ports
+
+            links = links_by_node.get(name, [])
+            node_id = int(str(columns['id'][name]).strip('"'))
+
+            with self.tracer.span('address_allocation', node=name):
+                addresses = self.addresses.allocate(name, node_id, len(links),
+                                                    class_vm_type.bus_type)
+
+            startup_config = columns['startup_config'][name]
             build_params = { 'ports': ports,
-                             'links': self.topology.get_links_for_node(node.get_name()),
-                             'name': node.get_name(),
-                             'node_id': node.get('id'),
+                             'links': links,
+                             'name': name,
+                             'node_id': node_id,
+                             'addresses': addresses,
                              'base_sim_dir': self.sim_dir,
-                             'base_image': self.image_depot.get_qcow2_image(vm_image)}
+                             'base_image': self._find_image_(vm_image),
+                             'boot_files': boot_files,
+                             'startup_config': dot_string(startup_config) if startup_config is not None else None,
+                             'disk': self._get_node_disk_(columns, name, class_vm_type)}
 
             vm_obj = class_vm_type(**build_params)
-            self.nodes[node.get_name()] = vm_obj
+            self.nodes[name] = vm_obj
+
+            # Nodes with a startup config get config media, and the node
+            # attribute 'config_media' overrides the VM type.  The media
+            # change the devices of the VM, so they are set up before the
+            # golden state is looked up.
+            config_media = columns['config_media'][name]
+            if config_media is None:
+                config_media = class_vm_type.config_media or startup_config is not None
+            else:
+                config_media = attribute_is_set(config_media)
 
-    def run(self):
+            if config_media and not class_vm_type.namespace:
+                vm_obj.media = vm_obj.get_config_media()
+
+            # The node attribute 'golden_boot' overrides the VM type
+            golden_boot = columns['golden_boot'][name]
+            if golden_boot is None:
+                golden_boot = class_vm_type.golden_boot
+            else:
+                golden_boot = attribute_is_set(golden_boot)
+
+            if golden_boot and not class_vm_type.namespace:
+                vm_obj.golden = self.image_depot.get_golden_image(vm_obj.base_image, vm_obj.get_golden_fingerprint())
+
+        self.topology.set_attribute_column('udp_ports', udp_ports)
+
+    def _apply_plan_ports_(self, plan):
         """
-        Method Name:        run
+        Method Name:        _apply_plan_ports_
+
+        Parameters:         plan
+                             - LaunchPlan whose ports should be used
+
+        Description:        Set the UDP ports of a cached plan on the nodes and
+                            links of the topology, the same way that
+                            '_construct_vms_' does for a newly compiled plan.
+        """
+        self.topology.set_attribute_column('udp_ports', dict((name, node['ports']) for name, node in plan.nodes.items()))
+
+        link_ports = dict(((link['source'], link['destination']), link) for link in plan.links)
+        for edge in self.topology.graph.get_edges():
+            link = link_ports.get((edge.get_source(), edge.get_destination()))
+            if link:
+                for name in ['local_port', 'remote_port']:
+                    if link[name]:
+                        edge.set(name, link[name])
+
+    def compile_plan(self):
+        """
+        Method Name:        compile_plan
 
         Parameters:         None
 
+        Description:        Compile the topology into a LaunchPlan.  If the
+                            topology and its images haven't changed since a
+                            plan was cached, and all of the cached plan's UDP
+                            ports are still free, the cached plan is reused.
+                            Otherwise, the VMs are constructed and a new plan
+                            is compiled and cached.
+
+        Returns:            LaunchPlan
+        """
+        with self.tracer.span('compile_plan'):
+            # The topology is checked before its images are looked up.  The
+            # free ports are only checked when a new plan is compiled, a
+            # cached plan brings its own ports.
+            with self.tracer.span('validate'):
+                self._get_validator_(check_ports=False).check()
+
+            nodes = self.topology.get_nodes()
+            with self.tracer.span('topology_hash'):
+                topo_hash = topology_hash(self.topology)
+                depot_hash = image_state_hash(path for node in nodes for path in self._get_image_files_(node))
+
+            plan = self.plan_cache.get(LaunchPlan.make_key(topo_hash, depot_hash))
+            if plan and (set(plan.nodes) == set(unquote_name(node.get_name()) for node in nodes)) and \
+               self.port_check.reserve_ports(plan.get_ports(), self.sim_dir):
+                log.debug('Reusing the cached launch plan {0}'.format(plan.key))
+                plan.rebase(self.sim_dir)
+                self._apply_plan_ports_(plan)
+            else:
+                with self.tracer.span('validate_ports'):
+                    if not self.port_check.scanned:
+                        self.port_check.scan()
+                    TopologyValidator(self.topology, free_ports=len(self.port_check.free_ports),
+                                      ports_per_node=base_ports).check()
+
+                # Nothing has the ports of the nodes until the plan is
+                # returned, so they are given back if it can't be compiled
+                try:
+                    with self.tracer.span('construct_vms'):
+                        self._construct_vms_()
+
+                    plan = LaunchPlan(self.sim_dir, topo_hash, depot_hash)
+                    for node in nodes:
+                        vm = self.nodes[unquote_name(node.get_name())]
+                        with self.tracer.span('build_cmdline', node=unquote_name(node.get_name())):
+                            argv = vm.build_kvm_cmdline()
+
+                        plan.add_node(unquote_name(node.get_name()), argv, vm.get_backer_image_path(),
+                                      vm.get_overlay_base(), vm.ports, node.get('vm_type'),
+                                      vm.get_golden_request(), vm.media, vm.get_namespace_request())
+                except BaseException:
+                    self.port_check.release_port(list(self.port_check.used_ports), sim_dir=self.sim_dir)
+                    raise
+
+                for edge in self.topology.graph.get_edges():
+                    plan.add_link(edge.get_source(), edge.get_destination(),
+                                  edge.get('local_port'), edge.get('remote_port'))
+
+                self.plan_cache.put(plan)
+
+        self.launch_plan = plan
+        return plan
+
+    def plan(self):
+        """
+        Method Name:        plan
+
+        Parameters:         None
+
+        Description:        Dry run.  Compile the launch plan and write it to
+                            'plan.yaml' in the simulation directory without
+                            starting any VMs.  The UDP ports are released
+                            again, so a later 'run' can reuse the same port
+                            layout if the ports are still free.
+
+        Returns:            LaunchPlan
+        """
+        plan = self.compile_plan()
+        plan.save('{0}/plan.yaml'.format(self.sim_dir))
+        self.port_check.release_port(plan.get_ports(), sim_dir=self.sim_dir)
+
+        return plan
+
+    def run(self, resume=False):
+        """
+        Method Name:        run
+
+        Parameters:         resume
+                             - Continue a start that was interrupted, see
+                               'prepare_launch'
+
         Description:        Startup the VM associated with the topology.
                             Then, dump the pydot graph into a YAML file
                             for use by other processes.
         """
         log.debug('Starting KVMs')
-        self._construct_vms_()
+        plan = self.prepare_launch(resume)
+
+        launcher = self._get_launcher_()
+        with self.tracer.span('helper_start'):
+            launcher.start()
+
+        self.prepare_config_media(plan)
+        self.prepare_golden_images(plan)
+        self.prepare_namespaces(plan)
+
+        requests = self.get_launch_requests(plan)
+        with self.tracer.span('create_overlays', count=len(requests['overlays'])):
+            returncodes = launcher.create_overlays(requests['overlays'])
+        self.record_overlays(requests['overlays'], returncodes)
+
+        pids = requests['pids']
+        stages = requests['stages']
+        if not stages:
+            # Every node was already running when the start was resumed
+            self.record_launch(pids)
+        for i, stage in enumerate(stages):
+            with self.tracer.span('spawn', count=len(stage), stage=i):
+                stage_pids = launcher.spawn([requests['argv_list'][j] for j in stage],
+                                            logs_list=[requests['logs_list'][j] for j in stage],
+                                            supervise_list=[requests['supervise_list'][j] for j in stage])
+
+            for j, pid in zip(stage, stage_pids):
+                pids[j] = pid
+
+            # The state is written after every stage, so the nodes that are
+            # up can be used (and stopped) before the rest has started
+            self.record_launch(pids, final=(i == len(stages) - 1))
+
+            names = [requests['names'][j] for j in stage]
+            self.tracer.emit('stage_started', {'stage': i, 'nodes': names})
+
+            if len(stages) > 1:
+                self._wait_stage_ready_(i, names, plan)
+
+    def _wait_stage_ready_(self, stage, names, plan):
+        start = time.time()
+
+        # Nodes in network namespaces are ready as soon as they are started
+        ports = dict((name, plan.nodes[name]['ports'][ssh_port_index]) for name in names
+                     if not plan.nodes[name].get('netns'))
+
+        with self.tracer.span('stage_ready_wait', count=len(names), stage=stage):
+            ready = wait_nodes_ready(ports, timeout=self.boot_stage_timeout)
+        ready |= set(names) - set(ports)
+
+        if len(ready) < len(names):
+            log.warn('{0} of the {1} nodes of stage {2} weren\'t ready after {3} seconds'.format(
+                     len(names) - len(ready), len(names), stage, self.boot_stage_timeout))
+
+        self.tracer.emit('stage_ready', {'stage': stage, 'nodes': names, 'ready': sorted(ready),
+                                         'seconds': time.time() - start})
+
+    def prepare_launch(self, resume=False):
+        """
+        Method Name:        prepare_launch
+
+        Parameters:         resume
+                             - Continue the start that the journal in the
+                               simulation directory was written by
+
+        Description:        First step of 'run'.  Compile the launch plan and
+                            save it in the simulation directory, then start
+                            the journal with the ports of every node.
 
-        for node in self.topology.get_nodes():
-            cmds = self.nodes[node.get_name()].build_kvm_cmdline()
-            log.debug(" ".join(cmds))
-            pid = subprocess.Popen(" ".join(cmds), shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            log.debug('PID for node {0}: {1}'.format(node.get_name(), pid.pid))
-            node.set('pid', pid.pid)
+                            When resuming, the saved plan of the interrupted
+                            start is used again with the ports that it still
+                            owns, and 'get_launch_requests' leaves out the
+                            overlays and VMs that the journal has.  Without a
+                            journal the simulation is started from the
+                            beginning.
+
+        Returns:            LaunchPlan
+        """
+        self._resumed_ = None
+        self._journaled_pids_ = {}
+
+        if resume:
+            plan = self._resume_plan_()
+            if plan:
+                return plan
+
+        plan = self.compile_plan()
+        plan.save('{0}/plan.yaml'.format(self.sim_dir))
+
+        with self.tracer.span('journal'):
+            self._get_journal_().begin(self.name, plan)
+
+        return plan
+
+    def _resume_plan_(self):
+        """
+        Method Name:        _resume_plan_
+
+        Parameters:         None
+
+        Description:        Load the plan of an interrupted start from the
+                            simulation directory
+
+        Returns:            LaunchPlan
+                             - None if there is nothing to resume
+        """
+        journal = self._get_journal_().replay()
+        plan_path = '{0}/plan.yaml'.format(self.sim_dir)
+
+        if not journal or not os.path.exists(plan_path):
+            log.info('There is no interrupted start in {0} to resume, starting from the beginning'.format(self.sim_dir))
+            return None
+
+        if journal['complete']:
+            raise LaunchJournalError('The simulation in {0} was already started'.format(self.sim_dir))
+
+        plan = LaunchPlan.load(plan_path)
+        if plan.key != journal['plan_key'] or plan.topo_hash != topology_hash(self.topology):
+            raise LaunchJournalError('The topology changed since the simulation in {0} was started, '
+                                     'stop it and start it again'.format(self.sim_dir))
+
+        # The ports are still owned by the simulation, they were never
+        # released
+        self.port_check.used_ports = list(set(self.port_check.used_ports + plan.get_ports()))
+        self._apply_plan_ports_(plan)
+        self.launch_plan = plan
+
+        self._resumed_ = journal
+        self._journaled_pids_ = dict((name, node['pid']) for name, node in journal['nodes'].items() if node['pid'])
+
+        return plan
+
+    def get_launch_requests(self, plan):
+        """
+        Method Name:        get_launch_requests
+
+        Parameters:         plan
+                             - LaunchPlan from 'prepare_launch'
+
+        Description:        Second step of 'run'.  Everything the launcher
+                            has to do, in the order of the topology's nodes.
+
+        Returns:            dict
+                             - 'names': name of every node,
+                               'overlays': (base image, overlay) tuples,
+                               'argv_list': argv of every VM,
+                               'logs_list': log settings of every VM,
+                               'supervise_list': Supervisor settings of
+                               every VM,
+                               'stages': lists of node indexes to start
+                               one after the other,
+                               'pids': PID of every node that is already
+                               running (when resuming), None for the rest
+        """
+        nodes = self.topology.get_nodes()
+
+        argv_list = [plan.nodes[unquote_name(node.get_name())]['argv'] for node in nodes]
+        for argv in argv_list:
+            log.debug(" ".join(argv))
+
+        names = [unquote_name(node.get_name()) for node in nodes]
+        index = dict((name, i) for i, name in enumerate(names))
+        stages = BootOrder(self.topology, self.boot_strategy, self.boot_roots).stages()
+        stages = [[index[name] for name in stage] for stage in stages]
+
+        # Nodes in network namespaces have no overlay
+        overlays = [(name, plan.nodes[name]['base_image'], plan.nodes[name]['overlay']) for name in names
+                    if plan.nodes[name]['overlay']]
+        pids = [None] * len(names)
+
+        if self._resumed_:
+            # Leave out what the interrupted start already did
+            done = self._resumed_['nodes']
+            for i, name in enumerate(names):
+                pid = done.get(name, {}).get('pid')
+                if pid_alive(pid):
+                    pids[i] = pid
+
+            overlays = [(name, base, overlay) for name, base, overlay in overlays
+                        if not (done.get(name, {}).get('overlay') == overlay and os.path.exists(overlay))]
+            stages = [stage for stage in ([j for j in stage if pids[j] is None] for stage in stages) if stage]
+
+            log.info('Resuming the start of {0}: {1} of {2} nodes are running, {3} overlays are left to create'.format(
+                     self.sim_dir, len([pid for pid in pids if pid]), len(names), len(overlays)))
+
+        return {'names': names,
+                'overlays': [(base, overlay) for _, base, overlay in overlays],
+                'argv_list': argv_list,
+                'logs_list': [self._get_log_settings_(node, plan) for node in nodes],
+                'supervise_list': [self.get_supervise_settings(node, plan) for node in nodes],
+                'stages': stages,
+                'pids': pids}
+
+    def prepare_config_media(self, plan, processes=None):
+        """
+        Method Name:        prepare_config_media
+
+        Parameters:         plan
+                             - LaunchPlan that is started
+                            processes
+                             - Size of the process pool, the number of CPUs
+                               by default
+
+        Description:        Make the config media of the nodes in a pool of
+                            processes.  The media are named by the hash of
+                            their contents, so the media of nodes that
+                            haven't changed since the last start are reused
+                            and nodes with the same contents share them.
+        """
+        jobs = [node['media'] for node in plan.nodes.values() if node.get('media')]
+        if not jobs:
+            return
 
-        with open('{0}/topo.yaml'.format(self.sim_dir), 'w') as stream:
-            yaml.dump(self.topology.graph, stream)
+        with self.tracer.span('config_media', count=len(jobs)):
+            built = build_all_media(jobs, processes)
+
+        log.debug('Made {0} config media, {1} were cached'.format(built, len(set(job['path'] for job in jobs)) - built))
+
+    def prepare_golden_images(self, plan):
+        """
+        Method Name:        prepare_golden_images
+
+        Parameters:         plan
+                             - LaunchPlan that is going to be started
+
+        Description:        Save the booted state of every golden image that
+                            the nodes of the plan are started from and that
+                            wasn't saved yet.  The first node that uses a
+                            golden image is booted from a new overlay of the
+                            base image (with its own ports) until it answers
+                            on SSH, then it is paused, its state is saved and
+                            it is stopped.  This happens once per base image
+                            and fingerprint, later simulations resume every
+                            node from the saved state.
+        """
+        pending = OrderedDict()
+        checked = set()
+        for name, node in plan.nodes.items():
+            golden = node.get('golden')
+            if not golden or golden['state'] in pending:
+                continue
+
+            # QEMU resumes the states as root, so nobody else may be able to
+            # write to their directory
+            golden_dir = os.path.dirname(golden['state'])
+            if golden_dir not in checked:
+                make_private_dir(golden_dir)
+                checked.add(golden_dir)
+
+            if not self.image_depot.is_golden_ready(GoldenImage(*[golden[field] for field in GoldenImage._fields])):
+                pending[golden['state']] = (name, golden)
+
+        for name, golden in pending.values():
+            with self.tracer.span('golden_image', node=name):
+                self._build_golden_image_(name, golden)
+
+    def prepare_namespaces(self, plan):
+        """
+        Method Name:        prepare_namespaces
+
+        Parameters:         plan
+                             - LaunchPlan that is going to be started
+
+        Description:        Set up the network namespaces of the nodes that
+                            aren't VMs before they are spawned.  Every node is
+                            a VM here, see NetnsBuilder.
+        """
+        pass
+
+    def _build_golden_image_(self, name, golden):
+        launcher = self._get_launcher_()
+
+        log.info('Saving the booted state of {0} for {1}, this is only done once'.format(golden['base_image'], name))
+
+        for path in [golden['disk'], golden['state']]:
+            if os.path.exists(path):
+                os.remove(path)
+
+        if any(launcher.create_overlays([(golden['base_image'], golden['disk'])])):
+            raise GoldenImageError('Couldn\'t create the golden disk {0}'.format(golden['disk']))
+
+        pid = launcher.spawn([golden['argv']])[0]
+        try:
+            ready = wait_nodes_ready({name: golden['ssh_port']}, timeout=golden['timeout'])
+            if not ready:
+                raise GoldenImageError('{0} didn\'t boot within {1} seconds, its golden state wasn\'t saved'.format(
+                                       name, golden['timeout']))
+
+            save_vm_state(golden['monitor_port'], golden['state'])
+        except Exception:
+            launcher.kill([pid])
+            for path in [golden['disk'], golden['state']]:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        # The VM quits once its state is saved
+        launcher.kill([pid])
+        self.image_depot.save_golden_info(GoldenImage(*[golden[field] for field in GoldenImage._fields]),
+                                          golden['base_image'], golden['fingerprint'])
+
+    def record_overlays(self, overlays, returncodes):
+        """
+        Method Name:        record_overlays
+
+        Parameters:         overlays
+                             - (base image, overlay) tuples that were created
+                            returncodes
+                             - 'qemu-img' exit code of every overlay
+
+        Description:        Add the created overlays to the journal
+        """
+        names = dict((node['overlay'], name) for name, node in self.launch_plan.nodes.items())
+
+        with self.tracer.span('journal'):
+            self._get_journal_().record('overlay', dict((names[overlay], {'overlay': overlay, 'returncode': rc})
+                                                        for (_, overlay), rc in zip(overlays, returncodes)
+                                                        if overlay in names))
+
+    def record_launch(self, pids, final=True):
+        """
+        Method Name:        record_launch
+
+        Parameters:         pids
+                             - PID of every VM, in the order of the
+                               topology's nodes.  None for the VMs that
+                               weren't started yet.
+                            final
+                             - False while there are stages left to start
+
+        Description:        Last step of 'run'.  Add the new PIDs to the
+                            journal, set the PIDs on the nodes and write the
+                            state file.  'topo.yaml' is only written once all
+                            of the stages were started.
+        """
+        nodes = self.topology.get_nodes()
+        spawned = {}
+        for node, pid in zip(nodes, pids):
+            log.debug('PID for node {0}: {1}'.format(unquote_name(node.get_name()), pid))
+            node.set('pid', pid)
+
+            if pid and self._journaled_pids_.get(unquote_name(node.get_name())) != pid:
+                spawned[unquote_name(node.get_name())] = {'pid': pid}
+
+        with self.tracer.span('journal'):
+            journal = self._get_journal_()
+            journal.record('spawned', spawned)
+            for name, values in spawned.items():
+                self._journaled_pids_[name] = values['pid']
+
+            if final:
+                journal.complete()
+
+        # The supervisor of the PrivHelper restarts the VMs that crash while
+        # later stages are started, so the nodes that weren't spawned now
+        # keep the PID, restarts and exits that are in the state file
+        def merge_nodes(state):
+            old_nodes = (state or {}).get('nodes') or {}
+            new_nodes = {}
+            for node in nodes:
+                name = unquote_name(node.get_name())
+                entry = {'pid': node.get('pid')}
+                if entry['pid'] and name not in spawned and name in old_nodes:
+                    entry = old_nodes[name]
+
+                entry['udp_ports'] = node.get('udp_ports')
+                new_nodes[name] = entry
+
+            return {'builder': self.name,
+                    'sim_dir': self.sim_dir,
+                    'topology_hash': self.launch_plan.topo_hash if self.launch_plan else None,
+                    'nodes': new_nodes}
+
+        with self.tracer.span('write_state'):
+            update_state(self.sim_dir, merge_nodes)
+
+            if final:
+                import yaml
+                with open('{0}/topo.yaml'.format(self.sim_dir), 'w') as stream:
+                    yaml.dump(self.topology.graph, stream)
+
+    def _get_log_settings_(self, node, plan):
+        """
+        Method Name:        _get_log_settings_
+
+        Parameters:         node
+                             - pydot.Node to get the log settings for
+                            plan
+                             - LaunchPlan that the node is started from
+
+        Description:        Where the VM's stdout and stderr go.  The serial
+                            console is only captured when the node has the
+                            attribute 'log_serial' set, since nobody else can
+                            connect to the console while it is captured.
+
+        Returns:            dict
+        """
+        logs = get_log_paths(self.sim_dir, unquote_name(node.get_name()))
+
+        if attribute_is_set(node.get('log_serial')):
+            # The serial port is the first port of every node
+            logs['serial_port'] = plan.nodes[unquote_name(node.get_name())]['ports'][0]
+        else:
+            del logs['serial']
+
+        return logs
+
+    def get_supervise_settings(self, node, plan):
+        """
+        Method Name:        get_supervise_settings
+
+        Parameters:         node
+                             - pydot.Node to get the settings for
+                            plan
+                             - LaunchPlan that the node is started from
+
+        Description:        How the privileged helper supervises the VM (see
+                            Supervisor).  The exits of every VM are recorded
+                            in the state, and the VMs are restarted when
+                            they crash if the node attribute 'auto_restart'
+                            (or the VM type) says so.
+
+        Returns:            dict
+        """
+        name = unquote_name(node.get_name())
+
+        restart = node.get('auto_restart')
+        if restart is None:
+            restart = self._get_vm_class_(node).auto_restart
+        else:
+            restart = attribute_is_set(restart)
+
+        settings = {'node': name, 'sim_dir': self.sim_dir, 'restart': restart}
+        if restart and plan.nodes[name].get('golden'):
+            settings['restart_argv'] = plan.get_restart_argv(name)
+
+        return settings
 
     def stop(self, run_from_cmd_line=True):
         """
@@ -116,62 +1019,151 @@ class KvmBuilder(BuilderBase):
                                by a different processes
 
         Description:        Stop a simulation in a given simulation directory.
-                            This directory must contain the 'topo.yaml' file
-                            that was created when the method 'run' was called.
+                            This directory must contain the 'state.json' (or
+                            for older simulations, the 'topo.yaml') file that
+                            was created when the method 'run' was called.
         """
         log.debug('Stopping KVMs')
+        launcher = self._get_launcher_()
+        kill_pids = self.prepare_stop(run_from_cmd_line)
 
-        with open('{0}/topo.yaml'.format(self.sim_dir), 'r') as stream:
-            topo = yaml.full_load(stream)
+        # Kill all of the VMs with one request and stop the helper
+        log.debug('Killing PIDs: {0}'.format(kill_pids))
+        with self.tracer.span('kill', count=len(kill_pids)):
+            launcher.kill(kill_pids)
+            launcher.shutdown()
 
-        for node in topo.get_nodes():
+        self.clear_journal()
+
+    def clear_journal(self):
+        # Once every node is stopped there is nothing left to resume
+        self._get_journal_().remove()
+
+    def prepare_stop(self, run_from_cmd_line=True, nodes=None):
+        """
+        Method Name:        prepare_stop
+
+        Parameters:         run_from_cmd_line
+                             - Boolean value indicating if the stop was called
+                               by a different processes
+                            nodes
+                             - {node name: {'pid': PID, 'udp_ports': [ports]}}
+                               of the nodes to stop.  By default, every node
+                               in the state of the simulation.
+
+        Description:        First step of 'stop'.  Release the UDP ports of
+                            the nodes and find the PIDs that have to be killed.
+
+        Returns:            list
+                             - PIDs to kill
+        """
+        import psutil
+
+        kill_pids = []
+
+        if nodes is None:
+            with self.tracer.span('load_state'):
+                nodes = self._load_state_()
+
+        for name, node in nodes.items():
             if node.get('pid'):
                 try:
-                    if isinstance(node.get('pid'), psutil.Process):
-                        self._kill_child_pid_(node.get('pid'))
-                    elif isinstance(node.get('pid'), int):
-                        self._kill_child_pid_(psutil.Process(node.get('pid')))
-                    elif isinstance(node.get('pid'), subprocess.Popen):
-                        self._kill_child_pid_(psutil.Process(node.get('pid').pid))
+                    kill_pids += self._get_kill_pids_(name, psutil.Process(node['pid']))
                 except psutil.NoSuchProcess:
-                    log.debug('PID {0} is defunct'.format(node.get('pid')))
+                    log.debug('PID {0} is defunct'.format(node['pid']))
 
             if node.get('udp_ports'):
                 if run_from_cmd_line:
                     # If 'stop' is called from the command line, then the 'used_ports'
                     # variable won't have any values in it.  So, we need to populate
-                    # the variables
-                    self.port_check.used_ports += node.get('udp_ports')
+                    # the variables.  The ports of the links are a part of the
+                    # node's ports.
+                    self.port_check.used_ports = list(set(self.port_check.used_ports + node['udp_ports']))
+
+                with self.tracer.span('release_ports', node=name):
+                    self.port_check.release_port(node['udp_ports'], sim_dir=self.sim_dir)
+
+        return kill_pids
+
+    def _load_state_(self):
+        """
+        Method Name:        _load_state_
+
+        Parameters:         None
+
+        Description:        Get the PID and UDP ports of every node in the
+                            simulation.  The state file is used when there is
+                            one, otherwise the pydot graph in 'topo.yaml' is
+                            loaded.  The launch journal adds the nodes that
+                            an interrupted start took ports for or started
+                            before they were in the state file.
+
+        Returns:            dict
+                             - {node name: {'pid': PID, 'udp_ports': [ports]}}
+        """
+        state = read_state(self.sim_dir)
+        journal = self._get_journal_().replay()
+
+        if state:
+            nodes = state['nodes']
+        elif journal and not os.path.exists('{0}/topo.yaml'.format(self.sim_dir)):
+            nodes = {}
+        else:
+            nodes = self._load_topo_yaml_()
+
+        if journal:
+            for name, node in journal['nodes'].items():
+                entry = nodes.setdefault(name, {'pid': None, 'udp_ports': None})
+                entry['pid'] = entry.get('pid') or node['pid']
+                entry['udp_ports'] = entry.get('udp_ports') or node['udp_ports']
+
+        return nodes
+
+    def _load_topo_yaml_(self):
+        import yaml
+        import psutil
+        with open('{0}/topo.yaml'.format(self.sim_dir), 'r') as stream:
+            topo = yaml.full_load(stream)
+
+        nodes = {}
+        for node in topo.get_nodes():
+            pid = node.get('pid')
+            if isinstance(pid, psutil.Process) or isinstance(pid, subprocess.Popen):
+                pid = pid.pid
 
-                    for link in self.topology.get_links_for_node(node.get_name()):
-                        for name in ['local_port', 'remote_port']:
-                            port = link.get(name)
-                            if port:
-                                self.port_check.used_ports.append(port)
+            nodes[unquote_name(node.get_name())] = {'pid': pid, 'udp_ports': node.get('udp_ports')}
 
-                    self.port_check.used_ports = list(set(self.port_check.used_ports))
+        return nodes
 
-                self.port_check.release_port(node.get('udp_ports'), sim_dir=self.sim_dir)
+    def _get_kill_pids_(self, name, pid):
+        # PIDs to kill to stop a node, 'pid' is the psutil.Process of the
+        # PID in the state
+        return self._find_leaf_pids_(pid)
 
-    def _kill_child_pid_(self, pid):
+    def _find_leaf_pids_(self, pid):
         """
-        Method Name:        _kill_child_pid_
+        Method Name:        _find_leaf_pids_
 
         Parameters:         pid
                              - psutil.Process object for a specific PID
 
-        Description:        Find the children PIDs for the giev PID and kill
-                            it when found.  The parent PIDs should naturally
-                            terminate when all the children are killed.
+        Description:        Find the children PIDs for the given PID that
+                            have to be killed.  The parent PIDs (e.g. 'sudo'
+                            wrappers) should naturally terminate when all the
+                            children are killed.
+
+        Returns:            list
+                             - PIDs to kill
         """
-        if not pid.children():
-            log.debug('Killing PID: {0}'.format(pid.pid))
-            subprocess.Popen(['sudo', 'kill', '-9', '{0}'.format(pid.pid)], 
-                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return
-        else:
-            for c in pid.children():
-                self._kill_child_pid_(c)
+        children = pid.children()
+        if not children:
+            return [pid.pid]
+
+        pids = []
+        for c in children:
+            pids += self._find_leaf_pids_(c)
+
+        return pids
 
     @staticmethod
     def is_builder_supported():
@@ -186,10 +1178,56 @@ class DefaultVmType(object):
                     been implemented for KVM/QEMU specifically and
                     most likely won't work for other builder types.
     """
+    # 'pci' for the 'pc' machine, 'pcie' for 'q35' (see PciLayout)
+    bus_type = 'pci'
+
+    # Resume the nodes from a saved booted state of the image instead of
+    # booting them (the node attribute 'golden_boot' overrides this).  The
+    # image has to apply the node's identity from the fw_cfg entry
+    # 'opt/pydotsim/identity' when it is resumed.
+    golden_boot = False
+    golden_boot_timeout = 900
+
+    # Start the VM again with the same overlay, ports and links when it
+    # crashes (the node attribute 'auto_restart' overrides this)
+    auto_restart = False
+
+    # Attach day-0 config media with the node's startup config (the node
+    # attribute 'config_media' overrides this, and a node with a
+    # 'startup_config' attribute always gets them).  The default is a
+    # cloud-init NoCloud data source.
+    config_media = False
+    config_media_format = 'fat'
+    config_media_label = 'cidata'
+
+    # Disk settings, one of 'disk_profiles' (the node attribute
+    # 'disk_profile' overrides this)
+    disk_profile = 'default'
+
+    # The node runs in a network namespace instead of a VM (see
+    # NetnsNodeType), so it has no image, disk or devices
+    namespace = False
+
+    # Boot the kernel of the image directly when the image depot has one
+    # for it (see DirectBootVmType).  The node attribute 'direct_boot'
+    # overrides this.
+    direct_boot = True
+
     def __init__(self, **kwargs):
         self.params = {}
         self.index = 0
 
+        # Settings of the disk, see 'get_disk_profile'
+        self.disk = kwargs.get('disk') or get_disk_profile(self.disk_profile)
+
+        # GoldenImage the node is resumed from, set by the builder
+        self.golden = kwargs.get('golden')
+
+        # Config media of the node (see 'get_config_media'), set by the
+        # builder
+        self.startup_config = kwargs.get('startup_config')
+        self.media = kwargs.get('media')
+
         if 'base_sim_dir' in kwargs:
             self.base_sim_dir = kwargs.get('base_sim_dir')
 
@@ -203,7 +1241,7 @@ class DefaultVmType(object):
 
         if 'base_image' in kwargs:
             self.base_image = kwargs.get('base_image')
-            if not self.base_image:
+            if not self.base_image and not self.namespace:
                 raise NoQcow2Image('The Image depot couldn\'t find an image')
         else:
             raise NoQcow2Image('There was no QCOW2 image found')
@@ -233,6 +1271,13 @@ class DefaultVmType(object):
         else:
             self.node_id = 0
 
+        # The builder assigns the addresses of all of the nodes at once.  A
+        # VM that is created on its own assigns its own.
+        if kwargs.get('addresses'):
+            self.addresses = kwargs['addresses']
+        else:
+            self.addresses = AddressAllocator().allocate(self.name, self.node_id, len(self.links), self.bus_type)
+
         for i, port_type in enumerate(default_vm_port_types):
             self.params[port_type] = self.ports[i]
             self.index = i
@@ -246,10 +1291,10 @@ class DefaultVmType(object):
 
         # Assign ports to the node's links
         for link in self.links:
-            if self.name == link.get_source().split(':')[0]:
+            if self.name == split_end(link.get_source())[0]:
                 self.index += 1
                 link.set('local_port', self.ports[self.index])
-            elif self.name == link.get_destination().split(':')[0]:
+            elif self.name == split_end(link.get_destination())[0]:
                 self.index += 1
                 link.set('remote_port', self.ports[self.index])
 
@@ -263,6 +1308,16 @@ class DefaultVmType(object):
         else:
             self.ram = 2048
 
+    def get_backer_image_path(self):
+        """
+        Method Name:        get_backer_image_path
+
+        Parameters:         None
+
+        Description:        Path of the QEMU backer image that the simulation will use.
+        """
+        return '{0}/{1}.qcow2'.format(os.path.join(self.base_sim_dir, self.name), self.name)
+
     def create_backer_image(self):
         """
         Method Name:        create_backer_image
@@ -271,16 +1326,227 @@ class DefaultVmType(object):
 
         Description:        Create the QEMU backer image that the simulation will use.
         """
-        if not os.path.exists(os.path.join(self.base_sim_dir, self.name)):
-            os.makedirs(os.path.join(self.base_sim_dir, self.name))
+        PrivLauncher(self.base_sim_dir).create_overlays([(self.base_image, self.get_backer_image_path())])
+
+        return self.get_backer_image_path()
+
+    def get_overlay_base(self):
+        """
+        Method Name:        get_overlay_base
 
-        cmd = ['sudo', 'qemu-img', 'create', '-b', self.base_image, '-f', 'qcow2',
-               '{0}/{1}.qcow2'.format(os.path.join(self.base_sim_dir, self.name), self.name)]
+        Parameters:         None
 
-        log.debug('backer cmd: {0}'.format(" ".join(cmd)))
-        subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        Description:        Image that the node's overlay is backed by.  Nodes
+                            resumed from a golden state use the golden disk.
+        """
+        return self.golden.disk if self.golden else self.base_image
 
-        return '{0}/{1}.qcow2'.format(os.path.join(self.base_sim_dir, self.name), self.name)
+    def get_golden_fingerprint(self):
+        """
+        Method Name:        get_golden_fingerprint
+
+        Parameters:         None
+
+        Description:        A saved VM state can only be resumed by a VM with
+                            the same devices, CPUs and RAM.  Nodes of the same
+                            type with the same number of links share a golden
+                            state.
+        """
+        fingerprint = '{0} cores={1} ram={2} links={3} bus={4}'.format(self.__class__.__name__, self.cores, self.ram,
+                                                                        len(self.links), self.bus_type)
+        if self.media:
+            fingerprint += ' media={0}'.format(self.media['format'])
+
+        # The disk is a different device when it has its own I/O thread
+        if self.disk.get('iothread'):
+            fingerprint += ' iothread=1'
+
+        return fingerprint
+
+    def _split_link_(self, link):
+        # (True if this node is the source of the link, (node, interface)
+        # of this node's end, (node, interface) of the other end)
+        source = split_end(link.get_source())
+        destination = split_end(link.get_destination())
+        if self.name == source[0]:
+            return True, source, destination
+
+        return False, destination, source
+
+    def _get_link_intf_names_(self):
+        return [self._split_link_(link)[1][1] for link in self.links]
+
+    def _get_link_peers_(self):
+        # (interface, 'node:interface' of the other end, MAC) of every link
+        peers = []
+        for link, mac in zip(self.links, self.addresses.intf_macs):
+            _, local, peer = self._split_link_(link)
+            peers.append((local[1], '{0}:{1}'.format(*peer), mac))
+
+        return peers
+
+    def get_config_files(self):
+        """
+        Method Name:        get_config_files
+
+        Parameters:         None
+
+        Description:        Files of the node's config media: the cloud-init
+                            meta-data and user-data (the startup config if
+                            the node has one) and 'links.json' with the peer
+                            and MAC of every interface.
+
+        Returns:            dict
+                             - {file name: contents}
+        """
+        user_data = self.startup_config
+        if user_data is None:
+            user_data = '#cloud-config\nhostname: {0}\n'.format(self.name)
+
+        return {'meta-data': 'instance-id: {0}-{1}\nlocal-hostname: {0}\n'.format(self.name, self.node_id),
+                'user-data': user_data,
+                'links.json': self._get_links_json_()}
+
+    def _get_links_json_(self):
+        links = [{'interface': intf, 'peer': peer, 'mac': mac} for intf, peer, mac in self._get_link_peers_()]
+        return json.dumps({'name': self.name, 'id': self.node_id, 'eth0': self.get_eth0_mac(), 'links': links},
+                          indent=2, separators=(',', ': '), sort_keys=True) + '\n'
+
+    def _get_interface_config_(self, indent):
+        lines = []
+        for intf, peer, _ in self._get_link_peers_():
+            lines += ['interface {0}'.format(intf), '{0}description {1}'.format(indent, peer)]
+
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def get_config_media(self):
+        """
+        Method Name:        get_config_media
+
+        Parameters:         None
+
+        Description:        The config media of the node.  They are made by
+                            the builder before the VM is started, see
+                            ConfigMedia.
+
+        Returns:            dict
+                             - 'path', 'format', 'label' and 'files'
+        """
+        return get_media_job(self.base_sim_dir, self.config_media_format, self.config_media_label,
+                             self.get_config_files())
+
+    def _build_config_media_options_(self):
+        """
+        Method Name:        _build_config_media_options_
+
+        Parameters:         None
+
+        Description:        Attach the config media read-only, ISO images as
+                            a CD-ROM and FAT images as a raw disk
+        """
+        if not self.media:
+            return []
+
+        if self.media['format'] == 'iso':
+            return ['-drive', 'file={0},media=cdrom,readonly=on'.format(self.media['path'])]
+
+        return ['-drive', 'file={0},if=virtio,format=raw,readonly=on'.format(self.media['path'])]
+
+    def _get_drive_options_(self):
+        # '-drive' options of the disk profile, in a fixed order so the
+        # command line of a node doesn't change between runs
+        return ''.join(',{0}={1}'.format(option, self.disk[option])
+                       for option in disk_option_values if option in self.disk)
+
+    def _build_disk_options_(self):
+        """
+        Method Name:        _build_disk_options_
+
+        Parameters:         None
+
+        Description:        Attach the overlay as a virtio disk with the
+                            settings of the disk profile.  A disk with its
+                            own I/O thread is set up as a separate drive and
+                            virtio-blk device, since '-drive if=virtio'
+                            can't be given one.
+        """
+        if not self.disk.get('iothread'):
+            return kvm_option(kvm_options['image'] + self._get_drive_options_(), self.get_backer_image_path())
+
+        return ['-object', 'iothread,id=iothread-disk0',
+                '-drive', 'file={0},if=none,id=disk0,werror=report{1}'.format(self.get_backer_image_path(),
+                                                                             self._get_drive_options_()),
+                '-device', 'virtio-blk-pci,drive=disk0,iothread=iothread-disk0']
+
+    def _build_golden_options_(self):
+        """
+        Method Name:        _build_golden_options_
+
+        Parameters:         None
+
+        Description:        Resume the VM from the golden state and pass it
+                            the identity of the node.  The devices and MAC
+                            addresses come back as they were in the VM that
+                            the state was saved from, so the guest has to set
+                            its own from the identity.
+        """
+        if not self.golden:
+            return []
+
+        identity = [('name', self.name), ('id', self.node_id), ('eth0', self.get_eth0_mac())]
+        identity += zip(self._get_link_intf_names_(), self.addresses.intf_macs)
+
+        return ['-incoming', 'exec:cat {0}'.format(shell_quote(self.golden.state)),
+                '-fw_cfg', 'name=opt/pydotsim/identity,string={0}'.format(format_identity(identity))]
+
+    def get_golden_request(self):
+        """
+        Method Name:        get_golden_request
+
+        Parameters:         None
+
+        Description:        Everything the builder needs to save the golden
+                            state if it doesn't exist yet: the node is booted
+                            with its own command line, but from the golden
+                            disk and without resuming.
+
+        Returns:            dict
+                             - None if the node isn't resumed from a golden
+                               state
+        """
+        if not self.golden:
+            return None
+
+        golden, self.golden = self.golden, None
+        try:
+            argv = self.build_kvm_cmdline()
+        finally:
+            self.golden = golden
+
+        overlay = self.get_backer_image_path()
+        return {'disk': golden.disk,
+                'state': golden.state,
+                'info': golden.info,
+                'key': golden.key,
+                'base_image': self.base_image,
+                'fingerprint': self.get_golden_fingerprint(),
+                'argv': [arg.replace(overlay, golden.disk) for arg in argv],
+                'monitor_port': self.params['monitor'],
+                'ssh_port': self.params['22'],
+                'timeout': self.golden_boot_timeout}
+
+    def get_namespace_request(self):
+        """
+        Method Name:        get_namespace_request
+
+        Parameters:         None
+
+        Description:        How the network namespace of the node is set up
+                            (see NetnsNodeType), None for a VM
+
+        Returns:            dict
+        """
+        return None
 
     def get_pci_info(self, idx):
         """
@@ -289,19 +1555,14 @@ class DefaultVmType(object):
         Parameters:         idx
                              - The index number of the interface
 
-        Description:        Return a unique PCI slot and multifunction value
-                            for a node.  This will be used when creating the
-                            interfaces on the KVM command line
+        Description:        Return a unique PCI bus, address and multifunction
+                            value for an interface of the node.  This will be
+                            used when creating the interfaces on the KVM
+                            command line.  NoMorePciSlots is raised when the
+                            addresses are assigned if the interfaces don't fit
+                            behind the PCI bridges.
         """
-        base_pci_slot = 6
-        pci_slot = base_pci_slot + (idx/8)
-        pci_function = idx % 8
-        multifunction = "on" if pci_function == 0 else "off"
-
-        if pci_slot > 31:
-            raise NoMorePciSlots('No more PCI slots available to add interfaces')
-
-        return pci_slot, pci_function, multifunction
+        return self.addresses.get_pci_info(idx)
 
     def get_eth0_mac(self):
         """
@@ -312,7 +1573,7 @@ class DefaultVmType(object):
         Description:        Set the MAC address for 'eth0' based on the 'node_id' since it should
                             be unique
         """
-        return "00:0a:00:{0:02x}:{1:02x}:00".format((self.node_id >> 8) & 0xff, self.node_id & 0xff)
+        return self.addresses.eth0_mac
 
     def get_intf_mac(self, intf_id):
         """
@@ -325,7 +1586,7 @@ class DefaultVmType(object):
                             MAC address is based on the 'node id' and 'interface id' since this should
                             yield a unique pair
         """
-        return "00:02:00:{0:02x}:{1:02x}:{2:02x}".format((self.node_id >> 8) & 0xff, self.node_id & 0xff, intf_id & 0xff)
+        return self.addresses.intf_macs[intf_id]
 
     def _build_common_kvm_options_(self):
         """
@@ -336,53 +1597,60 @@ class DefaultVmType(object):
         Description:        Build some of the common options that some of the
                             others KVM command line need.
         """
-        cmd = ['sudo', '/usr/bin/kvm', '-enable-kvm', '-nographic', 
-               '-name {0}'.format(self.name), '-cpu host']
+        cmd = [kvm_binary, '-enable-kvm', '-nographic',
+               '-name', self.name, '-cpu', 'host']
 
         for port_type in ['serial', 'monitor']:
-            cmd.append(kvm_options[port_type].format(self.params[port_type]))
+            cmd += kvm_option(kvm_options[port_type], self.params[port_type])
 
-        cmd.append(kvm_options['cores'].format(self.cores))
-        cmd.append(kvm_options['ram'].format(self.ram))
+        cmd += kvm_option(kvm_options['cores'], self.cores)
+        cmd += kvm_option(kvm_options['ram'], self.ram)
 
         return cmd
 
-    def _build_kvm_intfs_(self):
+    def _build_kvm_intfs_(self, links_format=None):
         """
         Method Name:        _build_kvm_intfs_
 
-        Parameters:         None
+        Parameters:         links_format
+                             - Template for the options of a link, the
+                               'links' template of 'kvm_options' by default
 
         Description:        Builds the KVM command line option for
-                            the VM's interfaces using UDP sockets.
+                            the VM's interfaces using UDP sockets.  The
+                            PCI bridges that the interfaces need come
+                            first.  The template is only split once, so
+                            a node with hundreds of links is built in a
+                            single pass over them.
         """
-        cmd = []
+        tokens = (links_format or kvm_options['links']).split()
+        addresses = self.addresses.layout.addresses
+        macs = self.addresses.intf_macs
+        cmd = list(self.addresses.devices)
 
         for i, link in enumerate(self.links):
-            slot, func, multifunc = self.get_pci_info(i)
+            bus, addr, multifunc = addresses[i]
+            is_source, (_, name), _ = self._split_link_(link)
 
-            link_params = {'daddr': '127.0.0.1',
-                           'saddr': '127.0.0.1',
-                           'mac': self.get_intf_mac(i),
-                           'slot': slot,
-                           'function': func,
-                           'multifunction': multifunc,
-                           'dev': i}
-
-            if self.name == link.get_source().split(':')[0]:
+            if is_source:
                 sport = link.get('local_port')
                 dport = link.get('remote_port')
-                name = link.get_source().split(':')[1]
-            elif self.name == link.get_destination().split(':')[0]:
-                sport =link.get('remote_port')
+            else:
+                sport = link.get('remote_port')
                 dport = link.get('local_port')
-                name = link.get_destination().split(':')[1]
 
-            link_params['sport'] = sport
-            link_params['dport'] = dport
-            link_params['name'] = name
+            link_params = {'daddr': '127.0.0.1',
+                           'saddr': '127.0.0.1',
+                           'sport': sport,
+                           'dport': dport,
+                           'name': name,
+                           'mac': macs[i],
+                           'bus': 'bus={0},'.format(bus) if bus else '',
+                           'addr': addr,
+                           'multifunction': multifunc,
+                           'dev': i}
 
-            cmd.append(kvm_options['links'].format(**link_params))
+            cmd += [token.format(**link_params) for token in tokens]
 
         return cmd
 
@@ -403,11 +1671,13 @@ class DefaultVmType(object):
         for port_type in default_vm_port_types[2:]:
             fwd_port_str += kvm_options['fwd_ports'].format(self.params[port_type], port_type)
 
-        cmd.append(kvm_options['eth0']+fwd_port_str)
-        cmd.append(kvm_options['nic'].format(self.get_eth0_mac()))
+        cmd += kvm_option(kvm_options['eth0']+fwd_port_str)
+        cmd += kvm_option(kvm_options['nic'], self.get_eth0_mac())
 
-        # Create a backer image
-        cmd.append(kvm_options['image'].format(self.create_backer_image()))
+        # The backer image is created when the VM is started
+        cmd += self._build_disk_options_()
+        cmd += self._build_config_media_options_()
+        cmd += self._build_golden_options_()
 
         return cmd
 
@@ -431,10 +1701,17 @@ class CiscoVmType(DefaultVmType):
     """
     image = 'cisco_nxosv-7.0.3'
 
+    # NXOSV reads 'nxos_config.txt' from a CD-ROM when it first boots
+    config_media_format = 'iso'
+    config_media_label = 'config'
+
+    # NXOSV needs its UEFI firmware and boot loader
+    direct_boot = False
+
     def __init__(self, **kwargs):
         super(CiscoVmType, self).__init__(**kwargs)
         self.links_format = "-netdev socket,udp={daddr}:{dport},localaddr={saddr}:{sport},id=dev{dev} " + \
-                            "-device e1000,addr={slot}.{function}," + \
+                            "-device e1000,{bus}addr={addr}," + \
                             "multifunction={multifunction},netdev=dev{dev},id={name}"
         self.mgmt_intf_format = '-netdev user,net=192.168.0.15/24'
 
@@ -445,6 +1722,21 @@ class CiscoVmType(DefaultVmType):
         if self.ram < 8192:
             self.ram = 8192
 
+    def get_config_files(self):
+        """
+        Method Name:        get_config_files
+
+        Parameters:         None
+
+        Description:        NXOSV config with the hostname and a description
+                            of the peer of every interface, followed by the
+                            node's startup config
+        """
+        config = 'hostname {0}\n'.format(self.name) + self._get_interface_config_('  ')
+
+        return {'nxos_config.txt': config + (self.startup_config or ''),
+                'links.json': self._get_links_json_()}
+
     def build_kvm_cmdline(self):
         """
         Method Name:        build_kvm_cmdline
@@ -455,66 +1747,44 @@ class CiscoVmType(DefaultVmType):
                             node.  The NXOSV KVM needs to have the options set in a specific order
                             for the VM to come up correctly
         """
-        cmd = ['sudo', '/usr/bin/kvm', '-enable-kvm', '-cpu host']
+        cmd = [kvm_binary, '-enable-kvm', '-cpu', 'host']
 
         # Get UEFI BIOS image.  Assuming that the UEFI bios image
         # name is 'bios.bin' and that it is in the same directory
         # as the base image.  Change this if this isn't true.
-        img_dir = '/'.join(self.base_image.split('/')[:-1])
-        cmd.append('-bios {0}/bios.bin '.format(img_dir))
+        img_dir = os.path.dirname(self.base_image)
+        cmd += ['-bios', os.path.join(img_dir, 'bios.bin')]
 
         for port_type in ['serial', 'monitor']:
-            cmd.append(kvm_options[port_type].format(self.params[port_type]))
+            cmd += kvm_option(kvm_options[port_type], self.params[port_type])
 
         # Build the eth0 parameters
         fwd_port_str = ""
         for port_type in default_vm_port_types[2:]:
             fwd_port_str += kvm_options['fwd_ports'].format(self.params[port_type], port_type)
 
-        cmd.append(self.mgmt_intf_format+fwd_port_str+',id=mgmt0')
-
-        # Create backer image
-        img_options = '-device ahci,id=ahci0,bus=pci.0,multifunction=on '
-        img_options += '-drive file={0},if=none,id=drive-sata-disk0,format=qcow2 '.format(self.create_backer_image())
-        img_options += '-device ide-drive,bus=ahci0.0,drive=drive-sata-disk0'
+        cmd += kvm_option(self.mgmt_intf_format+fwd_port_str+',id=mgmt0')
 
-        cmd.append(img_options)
+        # The backer image is created when the VM is started
+        cmd += ['-device', 'ahci,id=ahci0,bus=pci.0,multifunction=on']
+        # AHCI disks can't have their own I/O thread, the rest of the disk
+        # profile applies
+        cmd += ['-drive', 'file={0},if=none,id=drive-sata-disk0,format=qcow2{1}'.format(self.get_backer_image_path(),
+                                                                                       self._get_drive_options_())]
+        cmd += ['-device', 'ide-drive,bus=ahci0.0,drive=drive-sata-disk0']
 
         cmd.append('-nographic')
-        cmd.append(kvm_options['cores'].format(self.cores))
-        cmd.append(kvm_options['ram'].format(self.ram))
+        cmd += kvm_option(kvm_options['cores'], self.cores)
+        cmd += kvm_option(kvm_options['ram'], self.ram)
 
         # Build backend parameters for the mgmt port
-        mgmt_str = '-device e1000,netdev=mgmt0,mac={0}'.format(self.get_eth0_mac())
-        cmd.append(mgmt_str)
-
-        cmd.append('-name {0}'.format(self.name))
-
-        for i, link in enumerate(self.links):
-            slot, func, multifunc = self.get_pci_info(i)
-
-            link_params = {'daddr': '127.0.0.1',
-                           'saddr': '127.0.0.1',
-                           'mac': self.get_intf_mac(i),
-                           'slot': slot,
-                           'function': func,
-                           'multifunction': multifunc,
-                           'dev': i}
-
-            if self.name == link.get_source().split(':')[0]:
-                sport = link.get('local_port')
-                dport = link.get('remote_port')
-                name = link.get_source().split(':')[1]
-            elif self.name == link.get_destination().split(':')[0]:
-                sport =link.get('remote_port')
-                dport = link.get('local_port')
-                name = link.get_destination().split(':')[1]
+        cmd += ['-device', 'e1000,netdev=mgmt0,mac={0}'.format(self.get_eth0_mac())]
 
-            link_params['sport'] = sport
-            link_params['dport'] = dport
-            link_params['name'] = name
+        cmd += ['-name', self.name]
 
-            cmd.append(self.links_format.format(**link_params))
+        cmd += self._build_kvm_intfs_(self.links_format)
+        cmd += self._build_config_media_options_()
+        cmd += self._build_golden_options_()
 
         return cmd
 
@@ -528,10 +1798,31 @@ class AristaVmType(DefaultVmType):
     """
     image = 'arista_eos-4.21.3'
 
+    # EOS copies 'startup-config' from the config media to flash on boot
+    config_media_label = 'config'
+
+    # EOS is started by Aboot from the image
+    direct_boot = False
+
     def __init__(self, **kwargs):
         super(AristaVmType, self).__init__(**kwargs)
         self.image = '-hda {0}'
 
+    def get_config_files(self):
+        """
+        Method Name:        get_config_files
+
+        Parameters:         None
+
+        Description:        EOS startup config with the hostname and a
+                            description of the peer of every interface,
+                            followed by the node's startup config
+        """
+        config = 'hostname {0}\n'.format(self.name) + self._get_interface_config_('   ')
+
+        return {'startup-config': config + (self.startup_config or ''),
+                'links.json': self._get_links_json_()}
+
     def build_kvm_cmdline(self):
         """
         Method Name:        build_kvm_cmdline
@@ -549,14 +1840,105 @@ class AristaVmType(DefaultVmType):
         for port_type in default_vm_port_types[2:]:
             fwd_port_str += kvm_options['fwd_ports'].format(self.params[port_type], port_type)
 
-        cmd.append(kvm_options['eth0']+fwd_port_str)
-        cmd.append(kvm_options['nic'].format(self.get_eth0_mac()))
+        cmd += kvm_option(kvm_options['eth0']+fwd_port_str)
+        cmd += kvm_option(kvm_options['nic'], self.get_eth0_mac())
+
+        # The backer image is created when the VM is started.  '-hda' can't
+        # take drive options, so a disk profile uses the '-drive' it stands
+        # for.  IDE disks can't have their own I/O thread.
+        if self._get_drive_options_():
+            cmd += ['-drive', 'file={0},index=0,media=disk{1}'.format(self.get_backer_image_path(),
+                                                                      self._get_drive_options_())]
+        else:
+            cmd += kvm_option(self.image, self.get_backer_image_path())
+        cmd += self._build_config_media_options_()
+        cmd += self._build_golden_options_()
+
+        return cmd
+
+class DirectBootVmType(DefaultVmType):
+    """
+    Class Name:     DirectBootVmType
+    Description:    VM that boots the kernel of its image directly on a
+                    'q35' machine without any of the default devices, so
+                    none of the boot time goes into emulated firmware and
+                    boot loaders.  The builder uses it instead of the VM
+                    type of a node when the image depot has a kernel for
+                    the node's image (see ImageDepot.get_boot_files), and
+                    only virtio PCI devices are attached.
+    """
+    bus_type = 'pcie'
+
+    # Kernel command line when the image doesn't come with a 'cmdline'
+    # file.  The overlay is the first virtio disk.
+    default_append = 'console=ttyS0 root=/dev/vda rw'
+
+    def __init__(self, **kwargs):
+        super(DirectBootVmType, self).__init__(**kwargs)
+
+        self.boot_files = kwargs.get('boot_files')
+        if not self.boot_files or not self.boot_files.get('kernel'):
+            raise NoQcow2Image('No kernel was found for {0}'.format(self.base_image))
+
+    def get_kernel_append(self):
+        """
+        Method Name:        get_kernel_append
+
+        Parameters:         None
+
+        Description:        Kernel command line, from the 'cmdline' file next
+                            to the kernel if there is one
+
+        Returns:            str
+        """
+        if self.boot_files.get('cmdline'):
+            with open(self.boot_files['cmdline'], 'r') as stream:
+                return ' '.join(stream.read().split())
+
+        return self.default_append
+
+    def build_kvm_cmdline(self):
+        """
+        Method Name:        build_kvm_cmdline
+
+        Parameters:         None
+
+        Description:        This method creates the command line to be used to start this particular
+                            node.
+        """
+        cmd = [kvm_binary, '-enable-kvm', '-nographic', '-nodefaults', '-no-user-config',
+               '-machine', 'q35,accel=kvm', '-name', self.name, '-cpu', 'host']
+
+        for port_type in ['serial', 'monitor']:
+            cmd += kvm_option(kvm_options[port_type], self.params[port_type])
+
+        cmd += kvm_option(kvm_options['cores'], self.cores)
+        cmd += kvm_option(kvm_options['ram'], self.ram)
+
+        cmd += ['-kernel', self.boot_files['kernel']]
+        if self.boot_files.get('initrd'):
+            cmd += ['-initrd', self.boot_files['initrd']]
+        cmd += ['-append', self.get_kernel_append()]
+
+        cmd += self._build_kvm_intfs_()
+
+        # The management interface is a virtio NIC instead of the
+        # emulated NIC of the 'pc' machine
+        fwd_port_str = ""
+        for port_type in default_vm_port_types[2:]:
+            fwd_port_str += kvm_options['fwd_ports'].format(self.params[port_type], port_type)
+
+        cmd += ['-netdev', 'user,id=mgmt0,net=192.168.0.15/24{0}'.format(fwd_port_str),
+                '-device', 'virtio-net-pci,netdev=mgmt0,mac={0}'.format(self.get_eth0_mac())]
 
-        # Create a backer image
-        cmd.append(self.image.format(self.create_backer_image()))
+        # The backer image is created when the VM is started
+        cmd += self._build_disk_options_()
+        cmd += self._build_config_media_options_()
+        cmd += self._build_golden_options_()
 
         return cmd
 
+
 vm_type_map = { 'cumulus':  CumulusVmType,
                 'cisco':    CiscoVmType,
                 'arista':   AristaVmType,
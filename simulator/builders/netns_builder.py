@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import shlex
+import platform
+import simulator
+from simulator.builders.kvm_builder import KvmBuilder, DefaultVmType, vm_type_map, dot_string
+from simulator.utilities.NetnsNode import netns_dir, namespace_name, list_namespaces
+import logging
+from simulator.utilities.LogWrapper import getLogger
+
+log = getLogger(__name__)
+
+
+class NetnsNodeType(DefaultVmType):
+    """
+    Class Name:     NetnsNodeType
+    Description:    Node that runs in a Linux network namespace instead of a
+                    VM, for hosts and simple routers that don't need a NOS.
+                    It is started in milliseconds and only uses the memory
+                    of its command.
+
+                    The links to other namespace nodes are veth pairs that
+                    the builder creates.  The links to VMs are tap devices
+                    whose frames are forwarded to the UDP socket of the VM's
+                    end of the link by the node's process (see NetnsNode),
+                    so the VMs are started the same way as always.
+    """
+    image = None
+    namespace = True
+    direct_boot = False
+
+    # Command that is run in the namespace, the node attribute 'command'
+    # overrides it (e.g. to start FRR).  The node is stopped when it exits.
+    command = ['sleep', 'infinity']
+
+    def __init__(self, **kwargs):
+        super(NetnsNodeType, self).__init__(**kwargs)
+
+        # Names of the nodes (this one included) that run in namespaces,
+        # set by the builder.  The links between them are veth pairs.
+        self.namespace_peers = set([self.name])
+
+    def get_backer_image_path(self):
+        return None
+
+    def get_overlay_base(self):
+        return None
+
+    def get_golden_request(self):
+        return None
+
+    def _get_link_ends_(self):
+        # (interface, peer node, peer interface, local port, remote port) of
+        # every link, in the order of 'links'
+        ends = []
+        for link in self.links:
+            is_source, local, peer = self._split_link_(link)
+
+            if is_source:
+                ends.append((local[1], peer[0], peer[1], link.get('local_port'), link.get('remote_port')))
+            else:
+                ends.append((local[1], peer[0], peer[1], link.get('remote_port'), link.get('local_port')))
+
+        return ends
+
+    def get_namespace_request(self):
+        """
+        Method Name:        get_namespace_request
+
+        Parameters:         None
+
+        Description:        The veth pairs that are created with the
+                            namespace of this node.  A pair between two
+                            namespace nodes is created by the node that is
+                            the source of the link.
+
+        Returns:            dict
+                             - 'veths': [interface, peer node, peer
+                               interface] lists
+        """
+        veths = []
+        for link, (intf, peer, peer_intf, _, _) in zip(self.links, self._get_link_ends_()):
+            if peer in self.namespace_peers and self._split_link_(link)[0]:
+                veths.append([intf, peer, peer_intf])
+
+        return {'veths': veths}
+
+    def build_kvm_cmdline(self):
+        """
+        Method Name:        build_kvm_cmdline
+
+        Parameters:         None
+
+        Description:        Command line of the process of the node, which
+                            sets up its interfaces, runs its command in the
+                            namespace and forwards the frames of the links
+                            to VMs
+        """
+        pkg_root = os.path.dirname(os.path.dirname(os.path.abspath(simulator.__file__)))
+
+        cmd = ['env', 'PYTHONPATH={0}'.format(pkg_root), sys.executable, '-m', 'simulator.utilities.NetnsNode',
+               '--sim-dir', self.base_sim_dir, '--node', self.name]
+
+        for (intf, peer, _, sport, dport), mac in zip(self._get_link_ends_(), self.addresses.intf_macs):
+            if peer in self.namespace_peers:
+                cmd += ['--link', '{0},{1}'.format(intf, mac)]
+            else:
+                cmd += ['--bridge', '{0},{1},{2},{3}'.format(intf, mac, sport, dport)]
+
+        return cmd + ['--'] + list(self.command)
+
+
+netns_vm_type_map = {'host':    NetnsNodeType,
+                     'netns':   NetnsNodeType}
+
+
+class NetnsBuilder(KvmBuilder):
+    """
+    Class Name:         NetnsBuilder
+    Description:        Builder for topologies where some of the nodes run in
+                        network namespaces (see NetnsNodeType).  A node is run
+                        in a namespace when its 'builder' attribute is 'netns'
+                        or its 'vm_type' is one of 'netns_vm_type_map', the
+                        rest of the nodes are KVM VMs, the same as with the
+                        KvmBuilder.  The namespaces are named after the
+                        simulation directory, so they are found again when
+                        the simulation is stopped.
+    """
+    name = 'netns'
+    preference = 20
+
+    def _get_vm_types_(self):
+        vm_types = dict(vm_type_map)
+        vm_types.update(netns_vm_type_map)
+        return vm_types
+
+    def _get_vm_type_class_(self, vm_type, builder=None):
+        vm_type = str(vm_type).strip('"') if vm_type is not None else None
+        if (builder is not None and str(builder).strip('"') == self.name) or vm_type in netns_vm_type_map:
+            return NetnsNodeType
+
+        return super(NetnsBuilder, self)._get_vm_type_class_(vm_type, builder)
+
+    def _construct_vms_(self):
+        super(NetnsBuilder, self)._construct_vms_()
+
+        namespaces = set(name for name, vm in self.nodes.items() if vm.namespace)
+        commands = self.topology.get_attribute_column('command')
+
+        for name in namespaces:
+            vm = self.nodes[name]
+            vm.namespace_peers = namespaces
+            if commands.get(name) is not None:
+                vm.command = shlex.split(dot_string(commands[name]))
+
+    def prepare_namespaces(self, plan):
+        """
+        Method Name:        prepare_namespaces
+
+        Parameters:         plan
+                             - LaunchPlan that is going to be started
+
+        Description:        Create the namespaces of the nodes and the veth
+                            pairs between them with a single 'ip -batch'.
+                            Namespaces that a stopped simulation in the same
+                            directory left behind are deleted first, unless
+                            the start is resumed.
+        """
+        requests = dict((name, node['netns']) for name, node in plan.nodes.items() if node.get('netns'))
+        if not requests:
+            return
+
+        commands = []
+        existing = set(list_namespaces(self.sim_dir))
+        if not self._resumed_:
+            commands += ['netns del {0}'.format(namespace) for namespace in sorted(existing)]
+            existing = set()
+
+        created = set()
+        for name in requests:
+            if namespace_name(self.sim_dir, name) not in existing:
+                commands.append('netns add {0}'.format(namespace_name(self.sim_dir, name)))
+                created.add(name)
+
+        for name, request in requests.items():
+            for intf, peer, peer_intf in request['veths']:
+                if name in created or peer in created:
+                    commands.append('link add {0} netns {1} type veth peer name {2} netns {3}'.format(
+                                    intf, namespace_name(self.sim_dir, name), peer_intf,
+                                    namespace_name(self.sim_dir, peer)))
+
+        with self.tracer.span('namespaces', count=len(created)):
+            self._get_launcher_().ip_batch(commands)
+
+    def prepare_stop(self, run_from_cmd_line=True, nodes=None):
+        """
+        Method Name:        prepare_stop
+
+        Parameters:         run_from_cmd_line
+                             - Boolean value indicating if the stop was called
+                               by a different processes
+                            nodes
+                             - {node name: {'pid': PID, 'udp_ports': [ports]}}
+                               of the nodes to stop.  By default, every node
+                               in the state of the simulation.
+
+        Description:        The same as for the KvmBuilder, and the
+                            namespaces of the nodes are deleted.  A namespace
+                            goes away with the last process in it, so it is
+                            deleted before the processes are killed.
+
+        Returns:            list
+                             - PIDs to kill
+        """
+        if nodes is None:
+            namespaces = list_namespaces(self.sim_dir)
+        else:
+            existing = set(list_namespaces(self.sim_dir))
+            namespaces = [namespace_name(self.sim_dir, name) for name in nodes
+                          if namespace_name(self.sim_dir, name) in existing]
+
+        kill_pids = super(NetnsBuilder, self).prepare_stop(run_from_cmd_line, nodes)
+
+        if namespaces:
+            with self.tracer.span('namespaces', count=len(namespaces)):
+                self._get_launcher_().ip_batch(['netns del {0}'.format(namespace) for namespace in namespaces])
+
+        return kill_pids
+
+    def _get_kill_pids_(self, name, pid):
+        # The process of a namespace node is killed with its command, so
+        # the supervisor sees that it was stopped
+        if os.path.exists(os.path.join(netns_dir, namespace_name(self.sim_dir, name))):
+            return [pid.pid] + [child.pid for child in pid.children(recursive=True)]
+
+        return super(NetnsBuilder, self)._get_kill_pids_(name, pid)
+
+    @staticmethod
+    def is_builder_supported():
+        return platform.system() == 'Linux' and os.path.exists('/dev/net/tun') and \
+               any(os.access(os.path.join(directory, 'ip'), os.X_OK)
+                   for directory in os.environ.get('PATH', '').split(os.pathsep) + ['/sbin', '/usr/sbin'])
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+import logging
+from simulator.utilities.LogWrapper import getLogger
+
+log = getLogger(__name__)
+
+# Slots of a bus that the interfaces can use.  The slots below 6 are left
+# for the devices that QEMU adds itself (host bridge, ISA bridge, VGA, the
+# management NIC, ...).  Slot 0 of a pci-bridge is left free as well.
+root_bus_slots = list(range(6, 32))
+bridge_slots = list(range(1, 32))
+pci_functions = 8
+
+# Interfaces get up to 16 bits of interface index and 22 bits of node ID.
+# The top 6 bits of the node ID go in the first octet, shifted past the
+# multicast and locally administered bits, so nodes with IDs below 65536
+# keep the addresses they always had.
+max_node_id = (1 << 22) - 1
+max_intf_id = (1 << 16) - 1
+bus_types = ['pci', 'pcie']
+
+
+class NoMorePciSlots(Exception):
+    pass
+
+
+class AddressSpaceExhausted(Exception):
+    pass
+
+
+def _mac_(node_id, second_octet, third_octet, last_octet):
+    if node_id < 0 or node_id > max_node_id:
+        raise AddressSpaceExhausted('The node ID {0} is out of range (0-{1})'.format(node_id, max_node_id))
+
+    return '{0:02x}:{1:02x}:{2:02x}:{3:02x}:{4:02x}:{5:02x}'.format((node_id >> 16) << 2, second_octet,
+                                                                    third_octet, (node_id >> 8) & 0xff,
+                                                                    node_id & 0xff, last_octet)
+
+
+def eth0_mac(node_id):
+    """
+    Function Name:      eth0_mac
+
+    Parameters:         node_id
+                         - The 'id' of the node
+
+    Description:        MAC address of the management interface of a node
+
+    Returns:            str
+    """
+    return _mac_(node_id, 0x0a, 0, 0)
+
+
+def intf_mac(node_id, intf_id):
+    """
+    Function Name:      intf_mac
+
+    Parameters:         node_id
+                         - The 'id' of the node
+                        intf_id
+                         - Index of the interface on the node
+
+    Description:        MAC address of an interface of a node.  Every
+                        (node ID, interface index) pair in range gets its own
+                        address.
+
+    Returns:            str
+    """
+    if intf_id < 0 or intf_id > max_intf_id:
+        raise AddressSpaceExhausted('The interface index {0} is out of range (0-{1})'.format(intf_id, max_intf_id))
+
+    return _mac_(node_id, 0x02, intf_id >> 8, intf_id & 0xff)
+
+
+class PciLayout(object):
+    """
+    Class Name:         PciLayout
+    Description:        PCI addresses for a number of interfaces.  If the
+                        interfaces fit on the root bus they are put there, the
+                        same way that they always have been.  Otherwise bridges
+                        are added to the root bus and the interfaces are put
+                        behind them:
+
+                            pci     - 'pci-bridge' devices with 31 slots of 8
+                                      functions each (the 'pc' machine)
+                            pcie    - 'pcie-root-port' devices with 8
+                                      functions each (the 'q35' machine)
+
+                        'devices' has the argv of the bridges and 'addresses'
+                        has a (bus, addr, multifunction) tuple for every
+                        interface, where 'bus' is None for the root bus.
+    """
+    def __init__(self, count, bus_type='pci'):
+        if bus_type not in bus_types:
+            raise ValueError('{0} isn\'t one of {1}'.format(bus_type, bus_types))
+
+        self.count = count
+        self.bus_type = bus_type
+        self.root_bus = 'pcie.0' if bus_type == 'pcie' else 'pci.0'
+        self.devices = []
+        self.addresses = []
+
+        if count <= len(root_bus_slots) * pci_functions:
+            self._fill_(None, root_bus_slots, count)
+        elif bus_type == 'pcie':
+            self._add_root_ports_()
+        else:
+            self._add_pci_bridges_()
+
+    def _fill_(self, bus, slots, count):
+        for slot in slots:
+            for function in range(pci_functions):
+                if len(self.addresses) == count:
+                    return
+
+                self.addresses.append((bus, '{0:x}.{1:x}'.format(slot, function),
+                                       'on' if function == 0 else 'off'))
+
+    def _add_pci_bridges_(self):
+        per_bridge = len(bridge_slots) * pci_functions
+        needed = (self.count + per_bridge - 1) // per_bridge
+
+        if needed > len(root_bus_slots):
+            raise NoMorePciSlots('{0} interfaces need more than {1} PCI bridges'.format(self.count, len(root_bus_slots)))
+
+        for i, slot in enumerate(root_bus_slots[:needed]):
+            bus = 'pci.{0}'.format(i + 1)
+            self.devices += ['-device', 'pci-bridge,id={0},chassis_nr={1},bus={2},addr={3:x}'.format(
+                             bus, i + 1, self.root_bus, slot)]
+            self._fill_(bus, bridge_slots, min(self.count, len(self.addresses) + per_bridge))
+
+    def _add_root_ports_(self):
+        # A root port has a single slot below it, so it holds up to 8
+        # interfaces as functions of that slot.  The root ports themselves
+        # are functions of the slots of the root bus.
+        needed = (self.count + pci_functions - 1) // pci_functions
+
+        if needed > len(root_bus_slots) * pci_functions:
+            raise NoMorePciSlots('{0} interfaces need more than {1} PCIe root ports'.format(
+                                 self.count, len(root_bus_slots) * pci_functions))
+
+        for i in range(needed):
+            slot = root_bus_slots[i // pci_functions]
+            function = i % pci_functions
+            bus = 'rp{0}'.format(i)
+            self.devices += ['-device', 'pcie-root-port,id={0},chassis={1},bus={2},addr={3:x}.{4:x}{5}'.format(
+                             bus, i + 1, self.root_bus, slot, function,
+                             ',multifunction=on' if function == 0 else '')]
+            self._fill_(bus, [0], min(self.count, len(self.addresses) + pci_functions))
+
+
+class NodeAddresses(object):
+    """
+    Class Name:         NodeAddresses
+    Description:        The PCI bridges, and the PCI address and MAC address of
+                        every interface, of a single node
+    """
+    def __init__(self, node_id, layout):
+        self.node_id = node_id
+        self.layout = layout
+        self.eth0_mac = eth0_mac(node_id)
+        self.intf_macs = [intf_mac(node_id, i) for i in range(layout.count)]
+
+    @property
+    def devices(self):
+        return self.layout.devices
+
+    def get_pci_info(self, idx):
+        """
+        Method Name:    get_pci_info
+
+        Parameters:     idx
+                          - The index number of the interface
+
+        Description:    PCI address of an interface
+
+        Returns:        tuple
+                          - (bus, addr, multifunction).  'bus' is None for
+                            the root bus.
+        """
+        return self.layout.addresses[idx]
+
+    def get_device_bus(self, idx):
+        """
+        Method Name:    get_device_bus
+
+        Parameters:     idx
+                          - The index number of the interface
+
+        Description:    The 'bus=...,' part of the '-device' option of an
+                        interface, empty for the root bus
+
+        Returns:        str
+        """
+        bus = self.layout.addresses[idx][0]
+        return 'bus={0},'.format(bus) if bus else ''
+
+
+class AddressAllocator(object):
+    """
+    Class Name:         AddressAllocator
+    Description:        Assigns the PCI and MAC addresses of all of the nodes
+                        of a topology at once.  The PCI layout only depends on
+                        the number of interfaces, so it is computed once for
+                        every interface count and bus type and shared by the
+                        nodes.
+    """
+    def __init__(self):
+        self.layouts = {}
+        self.nodes = {}
+        self.node_ids = {}
+
+    def get_layout(self, count, bus_type='pci'):
+        key = (count, bus_type)
+        if key not in self.layouts:
+            self.layouts[key] = PciLayout(count, bus_type)
+
+        return self.layouts[key]
+
+    def allocate(self, name, node_id, count, bus_type='pci'):
+        """
+        Method Name:    allocate
+
+        Parameters:     name
+                          - Name of the node
+                        node_id
+                          - The 'id' of the node
+                        count
+                          - Number of interfaces of the node
+                        bus_type
+                          - 'pci' or 'pcie', see PciLayout
+
+        Description:    Assign the addresses of a node.  Nodes that share an
+                        ID would share MAC addresses as well, so that is
+                        logged.
+
+        Returns:        NodeAddresses
+        """
+        if node_id in self.node_ids and self.node_ids[node_id] != name:
+            log.warn('{0} and {1} have the same id {2}, so their MAC addresses are the same'.format(
+                     self.node_ids[node_id], name, node_id))
+        self.node_ids.setdefault(node_id, name)
+
+        self.nodes[name] = NodeAddresses(node_id, self.get_layout(count, bus_type))
+        return self.nodes[name]
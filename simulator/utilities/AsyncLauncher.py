@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import signal
+import asyncio
+import logging
+from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.PrivHelper import PrivLauncher, PrivHelperError
+
+log = getLogger(__name__)
+
+# Replies of big batches (e.g. 'status' of every VM) don't fit in the
+# default 64 KB line limit of asyncio streams
+reply_limit = 16 * 1024 * 1024
+
+
+async def async_request(socket_path, requests):
+    """
+    Function Name:      async_request
+
+    Parameters:         socket_path
+                         - Unix socket of a PrivHelper or the host daemon
+                        requests
+                         - List of request dictionaries
+
+    Description:        Send a batch of requests without blocking the event
+                        loop
+
+    Returns:            list
+                         - Result dictionary for every request
+    """
+    reader, writer = await asyncio.open_unix_connection(socket_path, limit=reply_limit)
+    try:
+        writer.write(json.dumps({'requests': requests}).encode('utf-8') + b'\n')
+        await writer.drain()
+        data = await reader.readline()
+    finally:
+        writer.close()
+
+    try:
+        return json.loads(data.decode('utf-8'))['results']
+    except (ValueError, KeyError) as e:
+        raise PrivHelperError('Bad reply from {0}: {1}'.format(socket_path, e))
+
+
+class AsyncLauncher(object):
+    """
+    Class Name:         AsyncLauncher
+    Description:        asyncio version of the PrivLauncher.  The requests are
+                        sent to the helper of the simulation (or to the
+                        socket given, e.g. the host daemon) over a
+                        non-blocking connection.  Without a helper, the
+                        commands are run as asyncio subprocesses.
+    """
+    def __init__(self, sim_dir, use_helper=True, socket_path=None):
+        self.sim_dir = sim_dir
+        self.sync = PrivLauncher(sim_dir, use_helper)
+        self.socket_path = socket_path or self.sync.socket_path
+        self.use_helper = use_helper
+
+    async def is_alive(self):
+        if not os.path.exists(self.socket_path):
+            return False
+
+        try:
+            await async_request(self.socket_path, [{'op': 'ping'}])
+        except (OSError, PrivHelperError):
+            return False
+        else:
+            return True
+
+    async def start(self):
+        if not self.use_helper or await self.is_alive():
+            return
+
+        cmd = self.sync.helper_command()
+        log.debug('Starting the privileged helper: {0}'.format(" ".join(cmd)))
+
+        # The helper daemonizes, so this returns once its socket is ready
+        proc = await asyncio.create_subprocess_exec(*cmd)
+        if await proc.wait() != 0 or not await self.is_alive():
+            log.warn('Couldn\'t start the privileged helper, running every request with sudo')
+            self.use_helper = False
+
+    async def request(self, requests):
+        if self.use_helper and os.path.exists(self.socket_path):
+            return await async_request(self.socket_path, requests)
+
+        return list(await asyncio.gather(*[self._run_locally_(request) for request in requests]))
+
+    async def _run_locally_(self, request):
+        op = request['op']
+
+        if op == 'spawn':
+            # The VMs have to outlive the event loop, and asyncio kills the
+            # processes it started when their transports are closed.  Popen
+            # doesn't wait for anything, so the loop isn't blocked.
+            return self.sync._run_locally_(request)
+        elif op == 'kill':
+            if request['pids']:
+                cmd = self.sync._sudo_() + ['kill', '-{0}'.format(request.get('signal', signal.SIGKILL))]
+                proc = await asyncio.create_subprocess_exec(*(cmd + [str(pid) for pid in request['pids']]),
+                                                            stdout=asyncio.subprocess.DEVNULL,
+                                                            stderr=asyncio.subprocess.DEVNULL)
+                await proc.wait()
+            return {'errors': {}}
+        elif op == 'create_overlay':
+            overlay_dir = os.path.dirname(request['overlay'])
+            if not os.path.exists(overlay_dir):
+                os.makedirs(overlay_dir)
+
+            cmd = self.sync._sudo_() + ['qemu-img', 'create', '-b', request['base_image'],
+                                        '-f', 'qcow2', request['overlay']]
+            try:
+                proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE,
+                                                            stderr=asyncio.subprocess.PIPE)
+            except OSError as e:
+                return {'returncode': 1, 'stderr': str(e)}
+
+            out, err = await proc.communicate()
+            return {'returncode': proc.returncode, 'stderr': err.decode('utf-8', 'replace')}
+        elif op in ['ping', 'shutdown']:
+            return {}
+        else:
+            return {'error': '{0} is only supported by the helper'.format(op)}
+
+    async def spawn(self, argv_list, stdout=None, stderr=None, logs_list=None, supervise_list=None):
+        logs_list = logs_list or [None] * len(argv_list)
+        supervise_list = supervise_list or [None] * len(argv_list)
+        results = await self.request([{'op': 'spawn', 'argv': argv, 'stdout': stdout, 'stderr': stderr,
+                                       'logs': logs, 'supervise': supervise}
+                                      for argv, logs, supervise in zip(argv_list, logs_list, supervise_list)])
+        return [r.get('pid') for r in results]
+
+    async def kill(self, pids, sig=signal.SIGKILL):
+        return (await self.request([{'op': 'kill', 'pids': list(pids), 'signal': int(sig)}]))[0]
+
+    async def status(self):
+        """
+        Method Name:    status
+
+        Parameters:     None
+
+        Description:    Exit codes of every process started by the helper
+
+        Returns:        dict
+                          - {PID: exit code, or None if it is running}
+        """
+        if not (self.use_helper and os.path.exists(self.socket_path)):
+            return {}
+
+        result = (await self.request([{'op': 'status'}]))[0]
+        return dict((int(pid), rc) for pid, rc in result.get('status', {}).items())
+
+    async def create_overlays(self, overlays):
+        results = await self.request([{'op': 'create_overlay', 'base_image': base, 'overlay': overlay}
+                                      for base, overlay in overlays])
+
+        for (base, overlay), result in zip(overlays, results):
+            if result.get('returncode') or result.get('error'):
+                log.warn('Creating {0} failed: {1}'.format(overlay, result.get('stderr') or result.get('error')))
+
+        return [r.get('returncode') for r in results]
+
+    async def shutdown(self):
+        if self.socket_path != self.sync.socket_path:
+            # Never stop the host daemon, it outlives the simulations
+            return
+
+        if self.use_helper and await self.is_alive():
+            await async_request(self.socket_path, [{'op': 'shutdown'}])
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+import time
+import errno
+import select
+import socket
+import logging
+from collections import deque
+from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.TopoStream import unquote_name, split_end, attribute_is_set
+
+log = getLogger(__name__)
+
+boot_strategies = ['priority', 'bfs', 'components', 'all']
+
+# The forwarded SSH port is the third port of every node (see
+# 'default_vm_port_types' of the KVM builder)
+ssh_port_index = 2
+
+
+class UnknownBootStrategy(Exception):
+    pass
+
+
+class BootOrder(object):
+    """
+    Class Name:         BootOrder
+    Description:        Splits the nodes of a topology into stages that are
+                        brought up one after the other:
+
+                            priority    - by the 'boot_priority' attribute of
+                                          the nodes, lowest first.  Nodes
+                                          without one come last.
+                            bfs         - BFS layers from the root nodes
+                                          (the 'roots' given or the nodes
+                                          with 'boot_root' set).  Nodes that
+                                          can't be reached come last.
+                            components  - every connected component is a
+                                          stage, the biggest first
+                            all         - a single stage
+
+                        Without a strategy, 'priority' is used if a node has
+                        a 'boot_priority', 'bfs' if a node has 'boot_root'
+                        and 'all' otherwise.
+    """
+    def __init__(self, topology, strategy=None, roots=None):
+        if strategy and strategy not in boot_strategies:
+            raise UnknownBootStrategy('{0} isn\'t one of {1}'.format(strategy, boot_strategies))
+
+        self.topology = topology
+        self.strategy = strategy
+        self.roots = roots
+
+        # Build the node list and adjacency once, every strategy is
+        # O(nodes + edges) from here
+        self.nodes = topology.get_nodes()
+        self.names = [unquote_name(node.get_name()) for node in self.nodes]
+        self.adjacency = dict((name, []) for name in self.names)
+
+        for edge in topology.graph.get_edges():
+            src = split_end(edge.get_source())[0]
+            dst = split_end(edge.get_destination())[0]
+            if src in self.adjacency and dst in self.adjacency:
+                self.adjacency[src].append(dst)
+                self.adjacency[dst].append(src)
+
+    def _get_roots_(self):
+        if self.roots:
+            roots = [unquote_name(root) for root in self.roots]
+            return [root for root in roots if root in self.adjacency]
+
+        return [name for node, name in zip(self.nodes, self.names) if attribute_is_set(node.get('boot_root'))]
+
+    def get_strategy(self):
+        if self.strategy:
+            return self.strategy
+
+        if any(node.get('boot_priority') is not None for node in self.nodes):
+            return 'priority'
+        elif self._get_roots_():
+            return 'bfs'
+
+        return 'all'
+
+    def stages(self):
+        """
+        Method Name:    stages
+
+        Parameters:     None
+
+        Description:    Split the nodes into stages
+
+        Returns:        list
+                          - List of stages, every stage is a list of node
+                            names in the order of the topology
+        """
+        strategy = self.get_strategy()
+
+        if strategy == 'priority':
+            stages = self._by_priority_()
+        elif strategy == 'bfs':
+            stages = self._by_bfs_()
+        elif strategy == 'components':
+            stages = self._by_components_()
+        else:
+            stages = [list(self.names)]
+
+        return [stage for stage in stages if stage]
+
+    def _by_priority_(self):
+        priorities = {}
+        last = []
+
+        for node, name in zip(self.nodes, self.names):
+            priority = node.get('boot_priority')
+            if priority is None:
+                last.append(name)
+                continue
+
+            try:
+                priority = int(str(priority).strip('"'))
+            except ValueError:
+                log.warn('{0} has a boot_priority that isn\'t a number: {1}'.format(name, priority))
+                last.append(name)
+                continue
+
+            priorities.setdefault(priority, []).append(name)
+
+        return [priorities[priority] for priority in sorted(priorities)] + [last]
+
+    def _by_bfs_(self):
+        layer_of = {}
+        queue = deque()
+
+        for root in self._get_roots_():
+            layer_of[root] = 0
+            queue.append(root)
+
+        while queue:
+            name = queue.popleft()
+            for neighbor in self.adjacency[name]:
+                if neighbor not in layer_of:
+                    layer_of[neighbor] = layer_of[name] + 1
+                    queue.append(neighbor)
+
+        layers = [[] for _ in range(max(layer_of.values()) + 1)] if layer_of else []
+        unreachable = []
+        for name in self.names:
+            if name in layer_of:
+                layers[layer_of[name]].append(name)
+            else:
+                unreachable.append(name)
+
+        return layers + [unreachable]
+
+    def _by_components_(self):
+        component_of = {}
+        components = []
+
+        for name in self.names:
+            if name in component_of:
+                continue
+
+            component_of[name] = len(components)
+            members = [name]
+            queue = deque([name])
+            while queue:
+                current = queue.popleft()
+                for neighbor in self.adjacency[current]:
+                    if neighbor not in component_of:
+                        component_of[neighbor] = len(components)
+                        members.append(neighbor)
+                        queue.append(neighbor)
+
+            components.append(members)
+
+        # Keep the members in the order of the topology
+        order = dict((name, i) for i, name in enumerate(self.names))
+        components = [sorted(members, key=order.get) for members in components]
+
+        return sorted(components, key=lambda members: -len(members))
+
+
+def wait_nodes_ready(ports, timeout=300, interval=2.0):
+    """
+    Function Name:      wait_nodes_ready
+
+    Parameters:         ports
+                         - {node name: local port forwarded to its SSH port}
+                        timeout
+                         - Seconds to wait for all of the nodes
+                        interval
+                         - Seconds between checks of a node
+
+    Description:        Wait until the nodes send an SSH banner.  QEMU
+                        accepts connections on a forwarded port before the
+                        guest is up, so only the banner means that the node
+                        is usable.  All of the nodes are checked at once from
+                        a single poll loop.
+
+    Returns:            set
+                         - Names of the nodes that are ready
+    """
+    deadline = time.time() + timeout
+    ready = set()
+    pending = dict(ports)
+
+    while pending and time.time() < deadline:
+        round_end = min(time.time() + interval, deadline)
+        poller = select.poll()
+        socks = {}
+
+        for name, port in pending.items():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(0)
+            if sock.connect_ex(('127.0.0.1', port)) in (0, errno.EINPROGRESS):
+                socks[sock.fileno()] = (name, sock)
+                poller.register(sock.fileno(), select.POLLIN)
+            else:
+                sock.close()
+
+        while socks and time.time() < round_end:
+            try:
+                events = poller.poll(max(0, round_end - time.time()) * 1000)
+            except (select.error, IOError, OSError) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd, event in events:
+                name, sock = socks.pop(fd)
+                poller.unregister(fd)
+                try:
+                    banner = sock.recv(64)
+                except socket.error:
+                    banner = b''
+                sock.close()
+
+                if banner.startswith(b'SSH-'):
+                    ready.add(name)
+                    del pending[name]
+
+        for name, sock in socks.values():
+            sock.close()
+
+        time.sleep(max(0, round_end - time.time()))
+
+    return ready
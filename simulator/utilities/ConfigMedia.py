@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+
+import os
+import json
+import shutil
+import struct
+import hashlib
+import tempfile
+import subprocess
+import multiprocessing
+import logging
+from simulator.utilities.LogWrapper import getLogger
+
+log = getLogger(__name__)
+
+# The media are cached by the hash of their contents in this directory of
+# the simulation directory, so nodes with the same contents share them
+media_dir_name = 'config_media'
+
+media_extensions = {'iso': 'iso', 'fat': 'img'}
+
+# ISO images are made with the first one of these that is installed
+iso_tools = [['genisoimage'], ['mkisofs'], ['xorriso', '-as', 'mkisofs']]
+
+sector_size = 512
+sectors_per_cluster = 4
+root_entries = 512
+min_fat_sectors = 2880
+max_fat12_clusters = 4084
+
+# 1980-01-01 00:00, so the same files always give the same image
+fat_date = (0 << 9) | (1 << 5) | 1
+fat_time = 0
+
+
+class ConfigMediaError(Exception):
+    pass
+
+
+def get_media_job(sim_dir, fmt, label, files):
+    """
+    Function Name:      get_media_job
+
+    Parameters:         sim_dir
+                         - Simulation directory
+                        fmt
+                         - 'iso' or 'fat'
+                        label
+                         - Volume label
+                        files
+                         - {file name: contents}
+
+    Description:        Describe the config media of a node.  The path is
+                        the hash of the contents, so it is known before the
+                        media are made and the same contents give the same
+                        path.
+
+    Returns:            dict
+                         - 'path', 'format', 'label' and 'files'
+    """
+    if fmt not in media_extensions:
+        raise ConfigMediaError('Unknown config media format {0}'.format(fmt))
+
+    digest = hashlib.sha1(json.dumps([fmt, label, sorted(files.items())]).encode('utf-8')).hexdigest()
+    path = os.path.join(sim_dir, media_dir_name, '{0}.{1}'.format(digest, media_extensions[fmt]))
+
+    return {'path': path, 'format': fmt, 'label': label, 'files': dict(files)}
+
+
+def _short_name_(name, index):
+    # 8.3 name of the directory entry, the real name is in the long file
+    # name entries in front of it
+    base, _, ext = name.upper().rpartition('.') if '.' in name else (name.upper(), '', '')
+    suffix = '~{0}'.format(index)
+    base = ''.join(c for c in base if c.isalnum())[:8 - len(suffix)] or 'FILE'
+    ext = ''.join(c for c in ext if c.isalnum())[:3]
+
+    return (base + suffix).ljust(8).encode('ascii') + ext.ljust(3).encode('ascii')
+
+
+def _lfn_checksum_(short_name):
+    checksum = 0
+    for c in bytearray(short_name):
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + c) & 0xff
+
+    return checksum
+
+
+def _dir_entries_(name, index, cluster, size):
+    short_name = _short_name_(name, index)
+    checksum = _lfn_checksum_(short_name)
+
+    chars = [ord(c) for c in name] + [0]
+    chars += [0xffff] * (-len(chars) % 13)
+    chunks = [chars[i:i + 13] for i in range(0, len(chars), 13)]
+
+    entries = []
+    for seq, chunk in reversed(list(enumerate(chunks, 1))):
+        if seq == len(chunks):
+            seq |= 0x40
+        entries.append(struct.pack('<B5HBBB6HH2H', seq, *(chunk[:5] + [0x0f, 0, checksum] + chunk[5:11] + [0] + chunk[11:])))
+
+    entries.append(struct.pack('<11sBBBHHHHHHHI', short_name, 0x20, 0, 0, fat_time, fat_date, fat_date, 0,
+                               fat_time, fat_date, cluster if size else 0, size))
+
+    return b''.join(entries)
+
+
+def write_fat_image(path, label, files):
+    """
+    Function Name:      write_fat_image
+
+    Parameters:         path
+                         - File to write the image to
+                        label
+                         - Volume label, at most 11 characters
+                        files
+                         - {file name: contents}
+
+    Description:        Write a FAT12 file system with the files in its root
+                        directory.  It is written directly, so no tools have
+                        to be installed.
+    """
+    cluster_size = sector_size * sectors_per_cluster
+    contents = [(name, data.encode('utf-8') if not isinstance(data, bytes) else data)
+                for name, data in sorted(files.items())]
+
+    clusters = sum(max(1, -(-len(data) // cluster_size)) for _, data in contents)
+    if clusters > max_fat12_clusters - 16:
+        raise ConfigMediaError('The config files are too big for the config media')
+
+    root_sectors = root_entries * 32 // sector_size
+    fat_sectors = -(-((max_fat12_clusters + 2) * 3 // 2) // sector_size)
+    data_sectors = max(min_fat_sectors - 1 - 2 * fat_sectors - root_sectors, clusters * sectors_per_cluster)
+    data_sectors -= data_sectors % sectors_per_cluster
+    total_sectors = 1 + 2 * fat_sectors + root_sectors + data_sectors
+
+    label = label.upper()[:11].ljust(11).encode('ascii')
+    boot = struct.pack('<3s8sHBHBHHBHHHIIBBBI11s8s', b'\xeb\x3c\x90', b'PYDOTSIM', sector_size, sectors_per_cluster,
+                       1, 2, root_entries, total_sectors, 0xf8, fat_sectors, 32, 64, 0, 0,
+                       0x80, 0, 0x29, 0x12345678, label, b'FAT12   ')
+    boot = boot.ljust(510, b'\0') + b'\x55\xaa'
+
+    fat = [0xff8, 0xfff]
+    directory = [struct.pack('<11sB20s', label, 0x08, b'\0' * 20)]
+    data = []
+
+    for index, (name, contents_bytes) in enumerate(contents, 1):
+        first = len(fat)
+        count = max(1, -(-len(contents_bytes) // cluster_size))
+        fat += list(range(first + 1, first + count)) + [0xfff]
+        directory.append(_dir_entries_(name, index, first, len(contents_bytes)))
+        data.append(contents_bytes.ljust(count * cluster_size, b'\0'))
+
+    directory = b''.join(directory)
+    if len(directory) > root_entries * 32:
+        raise ConfigMediaError('Too many config files for the config media')
+
+    fat += [0] * (-len(fat) % 2)
+    table = bytearray()
+    for i in range(0, len(fat), 2):
+        pair = fat[i] | (fat[i + 1] << 12)
+        table += bytearray([pair & 0xff, (pair >> 8) & 0xff, (pair >> 16) & 0xff])
+    table = bytes(table).ljust(fat_sectors * sector_size, b'\0')
+
+    with open(path, 'wb') as stream:
+        stream.write(boot)
+        stream.write(table)
+        stream.write(table)
+        stream.write(directory.ljust(root_sectors * sector_size, b'\0'))
+        stream.write(b''.join(data))
+        stream.truncate(total_sectors * sector_size)
+
+
+def write_iso_image(path, label, files):
+    """
+    Function Name:      write_iso_image
+
+    Parameters:         path
+                         - File to write the image to
+                        label
+                         - Volume ID
+                        files
+                         - {file name: contents}
+
+    Description:        Write an ISO 9660 image (with Joliet and Rock Ridge
+                        names) with genisoimage, mkisofs or xorriso
+    """
+    tool = None
+    for candidate in iso_tools:
+        for directory in os.environ.get('PATH', '').split(os.pathsep):
+            if os.access(os.path.join(directory, candidate[0]), os.X_OK):
+                tool = candidate
+                break
+        if tool:
+            break
+    else:
+        raise ConfigMediaError('ISO config media need genisoimage, mkisofs or xorriso')
+
+    staging = tempfile.mkdtemp(prefix='config-media-')
+    try:
+        for name, contents in files.items():
+            with open(os.path.join(staging, name), 'wb') as stream:
+                stream.write(contents.encode('utf-8') if not isinstance(contents, bytes) else contents)
+
+        proc = subprocess.Popen(tool + ['-quiet', '-o', path, '-V', label, '-J', '-r', staging],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        _, stderr = proc.communicate()
+        if proc.returncode:
+            raise ConfigMediaError('{0} failed: {1}'.format(tool[0], stderr.decode('utf-8', 'replace').strip()))
+    finally:
+        shutil.rmtree(staging)
+
+
+def build_media(job):
+    """
+    Function Name:      build_media
+
+    Parameters:         job
+                         - dict from 'get_media_job'
+
+    Description:        Make the config media of a job unless they are
+                        already cached.  The image is written next to its
+                        final path and renamed, so a cached image is always
+                        complete.
+
+    Returns:            Boolean
+                         - True if the media were made, False if they were
+                           cached
+    """
+    if os.path.exists(job['path']):
+        return False
+
+    tmp_path = '{0}.{1}.tmp'.format(job['path'], os.getpid())
+    if job['format'] == 'iso':
+        write_iso_image(tmp_path, job['label'], job['files'])
+    else:
+        write_fat_image(tmp_path, job['label'], job['files'])
+
+    os.rename(tmp_path, job['path'])
+    return True
+
+
+def build_all_media(jobs, processes=None):
+    """
+    Function Name:      build_all_media
+
+    Parameters:         jobs
+                         - dicts from 'get_media_job'
+                        processes
+                          - Size of the process pool, the number of CPUs by
+                            default
+
+    Description:        Make the config media of every node that aren't
+                        cached yet, in a pool of processes
+
+    Returns:            int
+                         - Number of media that were made
+    """
+    missing = {}
+    for job in jobs:
+        if not os.path.exists(job['path']):
+            missing[job['path']] = job
+
+    if not missing:
+        return 0
+
+    for path in missing:
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    jobs = list(missing.values())
+    processes = min(len(jobs), processes or multiprocessing.cpu_count())
+    if processes <= 1:
+        return sum(build_media(job) for job in jobs)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        return sum(pool.map(build_media, jobs))
+    finally:
+        pool.close()
+        pool.join()
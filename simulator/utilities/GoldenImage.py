@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+import re
+import time
+import socket
+import logging
+from collections import namedtuple
+from simulator.utilities.LogWrapper import getLogger
+
+try:
+    from shlex import quote as shell_quote
+except ImportError:
+    from pipes import quote as shell_quote
+
+log = getLogger(__name__)
+
+# Files of the booted state of an image.  'disk' is a QCOW2 overlay of the
+# base image with the disk as the booted VM left it and 'state' is the saved
+# RAM and device state of the VM.
+GoldenImage = namedtuple('GoldenImage', ['disk', 'state', 'info', 'key'])
+
+# Telnet negotiation that QEMU sends on its telnet monitor
+telnet_commands = re.compile(b'\xff[\xfb-\xfe].|\xff[\xf0-\xfa]', re.DOTALL)
+
+
+class GoldenImageError(Exception):
+    pass
+
+
+class MonitorClient(object):
+    """
+    Class Name:         MonitorClient
+    Description:        Client for the human monitor of a VM that was started
+                        with '-monitor telnet::<port>,server,nowait'
+    """
+    prompt = b'(qemu) '
+
+    def __init__(self, port, host='127.0.0.1', timeout=30.0):
+        self.timeout = timeout
+        self.sock = socket.create_connection((host, port), timeout)
+        self._read_()
+
+    def _read_(self):
+        data = b''
+        deadline = time.time() + self.timeout
+
+        while not data.endswith(self.prompt):
+            if time.time() > deadline:
+                raise GoldenImageError('The monitor didn\'t answer within {0} seconds'.format(self.timeout))
+
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                break
+            data = telnet_commands.sub(b'', data + chunk)
+
+        return data[:-len(self.prompt)] if data.endswith(self.prompt) else data
+
+    def command(self, line):
+        """
+        Method Name:    command
+
+        Parameters:     line
+                          - Monitor command
+
+        Description:    Run a monitor command and wait for the next prompt
+
+        Returns:        str
+                          - Output of the command, without the echoed command
+        """
+        self.sock.sendall(line.encode('utf-8') + b'\r\n')
+        output = self._read_().decode('utf-8', 'replace').replace('\r', '')
+
+        # The monitor echoes the command back
+        return output.split('\n', 1)[1] if '\n' in output else ''
+
+    def close(self):
+        self.sock.close()
+
+
+def save_vm_state(monitor_port, path, timeout=600.0, interval=1.0):
+    """
+    Function Name:      save_vm_state
+
+    Parameters:         monitor_port
+                         - Telnet port of the VM's monitor
+                        path
+                         - File to save the state of the VM in
+                        timeout
+                         - Seconds to wait for the state to be saved
+                        interval
+                         - Seconds between checks of the migration status
+
+    Description:        Pause the VM, write its RAM and device state to
+                        'path' (the same stream a migration sends, so a VM
+                        with the same devices can be started from it with
+                        '-incoming') and quit the VM.  The disk isn't
+                        written to after the VM is paused, so it matches
+                        the state.
+    """
+    monitor = MonitorClient(monitor_port)
+
+    try:
+        monitor.command('stop')
+        monitor.command('migrate -d "exec:cat > {0}"'.format(shell_quote(path)))
+
+        deadline = time.time() + timeout
+        while True:
+            status = monitor.command('info migrate')
+            if 'status: completed' in status:
+                break
+
+            if 'status: failed' in status or 'status: cancelled' in status:
+                raise GoldenImageError('Saving the state of the VM failed: {0}'.format(status.strip()))
+
+            if time.time() > deadline:
+                monitor.command('migrate_cancel')
+                raise GoldenImageError('Saving the state of the VM took more than {0} seconds'.format(timeout))
+
+            time.sleep(interval)
+
+        try:
+            monitor.command('quit')
+        except (socket.error, GoldenImageError):
+            # The VM closes the monitor when it quits
+            pass
+    finally:
+        monitor.close()
+
+
+def format_identity(identity):
+    """
+    Function Name:      format_identity
+
+    Parameters:         identity
+                         - List of (key, value) pairs
+
+    Description:        Format the identity of a node for the fw_cfg entry
+                        that it is passed to the VM in.  The guest reads it
+                        from '/sys/firmware/qemu_fw_cfg/by_name/opt/pydotsim/
+                        identity/raw' when it is resumed from a golden state.
+                        Commas are doubled because QEMU splits its options on
+                        them.
+
+    Returns:            str
+    """
+    return ';'.join('{0}={1}'.format(key, value) for key, value in identity).replace(',', ',,')
@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+
+import logging
+from array import array
+from collections import deque
+from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.TopoStream import iter_nodes, iter_edges, default_statements
+
+log = getLogger(__name__)
+
+
+def _numpy_():
+    # NumPy is slow to import, so it's only imported when a GraphQuery is
+    # built.  The queries work without it, only slower on big graphs.
+    try:
+        import numpy
+    except ImportError:
+        return None
+
+    return numpy
+
+
+class UnknownNode(Exception):
+    pass
+
+
+def graph_signature(graph):
+    """
+    Function Name:      graph_signature
+
+    Parameters:         graph
+                         - pydot.Dot
+
+    Description:        Cheap signature of the structure of a graph.  pydot
+                        numbers every node and edge that is added, so adding
+                        or deleting one changes the signature.
+
+    Returns:            tuple
+    """
+    obj_dict = graph.obj_dict
+    return (len(obj_dict['nodes']), len(obj_dict['edges']), obj_dict.get('current_child_sequence'))
+
+
+class GraphQuery(object):
+    """
+    Class Name:         GraphQuery
+    Description:        Queries on the structure of a topology.  The links are
+                        kept as a CSR adjacency (NumPy arrays if NumPy is
+                        installed): the neighbors of node 'i' are
+                        'indices[indptr[i]:indptr[i + 1]]' and the link of
+                        every entry is at the same place in 'links'.  It is
+                        built from the graph once, and DotTopo builds a new one
+                        when the graph changes.
+
+                        Links are undirected, a node linked to itself isn't
+                        its own neighbor and parallel links count once for the
+                        neighbors and paths, but every one of them counts for
+                        the cuts.
+    """
+    def __init__(self, graph):
+        numpy = self.numpy = _numpy_()
+        self.names = [name for name, _ in iter_nodes(graph) if name not in default_statements]
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.edges = []
+
+        # Ends of the links that aren't nodes of the graph are skipped
+        pairs = []
+        for source, destination, _ in iter_edges(graph):
+            src = self.index.get(source.split(':')[0])
+            dst = self.index.get(destination.split(':')[0])
+            if src is None or dst is None or src == dst:
+                continue
+
+            pairs.append((src, dst, len(self.edges)))
+            self.edges.append((source, destination))
+
+        count = len(self.names)
+        degree = [0] * (count + 1)
+        for src, dst, _ in pairs:
+            degree[src + 1] += 1
+            degree[dst + 1] += 1
+
+        for i in range(count):
+            degree[i + 1] += degree[i]
+
+        indptr = degree
+        fill = list(indptr[:-1])
+        indices = [0] * (2 * len(pairs))
+        links = [0] * (2 * len(pairs))
+        for src, dst, link in pairs:
+            indices[fill[src]], links[fill[src]] = dst, link
+            fill[src] += 1
+            indices[fill[dst]], links[fill[dst]] = src, link
+            fill[dst] += 1
+
+        if numpy is not None:
+            self.indptr = numpy.array(indptr, dtype=numpy.int64)
+            self.indices = numpy.array(indices, dtype=numpy.int64)
+            self.links = numpy.array(links, dtype=numpy.int64)
+        else:
+            self.indptr = array('l', indptr)
+            self.indices = array('l', indices)
+            self.links = array('l', links)
+
+        self._neighbors_ = {}
+
+    def _get_index_(self, name):
+        try:
+            return self.index[name]
+        except KeyError:
+            raise UnknownNode('There is no node named {0}'.format(name))
+
+    def _neighbor_indexes_(self, i):
+        if i not in self._neighbors_:
+            self._neighbors_[i] = sorted(set(self.indices[self.indptr[i]:self.indptr[i + 1]]))
+
+        return self._neighbors_[i]
+
+    def neighbors(self, name):
+        """
+        Method Name:    neighbors
+
+        Parameters:     name
+                          - Name of the node
+
+        Description:    Names of the nodes linked to a node
+
+        Returns:        list
+        """
+        return [self.names[j] for j in self._neighbor_indexes_(self._get_index_(name))]
+
+    def degree(self, name):
+        """
+        Method Name:    degree
+
+        Parameters:     name
+                          - Name of the node
+
+        Description:    Number of links of a node
+
+        Returns:        int
+        """
+        i = self._get_index_(name)
+        return int(self.indptr[i + 1] - self.indptr[i])
+
+    def _bfs_(self, start, limit=None, target=None):
+        # Returns the hop count of every node (-1 if it can't be reached)
+        # and the node that every node was reached from
+        count = len(self.names)
+        numpy = self.numpy
+
+        if numpy is not None:
+            dist = numpy.full(count, -1, dtype=numpy.int64)
+            parent = numpy.full(count, -1, dtype=numpy.int64)
+            dist[start] = 0
+            frontier = numpy.array([start], dtype=numpy.int64)
+            level = 0
+
+            while frontier.size and (limit is None or level < limit):
+                # Gather the neighbors of the whole frontier at once
+                starts = self.indptr[frontier]
+                counts = self.indptr[frontier + 1] - starts
+                total = int(counts.sum())
+                if not total:
+                    break
+
+                offsets = numpy.repeat(starts - numpy.cumsum(counts) + counts, counts) + numpy.arange(total)
+                found = self.indices[offsets]
+                sources = numpy.repeat(frontier, counts)
+
+                new = dist[found] < 0
+                found, first = numpy.unique(found[new], return_index=True)
+                level += 1
+                dist[found] = level
+                parent[found] = sources[new][first]
+                frontier = found
+
+                if target is not None and dist[target] >= 0:
+                    break
+
+            return dist, parent
+
+        dist = [-1] * count
+        parent = [-1] * count
+        dist[start] = 0
+        queue = deque([start])
+
+        while queue:
+            i = queue.popleft()
+            if limit is not None and dist[i] >= limit:
+                continue
+
+            for j in self.indices[self.indptr[i]:self.indptr[i + 1]]:
+                if dist[j] < 0:
+                    dist[j] = dist[i] + 1
+                    parent[j] = i
+                    queue.append(j)
+
+            if target is not None and dist[target] >= 0:
+                break
+
+        return dist, parent
+
+    def k_hop(self, name, k, exact=False):
+        """
+        Method Name:    k_hop
+
+        Parameters:     name
+                          - Name of the node
+                        k
+                          - Number of hops
+                        exact
+                          - Only the nodes that are exactly 'k' hops away
+
+        Description:    Names of the nodes that are at most (or exactly) 'k'
+                        hops from a node, not counting the node itself
+
+        Returns:        set
+        """
+        dist, _ = self._bfs_(self._get_index_(name), limit=k)
+
+        if exact:
+            return set(self.names[i] for i, d in enumerate(dist) if d == k)
+
+        return set(self.names[i] for i, d in enumerate(dist) if 0 < d <= k)
+
+    def distances(self, name):
+        """
+        Method Name:    distances
+
+        Parameters:     name
+                          - Name of the node
+
+        Description:    Number of hops from a node to every node that can be
+                        reached from it
+
+        Returns:        dict
+                          - {node name: hops}
+        """
+        dist, _ = self._bfs_(self._get_index_(name))
+        return dict((self.names[i], int(d)) for i, d in enumerate(dist) if d >= 0)
+
+    def shortest_path(self, source, destination, links=False):
+        """
+        Method Name:    shortest_path
+
+        Parameters:     source
+                          - Name of the first node
+                        destination
+                          - Name of the last node
+                        links
+                          - Return the links of the path instead of the nodes
+
+        Description:    One of the paths with the fewest hops between two
+                        nodes
+
+        Returns:        list
+                          - Names of the nodes on the path, or the
+                            ('node:interface', 'node:interface') ends of its
+                            links.  None if there is no path.
+        """
+        start = self._get_index_(source)
+        end = self._get_index_(destination)
+
+        _, parent = self._bfs_(start, target=end)
+        if start != end and parent[end] < 0:
+            return None
+
+        path = [end]
+        while path[-1] != start:
+            path.append(int(parent[path[-1]]))
+        path.reverse()
+
+        if not links:
+            return [self.names[i] for i in path]
+
+        return [self.edges[self._link_between_(a, b)] for a, b in zip(path, path[1:])]
+
+    def _link_between_(self, a, b):
+        for k in range(self.indptr[a], self.indptr[a + 1]):
+            if self.indices[k] == b:
+                return int(self.links[k])
+
+    def components(self):
+        """
+        Method Name:    components
+
+        Parameters:     None
+
+        Description:    Connected components of the topology
+
+        Returns:        list
+                          - Node names of every component, the biggest
+                            component first
+        """
+        component = [-1] * len(self.names)
+        groups = []
+
+        for start in range(len(self.names)):
+            if component[start] >= 0:
+                continue
+
+            dist, _ = self._bfs_(start)
+            members = [i for i, d in enumerate(dist) if d >= 0]
+            for i in members:
+                component[i] = len(groups)
+            groups.append([self.names[i] for i in members])
+
+        return sorted(groups, key=lambda members: -len(members))
+
+    def min_cut(self, source, destination):
+        """
+        Method Name:    min_cut
+
+        Parameters:     source
+                          - Name of a node on one side of the cut
+                        destination
+                          - Name of a node on the other side
+
+        Description:    Fewest links that have to fail to separate two nodes
+                        (Edmonds-Karp on links of capacity 1).  This is also
+                        the number of link-disjoint paths between them.
+
+        Returns:        tuple
+                          - (number of links, list of the link ends of a
+                            minimum cut)
+        """
+        start = self._get_index_(source)
+        end = self._get_index_(destination)
+        if start == end:
+            return 0, []
+
+        # Flow on every entry of the adjacency.  Both directions of an
+        # undirected link share the capacity of 1.
+        flow = [0] * len(self.edges)
+        direction = [0] * len(self.edges)
+
+        def residual(i, k):
+            link = self.links[k]
+            if flow[link] == 0:
+                return True
+            # Flow can be pushed back against the direction it went
+            return direction[link] != i
+
+        total = 0
+        while True:
+            parent = {start: (None, None)}
+            queue = deque([start])
+            while queue and end not in parent:
+                i = queue.popleft()
+                for k in range(self.indptr[i], self.indptr[i + 1]):
+                    j = int(self.indices[k])
+                    if j not in parent and residual(i, k):
+                        parent[j] = (i, k)
+                        queue.append(j)
+
+            if end not in parent:
+                break
+
+            j = end
+            while j != start:
+                i, k = parent[j]
+                link = int(self.links[k])
+                if flow[link] and direction[link] != i:
+                    flow[link] = 0
+                else:
+                    flow[link] = 1
+                    direction[link] = i
+                j = i
+            total += 1
+
+        # The nodes still reachable in the residual graph are on the side
+        # of the source
+        side = set(parent)
+        cut = [self.edges[link] for link in range(len(self.edges))
+               if (self.index[self.edges[link][0].split(':')[0]] in side) !=
+                  (self.index[self.edges[link][1].split(':')[0]] in side)]
+
+        return total, cut
+
+    def bisection(self):
+        """
+        Method Name:    bisection
+
+        Parameters:     None
+
+        Description:    Split the nodes into two halves with few links
+                        between them.  The nodes are ordered by their
+                        distance from a node at the edge of the topology
+                        (found with two BFS walks), the halves are the two
+                        ends of that order and then nodes are swapped
+                        between them while that removes links from the cut.
+                        This is a heuristic, it finds the natural cut of
+                        fabrics and rings but not always the smallest one.
+
+        Returns:        tuple
+                          - (names of one half, names of the other half,
+                            list of the link ends between them)
+        """
+        count = len(self.names)
+        if count < 2:
+            return list(self.names), [], []
+
+        # Every component is walked from its own far end
+        order = []
+        seen = set()
+        for members in self.components():
+            first = self.index[members[0]]
+            dist, _ = self._bfs_(first)
+            far = max((d, i) for i, d in enumerate(dist) if d >= 0)[1]
+            dist, _ = self._bfs_(far)
+            order += [i for d, i in sorted((d, i) for i, d in enumerate(dist) if d >= 0 and i not in seen)]
+            seen.update(self.index[name] for name in members)
+
+        side = [1] * count
+        for i in order[:count // 2]:
+            side[i] = 0
+
+        # Gain of moving a node is the links it has to the other side minus
+        # the links it has on its own side
+        def gain(i):
+            g = 0
+            for j in self.indices[self.indptr[i]:self.indptr[i + 1]]:
+                g += 1 if side[j] != side[i] else -1
+            return g
+
+        improved = True
+        while improved:
+            improved = False
+            best = sorted(((gain(i), i) for i in range(count)), reverse=True)
+            left = [i for g, i in best if side[i] == 0 and g > 0]
+            right = [i for g, i in best if side[i] == 1 and g > 0]
+            for a, b in zip(left, right):
+                # The links between the two stay in the cut
+                shared = sum(1 for j in self.indices[self.indptr[a]:self.indptr[a + 1]] if j == b)
+                if gain(a) + gain(b) - 2 * shared > 0:
+                    side[a], side[b] = 1, 0
+                    improved = True
+
+        halves = ([self.names[i] for i in range(count) if side[i] == 0],
+                  [self.names[i] for i in range(count) if side[i] == 1])
+        cut = [(a, b) for a, b in self.edges
+               if side[self.index[a.split(':')[0]]] != side[self.index[b.split(':')[0]]]]
+
+        return halves[0], halves[1], cut
@@ -0,0 +1,640 @@
+#!/usr/bin/env python
+
+import os
+import json
+import errno
+import socket
+import hashlib
+import argparse
+import threading
+import traceback
+import logging
+from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.PrivHelper import PrivHelper, PrivHelperError, daemonize
+from simulator.utilities.PortResourceCheck import PortResourceCheck
+from simulator.utilities.SimState import read_state, update_state, get_state_path, lock_file_name
+from simulator.utilities.LaunchJournal import get_journal_path
+from simulator.utilities.UserDirs import give_to_user, make_private_dir, user_tmp_dir, is_owned
+from simulator.utilities.Tracer import Tracer, get_tracer
+
+log = getLogger(__name__)
+
+# The daemon runs as root, so its socket and log are kept in a directory
+# that only root can write to.  A socket in /tmp could be bound by any user,
+# and clients send their topologies to whatever answers on it.
+host_daemon_dir = '/run/pydotsim'
+host_daemon_socket = os.path.join(host_daemon_dir, 'host.sock')
+host_daemon_log = os.path.join(host_daemon_dir, 'host.log')
+overlay_pool_dir = user_tmp_dir('overlay_pool')
+
+
+def topology_to_dict(topology):
+    """
+    Function Name:      topology_to_dict
+
+    Parameters:         topology
+                         - DotTopo to send to the daemon
+
+    Description:        Plain data of every node and edge of a topology.  The
+                        DOT text can't be used since the list attributes
+                        (e.g. 'bridge') don't survive 'to_string'.
+
+    Returns:            dict
+    """
+    return {'nodes': [[node.get_name(), dict(node.get_attributes())] for node in topology.get_nodes()],
+            'edges': [[edge.get_source(), edge.get_destination(), dict(edge.get_attributes())]
+                      for edge in topology.graph.get_edges()]}
+
+
+def topology_from_dict(data):
+    """
+    Function Name:      topology_from_dict
+
+    Parameters:         data
+                         - Dictionary from 'topology_to_dict'
+
+    Description:        Rebuild the topology that was sent to the daemon
+
+    Returns:            DotTopo
+    """
+    import pydot
+    from simulator.DotTopo import DotTopo
+
+    graph = pydot.Dot(graph_type='graph')
+    for name, attributes in data['nodes']:
+        graph.add_node(pydot.Node(str(name), **dict((str(k), v) for k, v in attributes.items())))
+
+    for source, destination, attributes in data['edges']:
+        graph.add_edge(pydot.Edge(str(source), str(destination),
+                                  **dict((str(k), v) for k, v in attributes.items())))
+
+    return DotTopo(graph)
+
+
+class DepotIndex(object):
+    """
+    Class Name:         DepotIndex
+    Description:        Keeps an ImageDepot for every depot directory that
+                        was asked for, together with the images that were
+                        found in it.  A depot is only walked again when the
+                        modification time of one of its type or version
+                        directories changed.
+    """
+    def __init__(self):
+        self.depots = {}
+        self.lock = threading.Lock()
+
+    def _signature_(self, depot_dir):
+        mtimes = [os.path.getmtime(depot_dir)]
+        for image_type in sorted(os.listdir(depot_dir)):
+            type_dir = os.path.join(depot_dir, image_type)
+            if os.path.isdir(type_dir):
+                mtimes.append(os.path.getmtime(type_dir))
+                for version in sorted(os.listdir(type_dir)):
+                    mtimes.append(os.path.getmtime(os.path.join(type_dir, version)))
+
+        return tuple(mtimes)
+
+    def get(self, depot_dir):
+        """
+        Method Name:    get
+
+        Parameters:     depot_dir
+                          - Directory of the image depot
+
+        Description:    Get the (possibly cached) ImageDepot of a directory
+
+        Returns:        ImageDepot
+        """
+        from simulator.utilities.ImageDepot import ImageDepot
+
+        depot_dir = os.path.realpath(depot_dir)
+        with self.lock:
+            signature = self._signature_(depot_dir)
+            entry = self.depots.get(depot_dir)
+
+            if entry is None or entry['signature'] != signature:
+                log.debug('Indexing the image depot {0}'.format(depot_dir))
+                entry = {'signature': signature, 'depot': CachedImageDepot(ImageDepot(depot_dir))}
+                self.depots[depot_dir] = entry
+
+            return entry['depot']
+
+
+class CachedImageDepot(object):
+    """
+    Class Name:         CachedImageDepot
+    Description:        ImageDepot wrapper that remembers the image and the
+                        boot files that were found for every image name
+    """
+    def __init__(self, depot):
+        self.depot = depot
+        self.images = {}
+        self.boot_files = {}
+
+    def get_qcow2_image(self, image):
+        if image not in self.images:
+            self.images[image] = self.depot.get_qcow2_image(image)
+
+        return self.images[image]
+
+    def get_boot_files(self, image):
+        if image not in self.boot_files:
+            self.boot_files[image] = self.depot.get_boot_files(image)
+
+        return self.boot_files[image]
+
+    def __getattr__(self, name):
+        return getattr(self.depot, name)
+
+
+class OverlayPool(object):
+    """
+    Class Name:         OverlayPool
+    Description:        Pre-created QCOW2 overlays for the base images that
+                        were used before.  Taking an overlay from the pool is
+                        a rename, the pool is refilled one overlay at a time
+                        from the daemon's loop.
+    """
+    def __init__(self, create_overlay, directory=overlay_pool_dir, size=4):
+        self.create_overlay = create_overlay
+        # Root boots the pooled overlays, so nobody else may put one there
+        self.directory = make_private_dir(directory)
+        self.size = size
+        self.bases = {}
+
+        # Overlays are taken by the threads that run simulations while the
+        # loop refills the pool
+        self.lock = threading.RLock()
+
+    def _key_(self, base_image):
+        stat = os.stat(base_image)
+        return hashlib.sha1('{0}:{1}:{2}'.format(base_image, stat.st_size,
+                                                  stat.st_mtime).encode('utf-8')).hexdigest()[:16]
+
+    def _ready_(self, key):
+        pool_dir = os.path.join(self.directory, key)
+        if not os.path.exists(pool_dir):
+            return []
+
+        ready = []
+        for f in sorted(os.listdir(pool_dir)):
+            path = os.path.join(pool_dir, f)
+            if not f.endswith('.qcow2'):
+                continue
+
+            if is_owned(path):
+                ready.append(path)
+            else:
+                log.warn('Ignoring the pooled overlay {0}, the daemon didn\'t create it'.format(path))
+
+        return ready
+
+    def take(self, base_image, overlay):
+        """
+        Method Name:    take
+
+        Parameters:     base_image
+                          - Base image that the overlay is backed by
+                        overlay
+                          - Path that the overlay should have
+
+        Description:    Move an overlay from the pool to 'overlay', or create
+                        it if the pool is empty
+
+        Returns:        dict
+                          - Same result as PrivHelper.create_overlay
+        """
+        try:
+            key = self._key_(base_image)
+        except OSError as e:
+            return {'returncode': 1, 'stderr': str(e)}
+
+        with self.lock:
+            self.bases[key] = base_image
+
+            for pooled in self._ready_(key):
+                overlay_dir = os.path.dirname(overlay)
+                if not os.path.exists(overlay_dir):
+                    os.makedirs(overlay_dir)
+
+                try:
+                    os.rename(pooled, overlay)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    # The pool is on a different file system
+                    break
+                else:
+                    log.debug('Took {0} from the overlay pool'.format(overlay))
+                    return {'returncode': 0, 'stderr': ''}
+
+        return self.create_overlay(base_image, overlay)
+
+    def refill(self):
+        with self.lock:
+            self._refill_()
+
+    def _refill_(self):
+        for key, base_image in list(self.bases.items()):
+            ready = self._ready_(key)
+            if len(ready) < self.size:
+                if not os.path.exists(base_image) or self._key_(base_image) != key:
+                    # The base image changed, the pooled overlays are stale
+                    for pooled in ready:
+                        os.unlink(pooled)
+                    del self.bases[key]
+                    continue
+
+                index = 0
+                while os.path.lexists(os.path.join(self.directory, key, '{0}.qcow2'.format(index))):
+                    index += 1
+
+                result = self.create_overlay(base_image, os.path.join(self.directory, key,
+                                                                      '{0}.qcow2'.format(index)))
+                if result.get('returncode'):
+                    log.warn('Stopped pooling overlays of {0}: {1}'.format(base_image, result.get('stderr')))
+                    del self.bases[key]
+
+                # Only one overlay per iteration so requests aren't held up
+                return
+
+
+class DaemonPortResourceCheck(PortResourceCheck):
+    """
+    Class Name:         DaemonPortResourceCheck
+    Description:        The port allocator of the host daemon.  It is shared
+                        by the threads that run simulations, and the port
+                        files that it creates belong to the user of the
+                        daemon, so the simulations that the user runs in
+                        their own process can still take ports.
+    """
+    def __init__(self, uid=None, gid=None, **kwargs):
+        super(DaemonPortResourceCheck, self).__init__(**kwargs)
+        self.uid = uid
+        self.gid = gid
+        self.lock = threading.RLock()
+
+    @property
+    def scanned(self):
+        # 'scan' sets it as soon as it starts, the other threads wait until
+        # the free ports are all there
+        with self.lock:
+            return self._scanned_
+
+    @scanned.setter
+    def scanned(self, value):
+        self._scanned_ = value
+
+    def scan(self):
+        with self.lock:
+            created = not os.path.exists(self.directory)
+            super(DaemonPortResourceCheck, self).scan()
+
+            if created and self.uid is not None:
+                give_to_user(self.directory, self.uid, self.gid)
+                for port in os.listdir(self.directory):
+                    give_to_user(os.path.join(self.directory, port), self.uid, self.gid)
+
+    def get_free_ports(self, num_ports, sim_dir=None):
+        with self.lock:
+            return super(DaemonPortResourceCheck, self).get_free_ports(num_ports, sim_dir)
+
+    def reserve_ports(self, ports, sim_dir):
+        with self.lock:
+            return super(DaemonPortResourceCheck, self).reserve_ports(ports, sim_dir)
+
+    def release_port(self, ports, sim_dir=None):
+        with self.lock:
+            return super(DaemonPortResourceCheck, self).release_port(ports, sim_dir)
+
+
+class DaemonLauncher(object):
+    """
+    Class Name:         DaemonLauncher
+    Description:        Launcher for builders that run inside the host
+                        daemon.  It has the same methods as the PrivLauncher,
+                        but runs the requests directly in the daemon.  The
+                        builders run in threads of their own, so the
+                        requests that change the daemon's children are
+                        handed to its loop.
+    """
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    def start(self):
+        pass
+
+    def request(self, requests):
+        return [self.daemon.call_in_loop(self.daemon.handle, request) for request in requests]
+
+    def spawn(self, argv_list, stdout=None, stderr=None, logs_list=None, supervise_list=None):
+        logs_list = logs_list or [None] * len(argv_list)
+        supervise_list = supervise_list or [None] * len(argv_list)
+        return [self.daemon.call_in_loop(self.daemon.spawn, argv, stdout, stderr, logs, supervise)['pid']
+                for argv, logs, supervise in zip(argv_list, logs_list, supervise_list)]
+
+    def kill(self, pids, sig=None):
+        if sig is None:
+            return self.daemon.call_in_loop(self.daemon.kill, pids)
+
+        return self.daemon.call_in_loop(self.daemon.kill, pids, sig)
+
+    def create_overlays(self, overlays):
+        results = [self.daemon.overlay_pool.take(base, overlay) for base, overlay in overlays]
+
+        for (base, overlay), result in zip(overlays, results):
+            if result.get('returncode'):
+                log.warn('Creating {0} failed: {1}'.format(overlay, result.get('stderr')))
+
+        return [r.get('returncode') for r in results]
+
+    def ip_batch(self, commands):
+        if not commands:
+            return 0
+
+        result = self.daemon.ip_batch(commands)
+        if result.get('returncode'):
+            log.warn('ip -batch failed: {0}'.format(result.get('stderr').strip()))
+
+        return result.get('returncode')
+
+    def shutdown(self):
+        # The daemon outlives the simulations
+        pass
+
+
+class HostDaemon(PrivHelper):
+    """
+    Class Name:         HostDaemon
+    Description:        Optional daemon that is shared by all of the
+                        simulations on a host.  On top of the PrivHelper
+                        requests it keeps the port allocator, the image depot
+                        index and a pool of overlays in memory, and supervises
+                        the VMs of every simulation:
+
+                            run             - start a topology
+                            stop            - stop a simulation
+                            allocate_ports  - take free UDP ports
+                            release_ports   - give UDP ports back
+                            find_image      - find an image in a depot
+
+                        'run' and 'stop' take as long as the VMs take to
+                        boot, so they are handled by a thread of their own
+                        and the loop keeps serving the other simulations,
+                        draining the logs and restarting crashed VMs.  The
+                        port allocator, the depot index and the overlay pool
+                        are shared by those threads.  The files that the
+                        daemon writes for a simulation are given to the
+                        user of the daemon ('uid').
+    """
+    # Requests that are handled by a thread of their own
+    worker_ops = set(['run', 'stop'])
+
+    def __init__(self, socket_path=host_daemon_socket, uid=None, gid=None,
+                 pool_dir=overlay_pool_dir, pool_size=4):
+        super(HostDaemon, self).__init__(socket_path, uid=uid, gid=gid)
+        self.port_check = DaemonPortResourceCheck(uid=uid, gid=gid)
+        self.depot_index = DepotIndex()
+        self.overlay_pool = OverlayPool(self.create_overlay, pool_dir, pool_size)
+        self.launcher = DaemonLauncher(self)
+        self.periodic.append(self.overlay_pool.refill)
+
+        # Simulation directories that a thread is running or stopping
+        self.busy = set()
+        self.busy_lock = threading.Lock()
+
+    def handle(self, request):
+        op = request.get('op')
+        try:
+            if op == 'run':
+                return self.run(request['topology'], request['sim_dir'], request['image_depot'],
+                                request.get('boot'))
+            elif op == 'stop':
+                return self.stop(request['sim_dir'])
+            elif op == 'allocate_ports':
+                return {'ports': self.port_check.get_free_ports(request['count'], sim_dir=request['sim_dir'])}
+            elif op == 'release_ports':
+                with self.port_check.lock:
+                    self.port_check.used_ports = list(set(self.port_check.used_ports + request['ports']))
+                    self.port_check.release_port(request['ports'], sim_dir=request['sim_dir'])
+                return {}
+            elif op == 'find_image':
+                return {'image': self.depot_index.get(request['image_depot']).get_qcow2_image(request['image'])}
+        except (KeyError, TypeError) as e:
+            return {'error': 'Malformed {0} request: {1}'.format(op, e)}
+        except Exception as e:
+            # A bad topology mustn't take down the daemon of every simulation
+            log.warn('{0} request failed:\n{1}'.format(op, traceback.format_exc()))
+            return {'error': '{0}: {1}'.format(e.__class__.__name__, e)}
+
+        return super(HostDaemon, self).handle(request)
+
+    def bind(self):
+        _make_run_dir_(os.path.dirname(self.socket_path))
+        super(HostDaemon, self).bind()
+
+    def _serve_(self, conn, requests):
+        if not any(isinstance(request, dict) and request.get('op') in self.worker_ops for request in requests):
+            return super(HostDaemon, self)._serve_(conn, requests)
+
+        # The client waits for as long as the VMs take to start
+        conn.settimeout(None)
+        worker = threading.Thread(target=self._work_, args=(conn, requests))
+        worker.daemon = True
+        worker.start()
+
+    def _work_(self, conn, requests):
+        results = []
+        for request in requests:
+            if request.get('op') in self.worker_ops:
+                results.append(self._handle_sim_request_(request))
+                continue
+
+            try:
+                results.append(self.call_in_loop(self.handle, request))
+            except PrivHelperError as e:
+                results.append({'error': str(e)})
+
+        self._reply_(conn, results)
+
+    def _handle_sim_request_(self, request):
+        # Only one thread at a time runs or stops a simulation
+        sim_dir = request.get('sim_dir')
+        with self.busy_lock:
+            if sim_dir in self.busy:
+                return {'error': '{0} is already being started or stopped'.format(sim_dir)}
+            self.busy.add(sim_dir)
+
+        try:
+            return self.handle(request)
+        finally:
+            with self.busy_lock:
+                self.busy.discard(sim_dir)
+
+            if sim_dir:
+                self._give_to_user_(sim_dir)
+
+            # Nothing in the daemon exports the spans of the process wide
+            # tracer (topology parsing), so they mustn't pile up
+            get_tracer().clear()
+
+    def _give_to_user_(self, sim_dir):
+        # The builder ran as root, the files that the simulation keeps
+        # using belong to the user that asked for it
+        if self.uid is None:
+            return
+
+        for path in [sim_dir, get_state_path(sim_dir), os.path.join(sim_dir, lock_file_name),
+                     get_journal_path(sim_dir), os.path.join(sim_dir, 'plan.yaml')]:
+            if os.path.exists(path):
+                give_to_user(path, self.uid, self.gid)
+
+    def _builder_(self, builder_class, graph, sim_dir, image_depot):
+        builder = builder_class(graph, sim_dir, image_depot)
+        builder.port_check = self.port_check
+        builder.launcher = self.launcher
+
+        # Every request has its own spans, a long lived daemon would keep
+        # those of every simulation it ever started otherwise
+        builder.tracer = Tracer()
+
+        return builder
+
+    def run(self, topology, sim_dir, image_depot_dir, boot=None):
+        """
+        Method Name:    run
+
+        Parameters:     topology
+                          - Topology from 'topology_to_dict'
+                        sim_dir
+                          - Simulation directory
+                        image_depot_dir
+                          - Directory of the image depot
+                        boot
+                          - Staged bring-up settings, see
+                            DotSimulator.get_boot_settings
+
+        Description:    Start a simulation with the daemon's port allocator,
+                        depot index and overlay pool
+
+        Returns:        dict
+                          - The state of the simulation
+        """
+        from simulator.builders import select_builder_class
+
+        graph = topology_from_dict(topology)
+        builder = self._builder_(select_builder_class(graph), graph, sim_dir, self.depot_index.get(image_depot_dir))
+        if boot:
+            builder.boot_strategy = boot.get('strategy')
+            builder.boot_roots = boot.get('roots')
+            builder.boot_stage_timeout = boot.get('stage_timeout', builder.boot_stage_timeout)
+
+        builder.run()
+
+        # Remember that the daemon owns the VMs, so they are stopped by it
+        def add_daemon(state):
+            state['host_daemon'] = self.socket_path
+            return state
+
+        state = update_state(sim_dir, add_daemon)
+
+        return {'state': state}
+
+    def stop(self, sim_dir):
+        from simulator.builders import get_builder_class
+
+        state = read_state(sim_dir) or {}
+        self._builder_(get_builder_class(state.get('builder') or 'kvm'), None, sim_dir, None).stop()
+        return {}
+
+
+def _make_run_dir_(path):
+    # The default directory of the socket and the log is made when the
+    # daemon starts.  Users that aren't root must be able to reach the
+    # socket in it, but not to write to it.
+    if path and not os.path.isdir(path):
+        make_private_dir(path, 0o755)
+
+
+class HostDaemonClient(object):
+    """
+    Class Name:         HostDaemonClient
+    Description:        Client of the host daemon.  Callers should check
+                        'is_alive' and fall back to running the simulation
+                        in their own process if the daemon isn't running.
+    """
+    def __init__(self, socket_path=host_daemon_socket):
+        self.socket_path = socket_path
+
+    def is_alive(self):
+        if not os.path.exists(self.socket_path):
+            return False
+
+        try:
+            self.request([{'op': 'ping'}])
+        except (socket.error, PrivHelperError):
+            return False
+        else:
+            return True
+
+    def request(self, requests):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps({'requests': requests}).encode('utf-8') + b'\n')
+
+            data = b''
+            while not data.endswith(b'\n'):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        finally:
+            sock.close()
+
+        try:
+            results = json.loads(data.decode('utf-8'))['results']
+        except (ValueError, KeyError) as e:
+            raise PrivHelperError('Bad reply from the host daemon: {0}'.format(e))
+
+        for result in results:
+            if result.get('error'):
+                raise PrivHelperError(result['error'])
+
+        return results
+
+    def run(self, topology, sim_dir, image_depot_dir, boot=None):
+        return self.request([{'op': 'run', 'topology': topology_to_dict(topology),
+                              'sim_dir': sim_dir, 'image_depot': image_depot_dir,
+                              'boot': boot}])[0]['state']
+
+    def stop(self, sim_dir):
+        self.request([{'op': 'stop', 'sim_dir': sim_dir}])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyDotSimulator host daemon')
+    parser.add_argument('--socket', help='Unix socket to listen on', default=host_daemon_socket)
+    parser.add_argument('--uid', help='User allowed to use the socket', type=int, default=None)
+    parser.add_argument('--gid', help='Group of the socket', type=int, default=None)
+    parser.add_argument('--pool-dir', help='Directory of the overlay pool', default=overlay_pool_dir)
+    parser.add_argument('--pool-size', help='Overlays kept per base image', type=int, default=4)
+    parser.add_argument('--log', help='Log file when running as a daemon', default=host_daemon_log)
+    parser.add_argument('--daemon', action='store_true', help='Run in the background', default=False)
+
+    args = parser.parse_args()
+
+    daemon = HostDaemon(args.socket, uid=args.uid, gid=args.gid,
+                        pool_dir=args.pool_dir, pool_size=args.pool_size)
+    daemon.bind()
+
+    if args.daemon:
+        _make_run_dir_(os.path.dirname(args.log))
+        daemonize(args.log)
+
+    daemon.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
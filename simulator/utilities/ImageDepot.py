@@ -2,11 +2,25 @@
 # Written by Ken Yin
 
 import os
+import json
+import hashlib
 import logging
 from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.UserDirs import user_tmp_dir, is_owned
 
 log = getLogger(__name__)
 
+# Booted states of the images (see 'get_golden_image').  They are kept out
+# of the depot, which may be read-only or shared.  QEMU resumes them as
+# root, so every user has a directory of their own (see UserDirs).
+golden_image_dir = user_tmp_dir('golden_images')
+
+# Files in the version directory of an image that it can be booted from
+# directly, without its firmware and boot loader (see 'get_boot_files')
+kernel_prefixes = ['vmlinuz', 'bzImage']
+initrd_prefixes = ['initrd', 'initramfs']
+cmdline_file = 'cmdline'
+
 
 class NoDepotPath(Exception):
     pass
@@ -21,8 +35,9 @@ class UnknownVmType(Exception):
 
 
 class ImageDepot(object):
-    def __init__(self, depot_location):
+    def __init__(self, depot_location, golden_dir=golden_image_dir):
         self.depot = depot_location
+        self.golden_dir = golden_dir
         self.vm_types = {}
 
         if not self.depot:
@@ -74,6 +89,115 @@ class ImageDepot(object):
             log.warn('No path with image found')
             return None
 
+    def get_boot_files(self, image):
+        """
+        Method Name:    get_boot_files
+
+        Parameters:     image
+                          - Name of the image, '<vm type>-<version>'
+
+        Description:    Find the kernel ('vmlinuz*' or 'bzImage*'), the
+                        initrd ('initrd*' or 'initramfs*') and the kernel
+                        command line (a 'cmdline' file) in the version
+                        directory of an image.  Only the kernel has to be
+                        there.
+
+        Returns:        dict
+                          - 'kernel', 'initrd' and 'cmdline' paths (None
+                            for the files that aren't there), or None if
+                            there is no kernel
+        """
+        vm_type, vm_version = image.split('-')
+        version_dir = os.path.join(self.depot, vm_type, vm_version)
+
+        if vm_type not in self.vm_types or not os.path.isdir(version_dir):
+            return None
+
+        files = {'kernel': None, 'initrd': None, 'cmdline': None}
+        for name in sorted(os.listdir(version_dir)):
+            path = os.path.join(version_dir, name)
+            if not os.path.isfile(path):
+                continue
+
+            if files['kernel'] is None and any(name.startswith(prefix) for prefix in kernel_prefixes):
+                files['kernel'] = path
+            elif files['initrd'] is None and any(name.startswith(prefix) for prefix in initrd_prefixes):
+                files['initrd'] = path
+            elif name == cmdline_file:
+                files['cmdline'] = path
+
+        return files if files['kernel'] else None
+
+    def get_golden_image(self, base_image, fingerprint):
+        """
+        Method Name:    get_golden_image
+
+        Parameters:     base_image
+                          - Path of the QCOW2 image that is booted
+                        fingerprint
+                          - String that is the same for every VM that can be
+                            started from the same booted state, i.e. VMs with
+                            the same devices, CPUs and RAM
+
+        Description:    Where the booted ("golden") state of an image is
+                        kept.  The name depends on the size and modification
+                        time of the base image, so a replaced image gets a new
+                        golden state and the old one is removed when the new
+                        one is saved.  Use 'is_golden_ready' to check if the
+                        state was already saved.
+
+        Returns:        GoldenImage
+        """
+        from simulator.utilities.GoldenImage import GoldenImage
+        from simulator.utilities.LaunchPlan import image_state_hash
+
+        key = hashlib.sha1('{0} {1}'.format(image_state_hash([base_image]), fingerprint).encode('utf-8')).hexdigest()[:16]
+        name = os.path.join(self.golden_dir, '{0}-{1}'.format(os.path.basename(base_image).rsplit('.', 1)[0], key))
+
+        return GoldenImage('{0}.qcow2'.format(name), '{0}.state'.format(name), '{0}.json'.format(name), key)
+
+    def is_golden_ready(self, golden):
+        # The disk and the state are written by QEMU, which may run as root
+        return all(is_owned(path, allow_root=True) for path in [golden.disk, golden.state, golden.info])
+
+    def save_golden_info(self, golden, base_image, fingerprint):
+        """
+        Method Name:    save_golden_info
+
+        Parameters:     golden
+                          - GoldenImage whose state was saved
+                        base_image
+                          - Path of the image it was booted from
+                        fingerprint
+                          - Fingerprint it was saved for
+
+        Description:    Mark a golden state as complete and remove the
+                        golden states of older versions of the base image
+                        with the same fingerprint
+        """
+        for name in os.listdir(self.golden_dir):
+            if not name.endswith('.json') or os.path.join(self.golden_dir, name) == golden.info:
+                continue
+
+            path = os.path.join(self.golden_dir, name)
+            try:
+                with open(path, 'r') as stream:
+                    info = json.load(stream)
+            except (IOError, OSError, ValueError):
+                continue
+
+            if info.get('base_image') == base_image and info.get('fingerprint') == fingerprint:
+                log.info('Removing the golden state of an older version of {0}'.format(base_image))
+                for suffix in ['.qcow2', '.state', '.json']:
+                    stale = path[:-len('.json')] + suffix
+                    if os.path.exists(stale):
+                        os.remove(stale)
+
+        tmp_path = '{0}.tmp'.format(golden.info)
+        with open(tmp_path, 'w') as stream:
+            json.dump({'base_image': base_image, 'fingerprint': fingerprint, 'key': golden.key}, stream)
+        os.rename(tmp_path, golden.info)
+
     def get_vagrant_image(self, image):
         # TODO: Find Vagrant image and install it into Vagrant
         pass
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import errno
+import logging
+from simulator.utilities.LogWrapper import getLogger
+
+log = getLogger(__name__)
+
+journal_file_name = 'journal.jsonl'
+
+
+class LaunchJournalError(Exception):
+    pass
+
+
+def get_journal_path(sim_dir):
+    return os.path.join(sim_dir, journal_file_name)
+
+
+def pid_alive(pid):
+    """
+    Function Name:      pid_alive
+
+    Parameters:         pid
+                         - Process ID
+
+    Description:        Check if a process is still running.  The VMs may
+                        belong to root, so a permission error means that the
+                        process is there.
+
+    Returns:            Boolean
+    """
+    if not pid:
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+
+    return True
+
+
+class LaunchJournal(object):
+    """
+    Class Name:         LaunchJournal
+    Description:        Write-ahead journal of the start of a simulation.
+                        Every step is appended to 'journal.jsonl' in the
+                        simulation directory as soon as it is done, and
+                        synced to disk, so a start that fails (or is killed)
+                        half way can be stopped or resumed from it.  The
+                        records are one JSON object per line:
+
+                            begin     - the launch plan of the start
+                            ports     - the UDP ports of a node were taken
+                            overlay   - the overlay image of a node was
+                                        created ('returncode' of qemu-img)
+                            spawned   - the VM of a node was started ('pid')
+                            complete  - every node was started
+
+                        A line that was only partially written when the
+                        process died is ignored.
+    """
+    def __init__(self, sim_dir):
+        self.sim_dir = sim_dir
+        self.path = get_journal_path(sim_dir)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _is_torn_(self):
+        # True if the last record was only partially written
+        try:
+            with open(self.path, 'rb') as stream:
+                stream.seek(-1, os.SEEK_END)
+                return stream.read(1) != b'\n'
+        except (IOError, OSError):
+            return False
+
+    def _write_(self, records, mode='a'):
+        torn = mode == 'a' and self._is_torn_()
+
+        with open(self.path, mode) as stream:
+            if torn:
+                # Don't append to the torn record
+                stream.write('\n')
+
+            for record in records:
+                record.setdefault('time', time.time())
+                stream.write(json.dumps(record, sort_keys=True) + '\n')
+
+            stream.flush()
+            os.fsync(stream.fileno())
+
+    def begin(self, builder, plan):
+        """
+        Method Name:    begin
+
+        Parameters:     builder
+                          - Name of the builder that starts the simulation
+                        plan
+                          - LaunchPlan that is started
+
+        Description:    Start a new journal, replacing an older one.  The
+                        ports of every node were taken when the plan was
+                        compiled, so they are written with it.
+        """
+        records = [{'step': 'begin', 'builder': builder, 'sim_dir': self.sim_dir,
+                    'plan_key': plan.key, 'topology_hash': plan.topo_hash}]
+        records += [{'step': 'ports', 'node': name, 'udp_ports': node['ports']} for name, node in plan.nodes.items()]
+
+        self._write_(records, mode='w')
+
+    def record(self, step, entries):
+        """
+        Method Name:    record
+
+        Parameters:     step
+                          - 'ports', 'overlay' or 'spawned'
+                        entries
+                          - {node name: dict of the step's values}
+
+        Description:    Append a step of many nodes at once.  The journal is
+                        synced once for the whole batch.
+        """
+        if entries:
+            self._write_([dict(values, step=step, node=name) for name, values in entries.items()])
+
+    def complete(self):
+        self._write_([{'step': 'complete'}])
+
+    def replay(self):
+        """
+        Method Name:    replay
+
+        Parameters:     None
+
+        Description:    Read the journal back
+
+        Returns:        dict
+                          - 'builder', 'sim_dir', 'plan_key',
+                            'topology_hash', 'complete' and 'nodes':
+                            {node name: {'pid': PID, 'udp_ports': [ports],
+                            'overlay': path of the created overlay}}.  None
+                            if there is no journal.
+        """
+        if not self.exists():
+            return None
+
+        state = None
+        with open(self.path, 'r') as stream:
+            for line in stream:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    log.debug('Ignoring the partially written journal record {0!r}'.format(line))
+                    continue
+
+                step = record.get('step')
+                if step == 'begin':
+                    state = {'builder': record.get('builder'),
+                             'sim_dir': record.get('sim_dir'),
+                             'plan_key': record.get('plan_key'),
+                             'topology_hash': record.get('topology_hash'),
+                             'complete': False,
+                             'nodes': {}}
+                    continue
+
+                if state is None:
+                    continue
+
+                if step == 'complete':
+                    state['complete'] = True
+                    continue
+
+                node = state['nodes'].setdefault(record['node'], {'pid': None, 'udp_ports': None, 'overlay': None})
+                if step == 'ports':
+                    node['udp_ports'] = record['udp_ports']
+                elif step == 'overlay':
+                    node['overlay'] = record['overlay'] if not record.get('returncode') else None
+                elif step == 'spawned':
+                    node['pid'] = record['pid']
+
+        return state
+
+    def remove(self):
+        if self.exists():
+            os.remove(self.path)
+            log.debug('Removed the launch journal {0}'.format(self.path))
+
+
+def replay_journal(sim_dir):
+    return LaunchJournal(sim_dir).replay()
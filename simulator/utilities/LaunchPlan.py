@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+import os
+import hashlib
+import tempfile
+import logging
+from collections import OrderedDict
+from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.UserDirs import user_tmp_dir, make_private_dir, is_owned
+
+log = getLogger(__name__)
+
+# Attributes that the builders set on the graph while a simulation is
+# running.  They aren't part of the topology, so they are ignored when
+# hashing it.
+runtime_attributes = set(['udp_ports', 'pid', 'local_port', 'remote_port'])
+
+# Bumped whenever the contents of a plan change, so plans cached by an
+# older version aren't reused
+plan_format_version = 7
+
+
+def _yaml_():
+    # yaml is slow to import, so it's only imported when a plan is
+    # read or written
+    import yaml
+    return yaml
+
+
+def topology_hash(topology):
+    """
+    Function Name:      topology_hash
+
+    Parameters:         topology
+                         - DotTopo instance
+
+    Description:        Hash the nodes, interfaces and links of a topology.
+                        Runtime attributes (PIDs, UDP ports) are left out so
+                        a topology hashes the same before and after it has
+                        been started.
+
+    Returns:            str
+                         - Hex digest of the topology
+    """
+    digest = hashlib.sha1()
+
+    def _update(kind, name, attributes):
+        attrs = sorted((k, str(v)) for k, v in attributes.items()
+                       if k not in runtime_attributes)
+        digest.update('{0} {1} {2}\n'.format(kind, name, attrs).encode('utf-8'))
+
+    for node in topology.get_nodes():
+        _update('node', node.get_name(), node.get_attributes())
+
+    for edge in topology.graph.get_edges():
+        _update('edge', '{0}--{1}'.format(edge.get_source(), edge.get_destination()),
+                edge.get_attributes())
+
+    return digest.hexdigest()
+
+
+def image_state_hash(image_paths):
+    """
+    Function Name:      image_state_hash
+
+    Parameters:         image_paths
+                         - Iterable of the base images used by a topology
+
+    Description:        Hash the path, size and modification time of every
+                        base image, so a plan is recompiled when an image
+                        in the depot is replaced.
+
+    Returns:            str
+                         - Hex digest of the image state
+    """
+    digest = hashlib.sha1()
+
+    for path in sorted(set(p for p in image_paths if p)):
+        try:
+            st = os.stat(path)
+        except OSError:
+            state = 'missing'
+        else:
+            state = '{0} {1}'.format(st.st_size, int(st.st_mtime))
+
+        digest.update('{0} {1}\n'.format(path, state).encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+class LaunchPlan(object):
+    """
+    Class Name:         LaunchPlan
+    Description:        The compiled form of a topology.  It holds everything
+                        that is needed to start the simulation without
+                        looking at the topology again: the command line,
+                        overlay image and UDP ports of every node and the
+                        ports used by every link.
+    """
+    def __init__(self, sim_dir, topo_hash=None, depot_hash=None):
+        self.sim_dir = sim_dir
+        self.topo_hash = topo_hash
+        self.depot_hash = depot_hash
+        self.nodes = OrderedDict()
+        self.links = []
+
+    @staticmethod
+    def make_key(topo_hash, depot_hash):
+        return 'v{0}-{1}-{2}'.format(plan_format_version, topo_hash, depot_hash)
+
+    @property
+    def key(self):
+        return self.make_key(self.topo_hash, self.depot_hash)
+
+    def add_node(self, name, argv, overlay, base_image, ports, vm_type=None, golden=None, media=None,
+                 netns=None):
+        # 'golden' is how to save the booted state that the node is started
+        # from (see DefaultVmType.get_golden_request), None for a cold boot.
+        # 'media' is the day-0 config media of the node (see ConfigMedia).
+        # 'netns' is set for the nodes that run in a network namespace
+        # instead of a VM (see NetnsNodeType), they have no overlay.
+        self.nodes[name] = {'argv': list(argv),
+                            'overlay': overlay,
+                            'base_image': base_image,
+                            'ports': list(ports),
+                            'vm_type': vm_type,
+                            'golden': golden,
+                            'media': media,
+                            'netns': netns}
+
+    def add_link(self, source, destination, local_port, remote_port):
+        self.links.append({'source': source,
+                           'destination': destination,
+                           'local_port': local_port,
+                           'remote_port': remote_port})
+
+    def get_restart_argv(self, name):
+        """
+        Method Name:    get_restart_argv
+
+        Parameters:     name
+                          - Name of the node
+
+        Description:    Command line that starts a node again from the
+                        overlay it already has.  The overlay of a node that
+                        was resumed from a golden state has moved on from
+                        the golden disk, so it boots instead.
+
+        Returns:        list
+        """
+        argv = self.nodes[name]['argv']
+        if '-incoming' not in argv:
+            return list(argv)
+
+        i = argv.index('-incoming')
+        return argv[:i] + argv[i + 2:]
+
+    def get_ports(self):
+        ports = []
+        for node in self.nodes.values():
+            ports += node['ports']
+
+        return ports
+
+    def rebase(self, sim_dir):
+        """
+        Method Name:    rebase
+
+        Parameters:     sim_dir
+                          - New simulation directory
+
+        Description:    Move every path of the plan that is in the old
+                        simulation directory into 'sim_dir'.  Used when a
+                        cached plan is reused by a new simulation.
+        """
+        old = self.sim_dir.rstrip('/')
+        new = sim_dir.rstrip('/')
+
+        if old != new:
+            for node in self.nodes.values():
+                node['argv'] = [arg.replace(old, new) for arg in node['argv']]
+                if node['overlay']:
+                    node['overlay'] = node['overlay'].replace(old, new)
+
+                if node.get('golden'):
+                    node['golden']['argv'] = [arg.replace(old, new) for arg in node['golden']['argv']]
+
+                if node.get('media'):
+                    node['media']['path'] = node['media']['path'].replace(old, new)
+
+        self.sim_dir = sim_dir
+
+    def to_dict(self):
+        return {'sim_dir': self.sim_dir,
+                'topo_hash': self.topo_hash,
+                'depot_hash': self.depot_hash,
+                'nodes': [dict(name=name, **node) for name, node in self.nodes.items()],
+                'links': self.links}
+
+    @classmethod
+    def from_dict(cls, data):
+        plan = cls(data['sim_dir'], data.get('topo_hash'), data.get('depot_hash'))
+
+        for node in data.get('nodes', []):
+            plan.add_node(node['name'], node['argv'], node['overlay'],
+                          node['base_image'], node['ports'], node.get('vm_type'), node.get('golden'),
+                          node.get('media'), node.get('netns'))
+
+        plan.links = data.get('links', [])
+
+        return plan
+
+    def dump(self, stream=None):
+        yaml = _yaml_()
+        return yaml.dump(self.to_dict(), stream, Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper),
+                         default_flow_style=False)
+
+    def save(self, path):
+        with open(path, 'w') as stream:
+            self.dump(stream)
+
+    @classmethod
+    def load(cls, path):
+        yaml = _yaml_()
+        with open(path, 'r') as stream:
+            return cls.from_dict(yaml.load(stream, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader)))
+
+
+class PlanCache(object):
+    """
+    Class Name:         PlanCache
+    Description:        Stores compiled launch plans by the hash of the
+                        topology and of the images it uses, so an unchanged
+                        topology doesn't have to be compiled again.  The
+                        command lines of a plan are run as root by the
+                        PrivHelper, so every user has a cache of their own
+                        and plans that the user doesn't own are ignored.
+    """
+    def __init__(self, directory=None):
+        self.directory = make_private_dir(directory or user_tmp_dir('plan_cache'))
+
+    def _path_(self, key):
+        return os.path.join(self.directory, '{0}.yaml'.format(key))
+
+    def get(self, key):
+        path = self._path_(key)
+        if not os.path.exists(path):
+            return None
+
+        if not is_owned(path):
+            log.warn('Ignoring the cached plan {0}, it doesn\'t belong to UID {1}'.format(path, os.getuid()))
+            return None
+
+        try:
+            return LaunchPlan.load(path)
+        except (_yaml_().YAMLError, KeyError, TypeError) as e:
+            log.warn('Ignoring the unreadable cached plan {0}: {1}'.format(path, e))
+            return None
+
+    def put(self, plan):
+        # Write to a temporary file first so that a concurrent reader never
+        # sees a partially written plan.  The host daemon may compile the
+        # same plan in two threads at once.
+        path = self._path_(plan.key)
+        fd, tmp_path = tempfile.mkstemp(prefix='{0}.'.format(os.path.basename(path)), dir=self.directory)
+        os.close(fd)
+        plan.save(tmp_path)
+        os.rename(tmp_path, path)
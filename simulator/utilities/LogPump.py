@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+
+import os
+import errno
+import fcntl
+import select
+import socket
+import logging
+from simulator.utilities.LogWrapper import getLogger
+
+log = getLogger(__name__)
+
+log_dir_name = 'logs'
+default_max_bytes = 1024 * 1024
+default_backups = 3
+
+# Telnet commands that QEMU's telnet server sends when a client connects
+telnet_iac = 255
+telnet_sb = 250
+telnet_se = 240
+
+
+def get_log_paths(sim_dir, node_name):
+    """
+    Function Name:      get_log_paths
+
+    Parameters:         sim_dir
+                         - Simulation directory
+                        node_name
+                         - Name of the node
+
+    Description:        Paths of the stdout, stderr and serial console logs
+                        of a node
+
+    Returns:            dict
+                         - {'stdout': path, 'stderr': path, 'serial': path}
+    """
+    log_dir = os.path.join(sim_dir, log_dir_name)
+    return dict((stream, os.path.join(log_dir, '{0}.{1}.log'.format(node_name, stream)))
+                for stream in ['stdout', 'stderr', 'serial'])
+
+
+class RotatingLog(object):
+    """
+    Class Name:         RotatingLog
+    Description:        Append only log file that is rotated to 'path.1',
+                        'path.2'... once it grows past 'max_bytes'.  Only
+                        'backups' old files are kept.
+    """
+    def __init__(self, path, max_bytes=default_max_bytes, backups=default_backups, uid=None, gid=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.uid = uid
+        self.gid = gid
+        self.stream = None
+        self.size = 0
+
+    def _open_(self):
+        log_dir = os.path.dirname(self.path)
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+            self._chown_(log_dir)
+
+        self.stream = open(self.path, 'ab')
+        self.size = self.stream.tell()
+        self._chown_(self.path)
+
+    def _chown_(self, path):
+        # The privileged helper writes the logs for the user that started
+        # the simulation
+        if self.uid is not None:
+            os.chown(path, self.uid, self.gid if self.gid is not None else -1)
+
+    def _rotate_(self):
+        self.stream.close()
+
+        for i in range(self.backups - 1, 0, -1):
+            src = '{0}.{1}'.format(self.path, i)
+            if os.path.exists(src):
+                os.rename(src, '{0}.{1}'.format(self.path, i + 1))
+
+        if self.backups > 0:
+            os.rename(self.path, '{0}.1'.format(self.path))
+        else:
+            os.unlink(self.path)
+
+        self._open_()
+
+    def write(self, data):
+        if self.stream is None:
+            self._open_()
+
+        if self.size and (self.size + len(data) > self.max_bytes):
+            self._rotate_()
+
+        self.stream.write(data)
+        self.stream.flush()
+        self.size += len(data)
+
+    def close(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+
+class LogPump(object):
+    """
+    Class Name:         LogPump
+    Description:        Drains the stdout/stderr pipes and serial consoles of
+                        all of the VMs of a simulation from a single poll
+                        loop into RotatingLogs.  The pump either hooks into
+                        an existing loop (any object with 'register(fd,
+                        handler, events)' and 'unregister(fd)', such as the
+                        PrivHelper), or runs its own loop with 'poll'.  The
+                        loop owner has to call 'tick' periodically so that
+                        serial consoles that weren't listening yet are
+                        connected again.
+    """
+    def __init__(self, loop=None, uid=None, gid=None, serial_retries=60):
+        self.loop = loop or self
+        self.uid = uid
+        self.gid = gid
+        self.serial_retries = serial_retries
+        self.streams = {}
+        self.pending_serial = []
+        self.handlers = {}
+        self.poller = select.poll() if loop is None else None
+
+    def register(self, fd, handler, events=select.POLLIN):
+        self.handlers[fd] = handler
+        self.poller.register(fd, events)
+
+    def unregister(self, fd):
+        if fd in self.handlers:
+            del self.handlers[fd]
+            self.poller.unregister(fd)
+
+    def poll(self, timeout=1.0):
+        """
+        Method Name:    poll
+
+        Parameters:     timeout
+                          - Seconds to wait for output
+
+        Description:    Run one iteration of the pump's own loop
+        """
+        try:
+            events = self.poller.poll(timeout * 1000)
+        except (select.error, IOError, OSError) as e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+
+        for fd, event in events:
+            handler = self.handlers.get(fd)
+            if handler:
+                handler(fd, event)
+
+        self.tick()
+
+    def _set_nonblocking_(self, fd):
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def add_stream(self, fd, path, max_bytes=default_max_bytes, backups=default_backups):
+        """
+        Method Name:    add_stream
+
+        Parameters:     fd
+                          - Read end of a pipe, e.g. a VM's stdout
+                        path
+                          - Log file to write the output to
+                        max_bytes
+                          - Size of the log file before it is rotated
+                        backups
+                          - Number of rotated log files to keep
+
+        Description:    Start draining a pipe.  The pump owns the file
+                        descriptor from now on and closes it at EOF.
+        """
+        self._set_nonblocking_(fd)
+        self.streams[fd] = {'log': RotatingLog(path, max_bytes, backups, self.uid, self.gid),
+                            'sock': None,
+                            'telnet': None}
+        self.loop.register(fd, self._read_, select.POLLIN | select.POLLHUP | select.POLLERR)
+
+    def add_serial(self, port, path, max_bytes=default_max_bytes, backups=default_backups):
+        """
+        Method Name:    add_serial
+
+        Parameters:     port
+                          - Local TCP port of the VM's telnet serial console
+                        path
+                          - Log file to write the console output to
+                        max_bytes
+                          - Size of the log file before it is rotated
+                        backups
+                          - Number of rotated log files to keep
+
+        Description:    Capture a VM's serial console.  QEMU only accepts
+                        one client, so nobody else can connect to the
+                        console while it is captured.
+        """
+        self.pending_serial.append({'port': port,
+                                    'log': RotatingLog(path, max_bytes, backups, self.uid, self.gid),
+                                    'tries': 0})
+        self._connect_serial_()
+
+    def _connect_serial_(self):
+        pending = self.pending_serial
+        self.pending_serial = []
+
+        for serial in pending:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(0)
+            rv = sock.connect_ex(('127.0.0.1', serial['port']))
+
+            if rv in (0, errno.EINPROGRESS):
+                fd = sock.fileno()
+                self.streams[fd] = {'log': serial['log'], 'sock': sock, 'telnet': [],
+                                    'serial': serial, 'connected': rv == 0}
+                self.loop.register(fd, self._read_, select.POLLIN | select.POLLOUT |
+                                   select.POLLHUP | select.POLLERR)
+            else:
+                sock.close()
+                self._retry_serial_(serial)
+
+    def _retry_serial_(self, serial):
+        serial['tries'] += 1
+        if serial['tries'] < self.serial_retries:
+            self.pending_serial.append(serial)
+        else:
+            log.warn('Gave up connecting to the serial console on port {0}'.format(serial['port']))
+            serial['log'].close()
+
+    def tick(self):
+        if self.pending_serial:
+            self._connect_serial_()
+
+    def _strip_telnet_(self, state, data):
+        # Remove the telnet negotiation that QEMU sends.  'state' holds the
+        # bytes of a command that was split over two reads.
+        out = bytearray()
+        for byte in bytearray(data):
+            if state:
+                state.append(byte)
+                if state[1] == telnet_iac:
+                    # Escaped 0xff data byte
+                    out.append(telnet_iac)
+                    del state[:]
+                elif state[1] == telnet_sb:
+                    if len(state) > 3 and state[-2] == telnet_iac and byte == telnet_se:
+                        del state[:]
+                elif state[1] < telnet_sb or len(state) == 3:
+                    del state[:]
+            elif byte == telnet_iac:
+                state.append(byte)
+            else:
+                out.append(byte)
+
+        return bytes(out)
+
+    def _read_(self, fd, event):
+        stream = self.streams.get(fd)
+        if stream is None:
+            self.loop.unregister(fd)
+            return
+
+        if stream['sock'] is not None and not stream['connected']:
+            err = stream['sock'].getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                self._close_(fd)
+                self._retry_serial_(stream['serial'])
+                return
+
+            # Only wait for output now that the connection is up
+            stream['connected'] = True
+            self.loop.unregister(fd)
+            self.loop.register(fd, self._read_, select.POLLIN | select.POLLHUP | select.POLLERR)
+            return
+
+        try:
+            data = os.read(fd, 65536)
+        except (IOError, OSError) as e:
+            if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                return
+            data = b''
+
+        if not data:
+            self._close_(fd)
+            stream['log'].close()
+            return
+
+        if stream['telnet'] is not None:
+            data = self._strip_telnet_(stream['telnet'], data)
+
+        if data:
+            stream['log'].write(data)
+
+    def _close_(self, fd):
+        stream = self.streams.pop(fd)
+        self.loop.unregister(fd)
+
+        if stream['sock'] is not None:
+            stream['sock'].close()
+        else:
+            os.close(fd)
+
+    def close(self):
+        for fd in list(self.streams):
+            stream = self.streams[fd]
+            self._close_(fd)
+            stream['log'].close()
+
+        for serial in self.pending_serial:
+            serial['log'].close()
+        self.pending_serial = []
+
+    def serve_forever(self, timeout=1.0):
+        """
+        Method Name:    serve_forever
+
+        Parameters:     timeout
+                          - Seconds between serial console reconnects
+
+        Description:    Run the pump's own loop until every stream is closed
+        """
+        while self.streams or self.pending_serial:
+            self.poll(timeout)
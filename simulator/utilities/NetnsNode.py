@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import errno
+import fcntl
+import select
+import signal
+import socket
+import struct
+import hashlib
+import argparse
+import subprocess
+import logging
+from simulator.utilities.LogWrapper import getLogger
+
+log = getLogger(__name__)
+
+# Namespaces are named mounts in this directory (see 'ip netns')
+netns_dir = '/run/netns'
+
+TUNSETIFF = 0x400454ca
+IFF_TAP = 0x0002
+IFF_NO_PI = 0x1000
+PR_SET_PDEATHSIG = 1
+
+# Largest frame that is read from a tap or a UDP socket
+max_frame = 65536
+
+
+class NetnsNodeError(Exception):
+    pass
+
+
+def namespace_prefix(sim_dir):
+    """
+    Function Name:      namespace_prefix
+
+    Parameters:         sim_dir
+                         - Simulation directory
+
+    Description:        Start of the names of the namespaces of a
+                        simulation.  Namespaces are global to the host, so
+                        the names have a hash of the simulation directory in
+                        them.
+
+    Returns:            str
+    """
+    digest = hashlib.sha1(os.path.abspath(sim_dir).encode('utf-8')).hexdigest()[:8]
+    return 'pds-{0}-'.format(digest)
+
+
+def namespace_name(sim_dir, node):
+    return namespace_prefix(sim_dir) + node
+
+
+def list_namespaces(sim_dir):
+    """
+    Function Name:      list_namespaces
+
+    Parameters:         sim_dir
+                         - Simulation directory
+
+    Description:        Namespaces of a simulation that exist on the host
+
+    Returns:            list
+                         - Names of the namespaces
+    """
+    if not os.path.isdir(netns_dir):
+        return []
+
+    prefix = namespace_prefix(sim_dir)
+    return sorted(name for name in os.listdir(netns_dir) if name.startswith(prefix))
+
+
+def open_tap(name):
+    """
+    Function Name:      open_tap
+
+    Parameters:         name
+                         - Name of the tap device, at most 15 characters
+
+    Description:        Create a tap device that exists as long as the file
+                        descriptor is open.  Frames are read and written
+                        without the packet information header.
+
+    Returns:            int
+                         - File descriptor of the tap
+    """
+    fd = os.open('/dev/net/tun', os.O_RDWR)
+    try:
+        fcntl.ioctl(fd, TUNSETIFF, struct.pack('16sH', name.encode('ascii'), IFF_TAP | IFF_NO_PI))
+    except (IOError, OSError):
+        os.close(fd)
+        raise
+
+    return fd
+
+
+def _die_with_parent_():
+    # The command of the node is killed when the runner is, even by SIGKILL
+    import ctypes
+    try:
+        ctypes.CDLL(None).prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+    except (AttributeError, OSError):
+        pass
+
+
+class TapBridge(object):
+    """
+    Class Name:         TapBridge
+    Description:        One link between a namespace node and a VM.  The
+                        interface of the node is a tap device that is moved
+                        into its namespace, and every frame is forwarded
+                        between the tap and a UDP socket, the same way that
+                        QEMU's '-netdev socket,udp=' sends them.
+    """
+    def __init__(self, name, mac, sport, dport, addr='127.0.0.1'):
+        self.name = name
+        self.mac = mac
+        self.sport = int(sport)
+        self.dport = int(dport)
+        self.addr = addr
+        self.tap = None
+        self.sock = None
+
+    def open(self, namespace, index):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((self.addr, self.sport))
+        self.sock.connect((self.addr, self.dport))
+        self.sock.setblocking(False)
+
+        # The tap is created in the host's namespace with a temporary name,
+        # the interface name of the link may already be used there
+        tmp_name = 'pdt{0}-{1}'.format(os.getpid(), index)[:15]
+        self.tap = open_tap(tmp_name)
+
+        subprocess.check_call(['ip', 'link', 'set', 'dev', tmp_name, 'netns', namespace])
+        subprocess.check_call(['ip', '-n', namespace, 'link', 'set', 'dev', tmp_name,
+                               'name', self.name, 'address', self.mac, 'up'])
+
+    def from_tap(self):
+        frame = os.read(self.tap, max_frame)
+        try:
+            self.sock.send(frame)
+        except socket.error as e:
+            # Nothing listens on the port while the VM is down
+            if e.errno not in [errno.ECONNREFUSED, errno.EAGAIN]:
+                raise
+
+    def from_socket(self):
+        try:
+            frame = self.sock.recv(max_frame)
+        except socket.error as e:
+            if e.errno in [errno.ECONNREFUSED, errno.EAGAIN]:
+                return
+            raise
+
+        try:
+            os.write(self.tap, frame)
+        except OSError as e:
+            # The interface is down
+            if e.errno not in [errno.EIO, errno.EAGAIN]:
+                raise
+
+    def close(self):
+        if self.tap is not None:
+            os.close(self.tap)
+        if self.sock is not None:
+            self.sock.close()
+
+        self.tap = None
+        self.sock = None
+
+
+def run_node(namespace, links, bridges, command):
+    """
+    Function Name:      run_node
+
+    Parameters:         namespace
+                         - Namespace of the node, the builder made it and
+                           the veth links in it
+                        links
+                         - (interface, MAC) of every veth link of the node
+                        bridges
+                         - TapBridge of every link to a VM
+                        command
+                         - argv that is run in the namespace
+
+    Description:        Bring up the interfaces of the node, run its command
+                        in the namespace and forward the frames of the links
+                        to VMs until the command exits
+
+    Returns:            int
+                         - Exit code of the command
+    """
+    for i, bridge in enumerate(bridges):
+        bridge.open(namespace, i)
+
+    batch = ['link set dev lo up'] + ['link set dev {0} address {1} up'.format(name, mac) for name, mac in links]
+    proc = subprocess.Popen(['ip', '-n', namespace, '-batch', '-'], stdin=subprocess.PIPE)
+    proc.communicate('\n'.join(batch).encode('utf-8') + b'\n')
+    if proc.returncode:
+        raise NetnsNodeError('Bringing up the interfaces in {0} failed'.format(namespace))
+
+    child = subprocess.Popen(['ip', 'netns', 'exec', namespace] + command, close_fds=True,
+                             preexec_fn=_die_with_parent_)
+
+    def stop(signum, frame):
+        child.terminate()
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+
+    handlers = {}
+    for bridge in bridges:
+        handlers[bridge.tap] = bridge.from_tap
+        handlers[bridge.sock.fileno()] = bridge.from_socket
+
+    try:
+        while child.poll() is None:
+            try:
+                readable, _, _ = select.select(list(handlers), [], [], 1.0)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd in readable:
+                handlers[fd]()
+    finally:
+        for bridge in bridges:
+            bridge.close()
+
+    return child.returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyDotSimulator network namespace node')
+    parser.add_argument('--sim-dir', help='Simulation directory', required=True)
+    parser.add_argument('--node', help='Name of the node', required=True)
+    parser.add_argument('--link', help='Veth link as interface,MAC', action='append', default=[])
+    parser.add_argument('--bridge', help='Link to a VM as interface,MAC,local port,remote port',
+                        action='append', default=[])
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='Command to run in the namespace')
+
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        parser.error('No command to run in the namespace')
+
+    links = [tuple(link.split(',')) for link in args.link]
+    bridges = [TapBridge(*bridge.split(',')) for bridge in args.bridge]
+
+    returncode = run_node(namespace_name(args.sim_dir, args.node), links, bridges, command)
+
+    # The exit code of a command that was killed is negative
+    sys.exit(returncode if returncode >= 0 else 128 - returncode)
+
+
+if __name__ == '__main__':
+    main()
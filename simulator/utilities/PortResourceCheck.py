@@ -16,8 +16,27 @@ class PortResourceCheck(object):
     def __init__(self, start=61001, end=65535, directory='/tmp/port_check'):
         self.free_ports = []
         self.used_ports = []
+        self.start = start
+        self.end = end
+        self.scanned = False
 
+        # The port directory is only scanned when ports are allocated, so
+        # releasing ports (e.g. when stopping a simulation) stays cheap
         self.directory = directory
+
+    def scan(self):
+        """
+        Method Name:    scan
+
+        Parameters:     None
+
+        Description:    Find all of the free UDP ports.  The port directory
+                        is created with a file for every free port if it
+                        doesn't exist yet.
+        """
+        self.scanned = True
+        self.free_ports = []
+
         if not os.path.exists(self.directory):
             log.debug('Creating the directory, {0}, since it didn\'t exist'.format(self.directory))
             os.mkdir(self.directory)
@@ -25,7 +44,7 @@ class PortResourceCheck(object):
 
             if rv:
                 # Lock for the directory acquired
-                for i in range(start, end+1):
+                for i in range(self.start, self.end+1):
                     if self.check_udp_state(i):
                         lock_acquired, fd = self.lock_file("{0}/{1}".format(self.directory, i))
                         if lock_acquired:
@@ -82,6 +101,9 @@ class PortResourceCheck(object):
         os.close(dir_fp)
 
     def get_free_ports(self, num_ports, sim_dir=None):
+        if not self.scanned:
+            self.scan()
+
         ports = []
 
         while len(ports) < num_ports:
@@ -90,6 +112,12 @@ class PortResourceCheck(object):
             except IndexError as e:
                 break
 
+            # The list of free ports may be stale if it was scanned a while
+            # ago (e.g. by the host daemon), skip ports that were taken since
+            with open('{0}/{1}'.format(self.directory, port), 'r') as f:
+                if f.read():
+                    continue
+
             rv, fp = self.lock_file('{0}/{1}'.format(self.directory, port))
             if rv and sim_dir:
                 fp.write('{0}'.format(sim_dir))
@@ -101,6 +129,55 @@ class PortResourceCheck(object):
 
         return ports
 
+    def reserve_ports(self, ports, sim_dir):
+        """
+        Method Name:    reserve_ports
+
+        Parameters:     ports
+                          - List of specific UDP ports to take
+                        sim_dir
+                          - Simulation directory that will own the ports
+
+        Description:    Take a specific set of ports, e.g. the ports of a
+                        cached launch plan.  Either all of the ports are
+                        taken or none of them are.
+
+        Returns:        Boolean
+                          - True if all of the ports were reserved
+        """
+        reserved = []
+
+        for port in ports:
+            port_file = '{0}/{1}'.format(self.directory, port)
+            if not os.path.exists(port_file):
+                break
+
+            with open(port_file, 'r') as f:
+                if f.read():
+                    # Owned by a simulation
+                    break
+
+            rv, fp = self.lock_file(port_file)
+            if not rv:
+                break
+
+            fp.write('{0}'.format(sim_dir))
+            self.unlock_file(fp)
+            reserved.append(port)
+
+            if port in self.free_ports:
+                self.free_ports.remove(port)
+
+            if port not in self.used_ports:
+                self.used_ports.append(port)
+        else:
+            return True
+
+        log.debug('Port {0} is no longer free'.format(port))
+        self.release_port(reserved, sim_dir=sim_dir)
+
+        return False
+
     def release_port(self, ports, sim_dir=None):
         for port in ports:
             if port in self.used_ports:
@@ -116,4 +193,6 @@ class PortResourceCheck(object):
                                 fd.write('')
                                 self.unlock_file(fd)
                                 self.used_ports.remove(port)
-                                self.free_ports.append(port)
+
+                                if self.scanned:
+                                    self.free_ports.append(port)
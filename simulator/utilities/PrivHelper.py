@@ -0,0 +1,660 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import errno
+import fcntl
+import select
+import signal
+import socket
+import argparse
+import threading
+import subprocess
+import logging
+from collections import deque
+from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.LogPump import LogPump, default_max_bytes, default_backups
+from simulator.utilities.Supervisor import Supervisor
+
+log = getLogger(__name__)
+
+helper_socket_name = 'priv_helper.sock'
+
+
+class PrivHelperError(Exception):
+    pass
+
+
+class PrivHelper(object):
+    """
+    Class Name:         PrivHelper
+    Description:        Long lived privileged process that is started once
+                        per simulation.  It accepts batches of requests over
+                        a Unix socket and runs them without a shell:
+
+                            spawn           - start a process from an argv list,
+                                              optionally capturing its output
+                                              and supervising it (see
+                                              Supervisor)
+                            kill            - send a signal to PIDs
+                            create_overlay  - create a QCOW2 overlay image
+                            ip_batch        - run 'ip' commands (network
+                                              namespaces and their links)
+                            status          - exit codes of spawned processes
+                            ping            - check that the helper is alive
+                            shutdown        - stop the helper
+
+                        Every request is a single line of JSON with a list
+                        of 'requests'.  The reply is a single line of JSON
+                        with a 'results' entry for every request.
+    """
+    def __init__(self, socket_path, uid=None, gid=None):
+        self.socket_path = socket_path
+        self.uid = uid
+        self.gid = gid
+        self.children = {}
+        self.exit_codes = {}
+        self.running = False
+        self.sock = None
+        self.poller = None
+        self.handlers = {}
+        self.log_pump = LogPump(loop=self, uid=uid, gid=gid)
+        self.supervisor = Supervisor(self, uid=uid, gid=gid)
+
+        # Called on every iteration of the loop, at least every 'timeout'
+        # seconds
+        self.periodic = [self.reap, self.log_pump.tick, self.supervisor.tick]
+
+        # Calls that other threads run in the loop (see 'call_in_loop') and
+        # the pipe that wakes the loop up for them
+        self.loop_thread = None
+        self.calls = deque()
+        self.calls_lock = threading.Lock()
+        self.wakeup = None
+
+    def bind(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.socket_path)
+
+        # Only the user that started the helper may talk to it
+        os.chmod(self.socket_path, 0o600)
+        if self.uid is not None:
+            os.chown(self.socket_path, self.uid, self.gid if self.gid is not None else -1)
+
+        self.sock.listen(16)
+
+    def register(self, fd, handler, events=select.POLLIN):
+        """
+        Method Name:    register
+
+        Parameters:     fd
+                          - File descriptor to watch in the helper's loop
+                        handler
+                          - Callable that is passed the fd and the poll events
+                        events
+                          - poll events to wait for
+
+        Description:    Add a file descriptor to the helper's poll loop
+        """
+        self.handlers[fd] = handler
+        self.poller.register(fd, events)
+
+    def unregister(self, fd):
+        if fd in self.handlers:
+            del self.handlers[fd]
+            self.poller.unregister(fd)
+
+    def call_in_loop(self, func, *args):
+        """
+        Method Name:    call_in_loop
+
+        Parameters:     func
+                          - Callable to run
+                        args
+                          - Arguments of the callable
+
+        Description:    Run a callable in the helper's loop and wait for it.
+                        The children, the log pump and the supervisor are
+                        only ever changed by the loop, so other threads
+                        spawn and kill processes through this.  When called
+                        from the loop, or before it runs, the callable is
+                        run right away.
+
+        Returns:        The value that the callable returned, its exception
+                        is raised again in the calling thread
+        """
+        with self.calls_lock:
+            if self.loop_thread is None or self.loop_thread is threading.current_thread():
+                queued = None
+            else:
+                queued = {'func': func, 'args': args, 'done': threading.Event()}
+                self.calls.append(queued)
+                os.write(self.wakeup[1], b'x')
+
+        if queued is None:
+            return func(*args)
+
+        queued['done'].wait()
+        if 'error' in queued:
+            raise queued['error']
+
+        return queued['result']
+
+    def _run_calls_(self, fd, event):
+        try:
+            while os.read(self.wakeup[0], 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+        while self.calls:
+            queued = self.calls.popleft()
+            try:
+                queued['result'] = queued['func'](*queued['args'])
+            except Exception as e:
+                queued['error'] = e
+            queued['done'].set()
+
+    def serve_forever(self, timeout=1.0):
+        self.poller = select.poll()
+        self.register(self.sock.fileno(), self._accept_)
+
+        self.wakeup = os.pipe()
+        for fd in self.wakeup:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.register(self.wakeup[0], self._run_calls_)
+
+        self.loop_thread = threading.current_thread()
+        self.running = True
+
+        while self.running:
+            try:
+                events = self.poller.poll(timeout * 1000)
+            except (select.error, IOError, OSError) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd, event in events:
+                handler = self.handlers.get(fd)
+                if handler:
+                    handler(fd, event)
+
+            for callback in self.periodic:
+                callback()
+
+        # Threads that are still waiting for the loop are let go
+        with self.calls_lock:
+            self.loop_thread = None
+            while self.calls:
+                queued = self.calls.popleft()
+                queued['error'] = PrivHelperError('The helper was shut down')
+                queued['done'].set()
+
+        for fd in self.wakeup:
+            os.close(fd)
+        self.wakeup = None
+
+        self.supervisor.close()
+        self.log_pump.close()
+        self.sock.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def reap(self):
+        for pid, proc in list(self.children.items()):
+            rc = proc.poll()
+            if rc is not None:
+                log.debug('PID {0} exited with {1}'.format(pid, rc))
+                self.exit_codes[pid] = rc
+                del self.children[pid]
+                self.supervisor.exited(pid, rc)
+
+    def _accept_(self, fd, event):
+        conn, _ = self.sock.accept()
+        conn.settimeout(30)
+
+        try:
+            data = b''
+            while not data.endswith(b'\n'):
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        except socket.error as e:
+            log.warn('Lost connection with a client: {0}'.format(e))
+            conn.close()
+            return
+
+        if not data.strip():
+            conn.close()
+            return
+
+        try:
+            requests = json.loads(data.decode('utf-8'))['requests']
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply_(conn, [{'error': 'Malformed request: {0}'.format(e)}])
+        else:
+            self._serve_(conn, requests)
+
+    def _serve_(self, conn, requests):
+        # Handle a batch of requests in the loop and reply to the client
+        self._reply_(conn, [self.handle(request) for request in requests])
+
+    def _reply_(self, conn, results):
+        try:
+            conn.sendall(json.dumps({'results': results}).encode('utf-8') + b'\n')
+        except socket.error as e:
+            log.warn('Lost connection with a client: {0}'.format(e))
+        finally:
+            conn.close()
+
+    def handle(self, request):
+        op = request.get('op')
+        try:
+            if op == 'spawn':
+                return self.spawn(request['argv'], request.get('stdout'), request.get('stderr'),
+                                  request.get('logs'), request.get('supervise'))
+            elif op == 'kill':
+                return self.kill(request['pids'], request.get('signal', signal.SIGKILL))
+            elif op == 'create_overlay':
+                return self.create_overlay(request['base_image'], request['overlay'])
+            elif op == 'ip_batch':
+                return self.ip_batch(request['commands'])
+            elif op == 'status':
+                return self.status(request.get('pids'))
+            elif op == 'ping':
+                return {'pid': os.getpid()}
+            elif op == 'shutdown':
+                self.running = False
+                return {}
+            else:
+                return {'error': 'Unknown request {0}'.format(op)}
+        except (KeyError, TypeError) as e:
+            return {'error': 'Malformed {0} request: {1}'.format(op, e)}
+        except (OSError, IOError) as e:
+            return {'error': str(e)}
+
+    def spawn(self, argv, stdout=None, stderr=None, logs=None, supervise=None):
+        devnull = open(os.devnull, 'r+')
+        out = open(stdout, 'a') if stdout else devnull
+        err = open(stderr, 'a') if stderr else devnull
+
+        # With 'logs', stdout and stderr are pipes that the log pump drains
+        # into size capped log files
+        if logs:
+            out = subprocess.PIPE if logs.get('stdout') else out
+            err = subprocess.PIPE if logs.get('stderr') else err
+
+        try:
+            proc = subprocess.Popen(argv, stdin=devnull, stdout=out, stderr=err,
+                                    close_fds=True, preexec_fn=os.setsid)
+        finally:
+            for f in set([devnull, out, err]):
+                if f is not subprocess.PIPE:
+                    f.close()
+
+        self.children[proc.pid] = proc
+        log.debug('Spawned PID {0}: {1}'.format(proc.pid, " ".join(argv)))
+
+        if logs:
+            self._capture_logs_(proc, logs)
+
+        if supervise:
+            self.supervisor.watch(proc.pid, argv, logs, supervise)
+
+        return {'pid': proc.pid}
+
+    def _capture_logs_(self, proc, logs):
+        sizes = {'max_bytes': logs.get('max_bytes', default_max_bytes),
+                 'backups': logs.get('backups', default_backups)}
+
+        # The pump owns the file descriptors from now on
+        for name, pipe in [('stdout', proc.stdout), ('stderr', proc.stderr)]:
+            if logs.get(name):
+                self.log_pump.add_stream(os.dup(pipe.fileno()), logs[name], **sizes)
+                pipe.close()
+
+        if logs.get('serial') and logs.get('serial_port'):
+            self.log_pump.add_serial(logs['serial_port'], logs['serial'], **sizes)
+
+    def kill(self, pids, sig=signal.SIGKILL):
+        errors = {}
+
+        # Killed VMs are stopped, not crashed
+        self.supervisor.stop_watching(pids)
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    errors[str(pid)] = str(e)
+
+        self.reap()
+        return {'errors': errors}
+
+    def create_overlay(self, base_image, overlay):
+        overlay_dir = os.path.dirname(overlay)
+        if not os.path.exists(overlay_dir):
+            os.makedirs(overlay_dir)
+
+        cmd = ['qemu-img', 'create', '-b', base_image, '-f', 'qcow2', overlay]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+
+        return {'returncode': proc.returncode, 'stderr': err.decode('utf-8', 'replace')}
+
+    def ip_batch(self, commands):
+        # '-force' runs the rest of the commands when one of them fails
+        proc = subprocess.Popen(['ip', '-force', '-batch', '-'], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate('\n'.join(commands).encode('utf-8') + b'\n')
+
+        return {'returncode': proc.returncode, 'stderr': err.decode('utf-8', 'replace')}
+
+    def status(self, pids=None):
+        self.reap()
+
+        if pids is None:
+            pids = list(self.children) + list(self.exit_codes)
+
+        # JSON keys are always strings
+        return {'status': dict((str(pid), self.exit_codes.get(pid)) for pid in pids)}
+
+
+class PrivLauncher(object):
+    """
+    Class Name:         PrivLauncher
+    Description:        Client for the PrivHelper of a simulation.  'start'
+                        launches the helper with a single 'sudo' (nothing is
+                        needed when already running as root).  If 'use_helper'
+                        is False, or the helper isn't running, the requests
+                        are run in this process with 'sudo' in front of every
+                        argv list, still without a shell.
+    """
+    def __init__(self, sim_dir, use_helper=True):
+        self.sim_dir = sim_dir
+        self.socket_path = os.path.join(sim_dir, helper_socket_name)
+        self.use_helper = use_helper
+
+    def _sudo_(self):
+        return [] if os.geteuid() == 0 else ['sudo']
+
+    def is_alive(self):
+        if not os.path.exists(self.socket_path):
+            return False
+
+        try:
+            self._send_([{'op': 'ping'}])
+        except (socket.error, PrivHelperError):
+            return False
+        else:
+            return True
+
+    def helper_command(self):
+        """
+        Method Name:    helper_command
+
+        Parameters:     None
+
+        Description:    Command that starts the helper of this simulation in
+                        the background
+
+        Returns:        list
+                          - argv of the command
+        """
+        pkg_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        python_path = os.pathsep.join([p for p in [pkg_root, os.environ.get('PYTHONPATH')] if p])
+
+        return self._sudo_() + ['env', 'PYTHONPATH={0}'.format(python_path),
+                                sys.executable, '-m', 'simulator.utilities.PrivHelper',
+                                '--socket', self.socket_path,
+                                '--uid', str(os.getuid()), '--gid', str(os.getgid()),
+                                '--log', os.path.join(self.sim_dir, 'priv_helper.log'),
+                                '--daemon']
+
+    def start(self):
+        """
+        Method Name:    start
+
+        Parameters:     None
+
+        Description:    Start the privileged helper for this simulation
+                        if it isn't running yet.  Falls back to running the
+                        requests locally if the helper can't be started.
+        """
+        if not self.use_helper or self.is_alive():
+            return
+
+        cmd = self.helper_command()
+        log.debug('Starting the privileged helper: {0}'.format(" ".join(cmd)))
+        if subprocess.call(cmd) != 0 or not self.is_alive():
+            log.warn('Couldn\'t start the privileged helper, running every request with sudo')
+            self.use_helper = False
+
+    def _send_(self, requests):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps({'requests': requests}).encode('utf-8') + b'\n')
+
+            data = b''
+            while not data.endswith(b'\n'):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        finally:
+            sock.close()
+
+        try:
+            return json.loads(data.decode('utf-8'))['results']
+        except (ValueError, KeyError) as e:
+            raise PrivHelperError('Bad reply from the privileged helper: {0}'.format(e))
+
+    def request(self, requests):
+        """
+        Method Name:    request
+
+        Parameters:     requests
+                          - List of request dictionaries (see PrivHelper)
+
+        Description:    Send a batch of requests to the helper, or run them
+                        locally if the helper isn't used
+
+        Returns:        list
+                          - Result dictionary for every request
+        """
+        if self.use_helper and os.path.exists(self.socket_path):
+            return self._send_(requests)
+
+        return [self._run_locally_(request) for request in requests]
+
+    def _run_locally_(self, request):
+        op = request['op']
+        devnull = open(os.devnull, 'r+')
+
+        try:
+            if op == 'spawn':
+                # Without the helper nothing outlives this process to drain
+                # pipes, so the output goes straight to the (uncapped) log files
+                logs = request.get('logs') or {}
+                out = err = devnull
+                for name in ['stdout', 'stderr']:
+                    if logs.get(name):
+                        log_dir = os.path.dirname(logs[name])
+                        if not os.path.exists(log_dir):
+                            os.makedirs(log_dir)
+
+                out = open(logs['stdout'], 'ab') if logs.get('stdout') else devnull
+                err = open(logs['stderr'], 'ab') if logs.get('stderr') else devnull
+
+                try:
+                    proc = subprocess.Popen(self._sudo_() + request['argv'], stdin=devnull,
+                                            stdout=out, stderr=err, close_fds=True)
+                finally:
+                    for f in set([out, err]):
+                        if f is not devnull:
+                            f.close()
+
+                return {'pid': proc.pid}
+            elif op == 'kill':
+                if request['pids']:
+                    cmd = self._sudo_() + ['kill', '-{0}'.format(request.get('signal', signal.SIGKILL))]
+                    subprocess.call(cmd + [str(pid) for pid in request['pids']],
+                                    stdout=devnull, stderr=devnull)
+                return {'errors': {}}
+            elif op == 'create_overlay':
+                overlay_dir = os.path.dirname(request['overlay'])
+                if not os.path.exists(overlay_dir):
+                    os.makedirs(overlay_dir)
+
+                cmd = self._sudo_() + ['qemu-img', 'create', '-b', request['base_image'],
+                                       '-f', 'qcow2', request['overlay']]
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                out, err = proc.communicate()
+                return {'returncode': proc.returncode, 'stderr': err.decode('utf-8', 'replace')}
+            elif op == 'ip_batch':
+                cmd = self._sudo_() + ['ip', '-force', '-batch', '-']
+                proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                out, err = proc.communicate('\n'.join(request['commands']).encode('utf-8') + b'\n')
+                return {'returncode': proc.returncode, 'stderr': err.decode('utf-8', 'replace')}
+            elif op in ['ping', 'shutdown']:
+                return {}
+            else:
+                return {'error': '{0} is only supported by the helper'.format(op)}
+        finally:
+            devnull.close()
+
+    def spawn(self, argv_list, stdout=None, stderr=None, logs_list=None, supervise_list=None):
+        """
+        Method Name:    spawn
+
+        Parameters:     argv_list
+                          - List of argv lists to start
+                        stdout/stderr
+                          - Files to append the output of every process to
+                        logs_list
+                          - Log settings for every process (see
+                            LogPump.get_log_paths), or None to drop the
+                            output
+                        supervise_list
+                          - Supervisor settings for every process, or None
+                            to leave it alone.  Only the helper supervises
+                            processes.
+
+        Description:    Start the processes in a single batch
+
+        Returns:        list
+                          - PID of every process
+        """
+        logs_list = logs_list or [None] * len(argv_list)
+        supervise_list = supervise_list or [None] * len(argv_list)
+        results = self.request([{'op': 'spawn', 'argv': argv, 'stdout': stdout, 'stderr': stderr,
+                                 'logs': logs, 'supervise': supervise}
+                                for argv, logs, supervise in zip(argv_list, logs_list, supervise_list)])
+        return [r.get('pid') for r in results]
+
+    def kill(self, pids, sig=signal.SIGKILL):
+        return self.request([{'op': 'kill', 'pids': list(pids), 'signal': int(sig)}])[0]
+
+    def create_overlays(self, overlays):
+        """
+        Method Name:    create_overlays
+
+        Parameters:     overlays
+                          - List of (base image, overlay path) tuples
+
+        Description:    Create the overlay images in a single batch
+
+        Returns:        list
+                          - 'qemu-img' exit code for every overlay
+        """
+        results = self.request([{'op': 'create_overlay', 'base_image': base, 'overlay': overlay}
+                                for base, overlay in overlays])
+
+        for (base, overlay), result in zip(overlays, results):
+            if result.get('returncode') or result.get('error'):
+                log.warn('Creating {0} failed: {1}'.format(overlay, result.get('stderr') or result.get('error')))
+
+        return [r.get('returncode') for r in results]
+
+    def ip_batch(self, commands):
+        """
+        Method Name:    ip_batch
+
+        Parameters:     commands
+                          - 'ip' commands, e.g. 'netns add <name>'
+
+        Description:    Run the commands with a single 'ip -batch'.  A
+                        command that fails doesn't stop the ones after it.
+
+        Returns:        int
+                          - Exit code of 'ip'
+        """
+        if not commands:
+            return 0
+
+        result = self.request([{'op': 'ip_batch', 'commands': list(commands)}])[0]
+        if result.get('returncode') or result.get('error'):
+            log.warn('ip -batch failed: {0}'.format((result.get('stderr') or result.get('error') or '').strip()))
+
+        return result.get('returncode')
+
+    def shutdown(self):
+        if self.use_helper and self.is_alive():
+            self._send_([{'op': 'shutdown'}])
+
+
+def daemonize(log_file=None):
+    """
+    Function Name:      daemonize
+
+    Parameters:         log_file
+                         - File to send stdout/stderr to
+
+    Description:        Detach from the terminal.  The parent process exits
+                        once the child is running so the caller knows the
+                        socket is ready.
+    """
+    if os.fork() > 0:
+        os._exit(0)
+
+    os.setsid()
+
+    if os.fork() > 0:
+        os._exit(0)
+
+    devnull = os.open(os.devnull, os.O_RDWR)
+    out = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644) if log_file else devnull
+    os.dup2(devnull, 0)
+    os.dup2(out, 1)
+    os.dup2(out, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyDotSimulator privileged helper')
+    parser.add_argument('--socket', help='Unix socket to listen on', required=True)
+    parser.add_argument('--uid', help='User allowed to use the socket', type=int, default=None)
+    parser.add_argument('--gid', help='Group of the socket', type=int, default=None)
+    parser.add_argument('--log', help='Log file when running as a daemon', default=None)
+    parser.add_argument('--daemon', action='store_true', help='Run in the background', default=False)
+
+    args = parser.parse_args()
+
+    helper = PrivHelper(args.socket, uid=args.uid, gid=args.gid)
+    helper.bind()
+
+    if args.daemon:
+        daemonize(args.log)
+
+    helper.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
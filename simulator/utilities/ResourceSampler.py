@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import struct
+import argparse
+import threading
+import logging
+from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.SimState import read_state, get_state_path
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+log = getLogger(__name__)
+
+ring_file_name = 'stats.ring'
+ring_nodes_file_name = 'stats.nodes.json'
+ring_magic = b'PDSR'
+
+# magic, capacity, record size, number of records written
+ring_header = struct.Struct('<4sIIQ')
+# time, node index, pid, cpu percent, rss, read bytes, write bytes, context switches
+ring_record = struct.Struct('<dIIdQQQQ')
+record_fields = ['time', 'node', 'pid', 'cpu_percent', 'rss', 'read_bytes', 'write_bytes', 'ctx_switches']
+
+
+class RingBuffer(object):
+    """
+    Class Name:         RingBuffer
+    Description:        Fixed size file of resource samples.  Once 'capacity'
+                        samples have been written, the oldest samples are
+                        overwritten.  The names of the nodes are kept in a
+                        separate JSON file, the records only have the index
+                        of the node.
+    """
+    def __init__(self, sim_dir, capacity=8192):
+        self.path = os.path.join(sim_dir, ring_file_name)
+        self.nodes_path = os.path.join(sim_dir, ring_nodes_file_name)
+        self.capacity = capacity
+        self.count = 0
+        self.stream = None
+
+    def create(self, node_names):
+        with open(self.nodes_path, 'w') as stream:
+            json.dump(list(node_names), stream)
+
+        self.stream = open(self.path, 'w+b')
+        self.stream.truncate(ring_header.size + self.capacity * ring_record.size)
+        self.count = 0
+        self._write_header_()
+
+    def _write_header_(self):
+        self.stream.seek(0)
+        self.stream.write(ring_header.pack(ring_magic, self.capacity, ring_record.size, self.count))
+
+    def append(self, records):
+        for record in records:
+            self.stream.seek(ring_header.size + (self.count % self.capacity) * ring_record.size)
+            self.stream.write(ring_record.pack(*record))
+            self.count += 1
+
+        # The header is written last, so readers never see a record
+        # before it is complete
+        self._write_header_()
+        self.stream.flush()
+
+    def close(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+    @classmethod
+    def read(cls, sim_dir):
+        """
+        Method Name:    read
+
+        Parameters:     sim_dir
+                          - Simulation directory
+
+        Description:    Read all of the samples that are in the ring buffer,
+                        oldest first
+
+        Returns:        list
+                          - Dictionary for every sample
+        """
+        path = os.path.join(sim_dir, ring_file_name)
+        if not os.path.exists(path):
+            return []
+
+        with open(os.path.join(sim_dir, ring_nodes_file_name), 'r') as stream:
+            node_names = json.load(stream)
+
+        with open(path, 'rb') as stream:
+            magic, capacity, record_size, count = ring_header.unpack(stream.read(ring_header.size))
+            if magic != ring_magic or record_size != ring_record.size:
+                log.warn('{0} isn\'t a resource sample file'.format(path))
+                return []
+
+            data = stream.read(capacity * record_size)
+
+        samples = []
+        for i in range(max(0, count - capacity), count):
+            offset = (i % capacity) * record_size
+            sample = dict(zip(record_fields, ring_record.unpack(data[offset:offset + record_size])))
+            sample['node'] = node_names[sample['node']]
+            samples.append(sample)
+
+        return samples
+
+
+def latest_stats(sim_dir):
+    """
+    Function Name:      latest_stats
+
+    Parameters:         sim_dir
+                         - Simulation directory
+
+    Description:        Get the most recent sample of every node
+
+    Returns:            dict
+                         - {node name: sample}
+    """
+    stats = {}
+    for sample in RingBuffer.read(sim_dir):
+        stats[sample['node']] = sample
+
+    return stats
+
+
+class ResourceSampler(object):
+    """
+    Class Name:         ResourceSampler
+    Description:        Periodically samples the CPU, RSS, disk I/O and
+                        context switches of the QEMU process tree of every
+                        node in a simulation and appends them to the ring
+                        buffer in the simulation directory.  The PIDs are
+                        read from the state file, which is re-read when it
+                        changes.
+    """
+    def __init__(self, sim_dir, interval=1.0, capacity=8192):
+        self.sim_dir = sim_dir
+        self.interval = interval
+        self.ring = RingBuffer(sim_dir, capacity)
+        self.node_pids = {}
+        self.node_index = {}
+        self.prev_cpu = {}
+        self.state_mtime = None
+        self.running = False
+        self.thread = None
+
+        try:
+            import psutil
+            self.psutil = psutil
+        except ImportError:
+            log.debug('psutil isn\'t available, reading the process stats from /proc')
+            self.psutil = None
+
+    def _load_pids_(self):
+        path = get_state_path(self.sim_dir)
+        if not os.path.exists(path):
+            return False
+
+        mtime = os.path.getmtime(path)
+        if mtime != self.state_mtime:
+            self.state_mtime = mtime
+            nodes = read_state(self.sim_dir)['nodes']
+            self.node_pids = dict((name, node.get('pid')) for name, node in nodes.items())
+
+            if set(self.node_pids) != set(self.node_index):
+                names = sorted(self.node_pids)
+                self.node_index = dict((name, i) for i, name in enumerate(names))
+                self.ring.close()
+                self.ring.create(names)
+
+        return True
+
+    def _sample_tree_(self, pid):
+        if not self.psutil:
+            return self._sample_tree_proc_(pid)
+
+        psutil = self.psutil
+        try:
+            root = psutil.Process(pid)
+            procs = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return None
+
+        totals = {'cpu': 0.0, 'rss': 0, 'read_bytes': 0, 'write_bytes': 0, 'ctx_switches': 0}
+        for proc in procs:
+            try:
+                with proc.oneshot():
+                    cpu = proc.cpu_times()
+                    totals['cpu'] += cpu.user + cpu.system
+                    totals['rss'] += proc.memory_info().rss
+                    ctx = proc.num_ctx_switches()
+                    totals['ctx_switches'] += ctx.voluntary + ctx.involuntary
+
+                    try:
+                        io = proc.io_counters()
+                    except (psutil.AccessDenied, AttributeError):
+                        # The VMs are started as root, so the I/O counters
+                        # can only be read when sampling as root
+                        pass
+                    else:
+                        totals['read_bytes'] += io.read_bytes
+                        totals['write_bytes'] += io.write_bytes
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+
+        return totals
+
+    def _proc_children_(self, pid):
+        children = []
+        task_dir = '/proc/{0}/task'.format(pid)
+        for tid in os.listdir(task_dir):
+            with open('{0}/{1}/children'.format(task_dir, tid), 'r') as stream:
+                children.extend(int(child) for child in stream.read().split())
+
+        return children
+
+    def _sample_tree_proc_(self, pid):
+        clock_ticks = float(os.sysconf('SC_CLK_TCK'))
+        page_size = os.sysconf('SC_PAGE_SIZE')
+
+        totals = {'cpu': 0.0, 'rss': 0, 'read_bytes': 0, 'write_bytes': 0, 'ctx_switches': 0}
+        pending = [pid]
+        found = False
+
+        while pending:
+            current = pending.pop()
+            proc_dir = '/proc/{0}'.format(current)
+
+            try:
+                with open(proc_dir + '/stat', 'r') as stream:
+                    # The command name may have spaces, the fields start after it
+                    fields = stream.read().rsplit(')', 1)[1].split()
+                totals['cpu'] += (int(fields[11]) + int(fields[12])) / clock_ticks
+                totals['rss'] += int(fields[21]) * page_size
+
+                with open(proc_dir + '/status', 'r') as stream:
+                    for line in stream:
+                        if line.startswith(('voluntary_ctxt_switches', 'nonvoluntary_ctxt_switches')):
+                            totals['ctx_switches'] += int(line.split()[1])
+
+                try:
+                    with open(proc_dir + '/io', 'r') as stream:
+                        for line in stream:
+                            key, value = line.split(':')
+                            if key in ('read_bytes', 'write_bytes'):
+                                totals[key] += int(value)
+                except (IOError, OSError):
+                    pass
+
+                pending.extend(self._proc_children_(current))
+            except (IOError, OSError):
+                continue
+
+            found = True
+
+        return totals if found else None
+
+    def sample_once(self):
+        """
+        Method Name:    sample_once
+
+        Parameters:     None
+
+        Description:    Take one sample of every node
+
+        Returns:        int
+                          - Number of nodes whose VM is still running
+        """
+        if not self._load_pids_():
+            return 0
+
+        now = time.time()
+        records = []
+        for name, pid in sorted(self.node_pids.items()):
+            if not pid:
+                continue
+
+            totals = self._sample_tree_(pid)
+            if totals is None:
+                continue
+
+            cpu_percent = 0.0
+            prev = self.prev_cpu.get(name)
+            if prev and now > prev[0]:
+                cpu_percent = max(0.0, (totals['cpu'] - prev[1]) / (now - prev[0]) * 100)
+            self.prev_cpu[name] = (now, totals['cpu'])
+
+            records.append((now, self.node_index[name], pid, cpu_percent, totals['rss'],
+                            totals['read_bytes'], totals['write_bytes'], totals['ctx_switches']))
+
+        if records:
+            self.ring.append(records)
+
+        return len(records)
+
+    def run(self):
+        """
+        Method Name:    run
+
+        Parameters:     None
+
+        Description:    Sample until 'stop' is called or none of the VMs
+                        are running anymore
+        """
+        self.running = True
+        idle = 0
+
+        while self.running:
+            start = time.time()
+            if self.sample_once():
+                idle = 0
+            else:
+                idle += 1
+                if idle > 2:
+                    log.debug('No VMs are running in {0}, stopping the sampler'.format(self.sim_dir))
+                    break
+
+            time.sleep(max(0, self.interval - (time.time() - start)))
+
+        self.running = False
+        self.ring.close()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='ResourceSampler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+
+
+def prometheus_text(sim_dir):
+    """
+    Function Name:      prometheus_text
+
+    Parameters:         sim_dir
+                         - Simulation directory
+
+    Description:        Format the latest sample of every node in the
+                        Prometheus text exposition format
+
+    Returns:            str
+    """
+    metrics = [('cpu_percent', 'gauge', 'CPU usage of the VM process tree in percent'),
+               ('rss', 'gauge', 'Resident memory of the VM process tree in bytes'),
+               ('read_bytes', 'counter', 'Bytes read by the VM process tree'),
+               ('write_bytes', 'counter', 'Bytes written by the VM process tree'),
+               ('ctx_switches', 'counter', 'Context switches of the VM process tree')]
+
+    stats = latest_stats(sim_dir)
+    lines = []
+    for field, metric_type, description in metrics:
+        name = 'pydotsim_vm_{0}'.format(field)
+        lines.append('# HELP {0} {1}'.format(name, description))
+        lines.append('# TYPE {0} {1}'.format(name, metric_type))
+
+        for node in sorted(stats):
+            lines.append('{0}{{node="{1}",sim_dir="{2}"}} {3}'.format(name, node, sim_dir,
+                                                                        stats[node][field]))
+
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer(object):
+    """
+    Class Name:         MetricsServer
+    Description:        HTTP server on a local port that serves the latest
+                        samples of a simulation in the Prometheus text
+                        format on '/metrics'
+    """
+    def __init__(self, sim_dir, port, address='127.0.0.1'):
+        sim = sim_dir
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = prometheus_text(sim).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                log.debug(fmt % args)
+
+        self.server = HTTPServer((address, port), Handler)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='MetricsServer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_sampler_process(sim_dir, interval=1.0, port=None, capacity=8192):
+    """
+    Function Name:      start_sampler_process
+
+    Parameters:         sim_dir
+                         - Simulation directory
+                        interval
+                         - Seconds between samples
+                        port
+                         - Local port for the Prometheus endpoint, if any
+                        capacity
+                         - Number of samples kept in the ring buffer
+
+    Description:        Start the sampler as a background process that keeps
+                        running after the process that started the
+                        simulation exits.  It stops by itself once none of
+                        the VMs are running.
+    """
+    import subprocess
+
+    pkg_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([p for p in [pkg_root, env.get('PYTHONPATH')] if p])
+
+    cmd = [sys.executable, '-m', 'simulator.utilities.ResourceSampler', '--sim-dir', sim_dir,
+           '--interval', str(interval), '--capacity', str(capacity), '--daemon']
+    if port:
+        cmd += ['--port', str(port)]
+
+    log.debug('Starting the resource sampler: {0}'.format(" ".join(cmd)))
+    subprocess.call(cmd, env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sample the resources used by the VMs of a simulation')
+    parser.add_argument('--sim-dir', help='Simulation directory', required=True)
+    parser.add_argument('--interval', help='Seconds between samples', type=float, default=1.0)
+    parser.add_argument('--capacity', help='Number of samples kept', type=int, default=8192)
+    parser.add_argument('--port', help='Serve Prometheus metrics on this local port', type=int, default=None)
+    parser.add_argument('--daemon', action='store_true', help='Run in the background', default=False)
+
+    args = parser.parse_args()
+
+    if args.daemon:
+        from simulator.utilities.PrivHelper import daemonize
+        daemonize(os.path.join(args.sim_dir, 'sampler.log'))
+
+    if args.port:
+        MetricsServer(args.sim_dir, args.port).start()
+
+    ResourceSampler(args.sim_dir, args.interval, args.capacity).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+import re
+import time
+import asyncio
+import logging
+from collections import namedtuple
+from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.GoldenImage import telnet_commands
+
+log = getLogger(__name__)
+
+# The serial console is the first port of every node
+serial_port_index = 0
+
+# How to log in to the serial console of a VM type and the prompt it shows.
+# 'setup' runs once after logging in, so the output of the commands isn't
+# paged or wrapped.
+ConsoleProfile = namedtuple('ConsoleProfile', ['prompt', 'username', 'password', 'setup'])
+
+console_profiles = {'cumulus': ConsoleProfile(prompt=br'[\w.@:~/-]+[$#] ?$',
+                                              username='cumulus',
+                                              password='CumulusLinux!',
+                                              setup=['stty -echo cols 1000', 'export PAGER=cat']),
+                    'cisco':   ConsoleProfile(prompt=br'[\w.-]+(\([\w-]+\))?# ?$',
+                                              username='admin',
+                                              password='admin',
+                                              setup=['terminal length 0', 'terminal width 511']),
+                    'arista':  ConsoleProfile(prompt=br'[\w.-]+(\([\w-]+\))?[>#] ?$',
+                                              username='admin',
+                                              password='',
+                                              setup=['enable', 'terminal length 0', 'terminal width 32767'])}
+console_profiles['default'] = console_profiles['cumulus']
+
+# Seconds to wait for a prompt before pressing enter.  A console only shows
+# its prompt once, so a node that booted before it was connected to shows
+# nothing until it gets a line.
+wake_timeout = 2.0
+
+login_prompt = re.compile(br'login: ?$')
+password_prompt = re.compile(br'[Pp]assword: ?$')
+escape_sequences = re.compile(br'\x1b\[[0-9;?]*[A-Za-z]')
+
+# Result of a command on the console of a node.  'error' is set instead of
+# 'output' if the node couldn't be reached or the command didn't finish.
+ConsoleResult = namedtuple('ConsoleResult', ['node', 'command', 'output', 'error', 'seconds'])
+
+
+class ConsoleError(Exception):
+    pass
+
+
+class ConsoleTimeout(ConsoleError):
+    pass
+
+
+class ConsoleSession(object):
+    """
+    Class Name:         ConsoleSession
+    Description:        asyncio client for the telnet serial console of a
+                        VM ('-serial telnet::<port>,server,nowait').  QEMU
+                        only lets one client connect to a console at a time,
+                        so a node whose console is logged ('log_serial')
+                        can't be used.
+    """
+    def __init__(self, name, port, profile, timeout=60.0, host='127.0.0.1'):
+        self.name = name
+        self.port = port
+        self.profile = profile
+        self.prompt = re.compile(profile.prompt)
+        self.timeout = timeout
+        self.host = host
+        self.reader = None
+        self.writer = None
+        self.buffer = b''
+
+    async def _read_until_(self, patterns, timeout):
+        # Read until the last line matches one of the patterns and return
+        # the pattern and everything that was read before it
+        deadline = time.time() + timeout
+
+        while True:
+            last_line = self.buffer.rsplit(b'\n', 1)[-1]
+            for pattern in patterns:
+                if pattern.search(last_line):
+                    data, self.buffer = self.buffer, b''
+                    return pattern, data[:len(data) - len(last_line)]
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise ConsoleTimeout('{0} didn\'t show a prompt within {1} seconds'.format(self.name, timeout))
+
+            try:
+                chunk = await asyncio.wait_for(self.reader.read(4096), remaining)
+            except asyncio.TimeoutError:
+                continue
+
+            if not chunk:
+                raise ConsoleError('The console of {0} was closed'.format(self.name))
+
+            chunk = escape_sequences.sub(b'', telnet_commands.sub(b'', self.buffer + chunk))
+            self.buffer = chunk.replace(b'\r', b'')
+
+    def _send_(self, line):
+        self.writer.write(line.encode('utf-8') + b'\r')
+
+    async def open(self):
+        """
+        Method Name:    open
+
+        Parameters:     None
+
+        Description:    Connect to the console, log in if the node asks for
+                        it and run the setup commands of the VM type
+        """
+        try:
+            self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                              self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ConsoleError('Couldn\'t connect to the console of {0} on port {1}: {2}'.format(
+                               self.name, self.port, e))
+
+        patterns = [self.prompt, login_prompt, password_prompt]
+        try:
+            pattern, _ = await self._read_until_(patterns, wake_timeout)
+        except ConsoleTimeout:
+            # An empty line makes the node show its login or shell prompt
+            self._send_('')
+            pattern, _ = await self._read_until_(patterns, self.timeout)
+
+        attempts = 0
+        while pattern is not self.prompt:
+            attempts += 1
+            if attempts > 3:
+                raise ConsoleError('Logging in to {0} as {1} failed'.format(self.name, self.profile.username))
+
+            if pattern is login_prompt:
+                self._send_(self.profile.username)
+            else:
+                self._send_(self.profile.password)
+
+            pattern, _ = await self._read_until_(patterns, self.timeout)
+
+        for command in self.profile.setup:
+            await self.command(command)
+
+    async def command(self, line, timeout=None):
+        """
+        Method Name:    command
+
+        Parameters:     line
+                          - Command to run
+                        timeout
+                          - Seconds to wait for the prompt, the timeout of
+                            the session by default
+
+        Description:    Run a command and wait for the next prompt
+
+        Returns:        str
+                          - Output of the command, without the echoed command
+        """
+        self._send_(line)
+        _, data = await self._read_until_([self.prompt], timeout or self.timeout)
+        output = data.decode('utf-8', 'replace')
+
+        first, _, rest = output.partition('\n')
+        if first.strip() == line.strip():
+            output = rest
+
+        return output
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+
+async def _run_node_(name, port, profile, commands, timeout, limit, results):
+    async with limit:
+        start = time.time()
+        session = ConsoleSession(name, port, profile, timeout)
+        command = None
+
+        try:
+            await session.open()
+            for command in commands:
+                start = time.time()
+                output = await session.command(command)
+                await results.put(ConsoleResult(name, command, output, None, time.time() - start))
+        except (ConsoleError, OSError) as e:
+            await results.put(ConsoleResult(name, command, None, str(e), time.time() - start))
+        finally:
+            session.close()
+
+
+async def iter_console_results(targets, commands, limit=32, timeout=60.0):
+    """
+    Function Name:      iter_console_results
+
+    Parameters:         targets
+                         - List of (node name, serial console port, vm_type)
+                        commands
+                         - Commands to run one after the other on every node
+                        limit
+                         - Most consoles that are open at the same time
+                        timeout
+                         - Seconds to wait for a login or command prompt
+
+    Description:        Run commands on the serial consoles of many nodes at
+                        once.  The commands of a node run in order, every
+                        node is handled on its own and the results are
+                        yielded as soon as they arrive.  A node that can't be
+                        reached yields one result with its error and no
+                        more.
+
+    Returns:            async generator
+                         - ConsoleResult of every command
+    """
+    limit = asyncio.Semaphore(limit)
+    results = asyncio.Queue()
+
+    tasks = [asyncio.ensure_future(_run_node_(name, port, console_profiles.get(vm_type) or console_profiles['default'],
+                                              commands, timeout, limit, results))
+             for name, port, vm_type in targets]
+    done = asyncio.ensure_future(asyncio.gather(*tasks))
+
+    try:
+        while not (done.done() and results.empty()):
+            getter = asyncio.ensure_future(results.get())
+            await asyncio.wait([getter, done], return_when=asyncio.FIRST_COMPLETED)
+
+            if getter.done():
+                yield getter.result()
+            else:
+                getter.cancel()
+
+        # Errors that aren't a node's console failing are raised here
+        done.result()
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import os
+import json
+import fcntl
+import tempfile
+import logging
+from contextlib import contextmanager
+from simulator.utilities.LogWrapper import getLogger
+
+log = getLogger(__name__)
+
+state_file_name = 'state.json'
+lock_file_name = 'state.json.lock'
+
+
+def get_state_path(sim_dir):
+    return os.path.join(sim_dir, state_file_name)
+
+
+def read_state(sim_dir):
+    """
+    Function Name:      read_state
+
+    Parameters:         sim_dir
+                         - Simulation directory
+
+    Description:        Read the state file that a builder writes when a
+                        simulation is started.  The state file only has
+                        plain data (builder name, PIDs and UDP ports of
+                        every node), so a simulation can be stopped without
+                        loading the topology.
+
+    Returns:            dict
+                         - The state, or None if there is no state file
+    """
+    path = get_state_path(sim_dir)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as stream:
+        return json.load(stream)
+
+
+def write_state(sim_dir, state):
+    """
+    Function Name:      write_state
+
+    Parameters:         sim_dir
+                         - Simulation directory
+                        state
+                         - JSON serializable dictionary
+
+    Description:        Atomically replace the state file of a simulation.
+                        Every writer has its own temporary file, so writers
+                        in other processes don't rename each other's files.
+                        Changes to a state that was read must be made with
+                        'update_state' instead.
+    """
+    path = get_state_path(sim_dir)
+    fd, tmp_path = tempfile.mkstemp(prefix='{0}.'.format(state_file_name), suffix='.tmp', dir=sim_dir)
+
+    try:
+        with os.fdopen(fd, 'w') as stream:
+            json.dump(state, stream, indent=2, sort_keys=True)
+
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+    log.debug('Wrote the simulation state to {0}'.format(path))
+
+
+@contextmanager
+def lock_state(sim_dir):
+    """
+    Function Name:      lock_state
+
+    Parameters:         sim_dir
+                         - Simulation directory
+
+    Description:        Context manager that holds the lock of the state
+                        file.  The builder, the supervisor of the PrivHelper
+                        and the host daemon change the state from different
+                        processes.  The lock file may have been created by
+                        root, so it is only opened for reading, which is
+                        enough for flock.
+    """
+    fd = os.open(os.path.join(sim_dir, lock_file_name),
+                 os.O_RDONLY | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def update_state(sim_dir, update):
+    """
+    Function Name:      update_state
+
+    Parameters:         sim_dir
+                         - Simulation directory
+                        update
+                         - Function that is called with the current state
+                           (None if there is no state file) and returns the
+                           state to write, or None to leave the file alone
+
+    Description:        Read, change and write the state file while holding
+                        its lock, so changes that other processes make at
+                        the same time aren't lost
+
+    Returns:            dict
+                         - The state that was written, or None if nothing was
+    """
+    with lock_state(sim_dir):
+        state = update(read_state(sim_dir))
+        if state is not None:
+            write_state(sim_dir, state)
+
+    return state
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+import os
+import time
+import select
+import logging
+import tenacity
+from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.SimState import update_state, get_state_path
+
+log = getLogger(__name__)
+
+# Backoff between the restarts of a node that keeps crashing.  A node that
+# ran for 'stable_seconds' before it crashed starts over from the first
+# attempt.
+restart_wait = tenacity.wait_exponential(multiplier=1, min=1, max=60)
+restart_stop = tenacity.stop_after_attempt(6)
+stable_seconds = 300
+
+# Exits that are kept in the state of every node
+exit_history = 10
+
+
+def open_pidfd(pid):
+    """
+    Function Name:      open_pidfd
+
+    Parameters:         pid
+                         - Process ID of a child
+
+    Description:        File descriptor that becomes readable when the
+                        process exits (Linux 5.3 and Python 3.9 or newer)
+
+    Returns:            int
+                         - None if pidfds aren't supported
+    """
+    pidfd_open = getattr(os, 'pidfd_open', None)
+    if pidfd_open is None:
+        return None
+
+    try:
+        return pidfd_open(pid)
+    except OSError as e:
+        log.debug('No pidfd for PID {0}: {1}'.format(pid, e))
+        return None
+
+
+class Supervisor(object):
+    """
+    Class Name:         Supervisor
+    Description:        Watches the VMs that the PrivHelper (or host daemon)
+                        spawned.  It hooks into the helper's loop like the
+                        LogPump: every VM has a pidfd in the loop, so an exit
+                        is seen as soon as it happens, and 'tick' runs the
+                        restarts that are due.  Without pidfds the exits are
+                        found by the helper's periodic 'reap'.
+
+                        Every exit is written to the node in the state of
+                        the simulation ('exits', the latest last).  A node
+                        that exits with an error and has 'restart' set is
+                        started again with the same command line, so it
+                        keeps its overlay, ports and links, after a backoff
+                        that grows with every crash.  The nodes that are
+                        killed through the helper are never restarted.
+    """
+    def __init__(self, helper, uid=None, gid=None):
+        self.helper = helper
+        self.uid = uid
+        self.gid = gid
+        self.watched = {}
+        self.pending = {}
+        self.stopping = set()
+
+    def watch(self, pid, argv, logs, supervise):
+        """
+        Method Name:    watch
+
+        Parameters:     pid
+                          - PID of a VM that the helper spawned
+                        argv
+                          - Command line of the VM
+                        logs
+                          - Log settings of the VM
+                        supervise
+                          - 'node', 'sim_dir', 'restart' and the
+                            'restart_argv' (the command line of a restart,
+                            'argv' if it isn't given)
+
+        Description:    Start watching a VM
+        """
+        entry = {'pid': pid,
+                 'argv': supervise.get('restart_argv') or argv,
+                 'logs': logs,
+                 'supervise': supervise,
+                 'started': time.time(),
+                 'retry': supervise.get('retry') or tenacity.RetryCallState(None, None, (), {}),
+                 'pidfd': open_pidfd(pid)}
+
+        if entry['pidfd'] is not None:
+            self.helper.register(entry['pidfd'], self._exit_event_, select.POLLIN)
+
+        self.watched[pid] = entry
+
+    def _exit_event_(self, fd, event):
+        # The helper collects the exit code and passes it on to 'exited'
+        self.helper.reap()
+
+    def stop_watching(self, pids):
+        """
+        Method Name:    stop_watching
+
+        Parameters:     pids
+                          - PIDs that are about to be killed
+
+        Description:    The VMs are being stopped, so they aren't restarted
+                        when they exit and the restarts that were waiting
+                        for them are dropped
+        """
+        for pid in pids:
+            if pid in self.watched:
+                self.stopping.add(pid)
+
+            entry = self.pending.pop(pid, None)
+            if entry:
+                log.info('Not restarting {0}, it is being stopped'.format(entry['supervise']['node']))
+
+    def exited(self, pid, returncode):
+        """
+        Method Name:    exited
+
+        Parameters:     pid
+                          - PID of a child that exited
+                        returncode
+                          - Its exit code (minus the signal if it was killed)
+
+        Description:    Record the exit of a VM and schedule its restart if
+                        it crashed
+        """
+        entry = self.watched.pop(pid, None)
+        if entry is None:
+            return
+
+        if entry['pidfd'] is not None:
+            self.helper.unregister(entry['pidfd'])
+            os.close(entry['pidfd'])
+
+        stopped = pid in self.stopping
+        self.stopping.discard(pid)
+
+        supervise = entry['supervise']
+        now = time.time()
+        self._record_exit_(supervise, {'pid': pid, 'code': returncode, 'time': now, 'stopped': stopped})
+
+        if stopped or not supervise.get('restart') or returncode == 0:
+            log.info('{0} (PID {1}) exited with {2}'.format(supervise['node'], pid, returncode))
+            return
+
+        retry = entry['retry']
+        if now - entry['started'] >= stable_seconds:
+            retry = tenacity.RetryCallState(None, None, (), {})
+
+        if restart_stop(retry):
+            log.error('{0} (PID {1}) crashed with {2} after {3} restarts, giving up'.format(
+                      supervise['node'], pid, returncode, retry.attempt_number - 1))
+            return
+
+        delay = restart_wait(retry)
+        retry.attempt_number += 1
+        entry['retry'] = retry
+        entry['restart_at'] = now + delay
+        self.pending[pid] = entry
+
+        log.warn('{0} (PID {1}) crashed with {2}, restarting it in {3:.0f} seconds'.format(
+                 supervise['node'], pid, returncode, delay))
+
+    def tick(self):
+        """
+        Method Name:    tick
+
+        Parameters:     None
+
+        Description:    Restart the crashed VMs whose backoff is over
+        """
+        now = time.time()
+        for old_pid, entry in list(self.pending.items()):
+            if entry['restart_at'] > now:
+                continue
+
+            del self.pending[old_pid]
+            supervise = dict(entry['supervise'], retry=entry['retry'])
+
+            try:
+                pid = self.helper.spawn(entry['argv'], logs=entry['logs'], supervise=supervise)['pid']
+            except (OSError, IOError) as e:
+                log.error('Restarting {0} failed: {1}'.format(supervise['node'], e))
+                continue
+
+            log.info('Restarted {0} with PID {1}'.format(supervise['node'], pid))
+            self._update_node_(supervise['sim_dir'], supervise['node'], old_pid,
+                               lambda node: node.update(pid=pid, restarts=node.get('restarts', 0) + 1))
+
+    def _record_exit_(self, supervise, record):
+        def add_exit(node):
+            node['exits'] = (node.get('exits') or [])[-(exit_history - 1):] + [record]
+
+        self._update_node_(supervise['sim_dir'], supervise['node'], record['pid'], add_exit)
+
+    def _update_node_(self, sim_dir, name, pid, update):
+        # Only the node that still has the PID is changed, so the state of
+        # a simulation that was started again in the same directory isn't
+        # touched
+        def update_node(state):
+            node = (state or {}).get('nodes', {}).get(name)
+            if node is None or node.get('pid') != pid:
+                return None
+
+            update(node)
+            return state
+
+        try:
+            state = update_state(sim_dir, update_node)
+        except (IOError, OSError, ValueError) as e:
+            log.warn('Couldn\'t update the state of {0}: {1}'.format(sim_dir, e))
+            return
+
+        # The helper may run as root, the state belongs to the user
+        if state is not None and self.uid is not None:
+            os.chown(get_state_path(sim_dir), self.uid, self.gid if self.gid is not None else -1)
+
+    def close(self):
+        for entry in self.watched.values():
+            if entry['pidfd'] is not None:
+                self.helper.unregister(entry['pidfd'])
+                os.close(entry['pidfd'])
+
+        self.watched = {}
+        self.pending = {}
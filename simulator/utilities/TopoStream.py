@@ -0,0 +1,764 @@
+#!/usr/bin/env python
+
+import io
+import re
+import gzip
+import json
+import struct
+import pydot
+import logging
+from simulator.utilities.LogWrapper import getLogger
+
+log = getLogger(__name__)
+
+# Older versions of pydot store the names of nodes and the ends of edges
+# quoted, newer ones store them as they are given
+quote_name = getattr(pydot, 'quote_if_necessary', lambda name: name)
+
+formats = ['dot', 'jsonl', 'bin']
+format_extensions = {'.dot': 'dot', '.gv': 'dot', '.jsonl': 'jsonl', '.bin': 'bin'}
+
+# Statements with the default attributes are stored as nodes by pydot
+default_statements = set(['node', 'edge', 'graph'])
+
+jsonl_format = 'pydotsim-topology'
+binary_magic = b'PDT\x01'
+
+# Attribute names and short values repeat on every node, so the binary
+# format writes them once and refers to them by index afterwards.  The
+# table is bounded so memory stays flat, later strings are written inline.
+max_string_table = 65536
+max_interned_length = 64
+
+_double_ = struct.Struct('<d')
+_dot_id_ = re.compile(r'^(?:[A-Za-z_\x80-\xff][A-Za-z0-9_\x80-\xff]*|-?(?:\.[0-9]+|[0-9]+(?:\.[0-9]*)?))$')
+_dot_end_ = re.compile(r'^("(?:[^"\\]|\\.)*"|[^:"]*)(?::(.*))?$')
+_dot_token_ = re.compile(r'\s*(?:("(?:[^"\\]|\\.)*")|(--|->)|([\[\]{};,=:])|([^\s\[\]{};,=:"]+))')
+
+
+class TopoStreamError(Exception):
+    pass
+
+
+def _text_(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+
+    return value
+
+
+def _unquote_(value):
+    if len(value) > 1 and value.startswith('"') and value.endswith('"'):
+        return value[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+
+    return value
+
+
+def unquote_name(name):
+    """
+    Function Name:      unquote_name
+
+    Parameters:         name
+                         - Name of a node the way pydot keeps it, e.g. 'a' or
+                           '"leaf-1"'
+
+    Description:        The name of a node without its quotes, the way
+                        'iter_nodes' and 'split_end' return it
+
+    Returns:            str
+    """
+    return _unquote_(name)
+
+
+def attribute_is_set(value):
+    """
+    Function Name:      attribute_is_set
+
+    Parameters:         value
+                         - Value of a boolean node attribute, e.g. 'true',
+                           '"yes"' or 1
+
+    Description:        Read a boolean attribute, pydot keeps the quotes of
+                        the value if it had them
+
+    Returns:            bool
+    """
+    return str(value).strip('"').lower() in ['true', 'yes', '1']
+
+
+def split_end(end):
+    """
+    Function Name:      split_end
+
+    Parameters:         end
+                         - One end of an edge the way pydot keeps it, e.g.
+                           'a:swp1', '"leaf-1":swp1' or '"leaf-1:swp1"'
+
+    Description:        Split the end of an edge into its node and its port.
+                        The node and the port may be quoted on their own, or
+                        the whole end may be quoted, which is then split on
+                        its last ':'.
+
+    Returns:            tuple
+                         - (node, port), the port is None if there isn't one
+    """
+    match = _dot_end_.match(end)
+    if not match:
+        return _unquote_(end), None
+
+    node, port = match.groups()
+    if port is not None:
+        return _unquote_(node), _unquote_(port)
+
+    node = _unquote_(node)
+    if node != match.group(1) and ':' in node:
+        node, port = node.rsplit(':', 1)
+
+    return node, port
+
+
+def unquote_end(end):
+    """
+    Function Name:      unquote_end
+
+    Parameters:         end
+                         - One end of an edge the way pydot keeps it
+
+    Description:        The end of an edge as 'node:port' without any quotes
+
+    Returns:            str
+    """
+    node, port = split_end(end)
+    return node if port is None else '{0}:{1}'.format(node, port)
+
+
+def iter_nodes(graph):
+    """
+    Function Name:      iter_nodes
+
+    Parameters:         graph
+                         - pydot.Dot
+
+    Description:        Walk the nodes of a graph without creating a pydot
+                        Node for every one of them
+
+    Returns:            generator
+                         - (name, attributes) of every node
+    """
+    for obj_dicts in graph.obj_dict['nodes'].values():
+        for obj_dict in obj_dicts:
+            yield _unquote_(obj_dict['name']), obj_dict['attributes']
+
+
+def iter_edges(graph):
+    """
+    Function Name:      iter_edges
+
+    Parameters:         graph
+                         - pydot.Dot
+
+    Description:        Walk the edges of a graph without creating a pydot
+                        Edge for every one of them
+
+    Returns:            generator
+                         - (source, destination, attributes) of every edge,
+                           the ends are 'node:port' without quotes (see
+                           'unquote_end')
+    """
+    for obj_dicts in graph.obj_dict['edges'].values():
+        for obj_dict in obj_dicts:
+            source, destination = obj_dict['points']
+            yield unquote_end(source), unquote_end(destination), obj_dict['attributes']
+
+
+def get_format(path, fmt=None):
+    """
+    Function Name:      get_format
+
+    Parameters:         path
+                         - File name
+                        fmt
+                         - Format to use instead of the one of the file name
+
+    Description:        Work out the format of a file and if it is gzipped
+                        from its name, e.g. 'fabric.jsonl.gz'
+
+    Returns:            tuple
+                         - (format, compressed)
+    """
+    compressed = path.endswith('.gz')
+    if compressed:
+        path = path[:-3]
+
+    if fmt is None:
+        for extension, name in format_extensions.items():
+            if path.endswith(extension):
+                fmt = name
+                break
+        else:
+            fmt = 'dot'
+
+    if fmt not in formats:
+        raise TopoStreamError('{0} isn\'t one of {1}'.format(fmt, formats))
+
+    return fmt, compressed
+
+
+class DotWriter(object):
+    """
+    Class Name:         DotWriter
+    Description:        Writes a topology in the DOT language one statement
+                        per line.  Unlike 'to_string', the list attributes
+                        (e.g. 'bridge') are written as JSON strings, so the
+                        output can be read back.  DOT only has text, so the
+                        values are read back as strings (the lists and
+                        dicts excepted) without the quotes that pydot keeps.
+                        The 'jsonl' and 'bin' formats give back exactly what
+                        was written.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    @staticmethod
+    def quote(value):
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        elif isinstance(value, (list, dict, tuple)):
+            value = json.dumps(value)
+        elif not isinstance(value, str):
+            value = _text_(value) if isinstance(value, bytes) else '{0}'.format(value)
+
+        if len(value) > 1 and value.startswith('"') and value.endswith('"'):
+            # pydot keeps the quotes of the values that it parses
+            return value
+
+        if _dot_id_.match(value) and value.lower() not in ['graph', 'digraph', 'subgraph', 'node', 'edge', 'strict']:
+            return value
+
+        return '"{0}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+
+    def _attributes_(self, attributes):
+        items = ['{0}={1}'.format(self.quote(key), self.quote(value))
+                 for key, value in attributes.items() if value is not None]
+
+        return ' [{0}]'.format(', '.join(items)) if items else ''
+
+    def _end_(self, end):
+        if ':' in end:
+            name, port = end.rsplit(':', 1)
+            return '{0}:{1}'.format(self.quote(name), self.quote(port))
+
+        return self.quote(end)
+
+    def _write_(self, line):
+        self.stream.write(line.encode('utf-8') + b'\n')
+
+    def write(self, graph):
+        graph_type = graph.obj_dict.get('type', 'graph')
+        self.connector = '->' if graph_type == 'digraph' else '--'
+
+        self._write_('{0} {1} {{'.format(graph_type, self.quote(graph.get_name().strip('"') or 'G')))
+
+        attributes = graph.obj_dict.get('attributes', {})
+        if attributes:
+            self._write_('graph{0};'.format(self._attributes_(attributes)))
+
+        for name, attributes in iter_nodes(graph):
+            if name in ['node', 'edge', 'graph']:
+                self._write_('{0}{1};'.format(name, self._attributes_(attributes)))
+            else:
+                self._write_('{0}{1};'.format(self.quote(name), self._attributes_(attributes)))
+
+        for source, destination, attributes in iter_edges(graph):
+            self._write_('{0} {1} {2}{3};'.format(self._end_(source), self.connector,
+                                                  self._end_(destination), self._attributes_(attributes)))
+
+        self._write_('}')
+
+
+class JsonLinesWriter(object):
+    """
+    Class Name:         JsonLinesWriter
+    Description:        Writes a topology as JSON lines.  The first line has
+                        the graph, and every node and edge is on a line of
+                        its own:
+
+                            {"format": "pydotsim-topology", "version": 1, "graph": {...}}
+                            {"node": "n1", "attributes": {...}}
+                            {"edge": ["n1:swp1", "n2:swp1"], "attributes": {...}}
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def _write_(self, data):
+        self.stream.write(json.dumps(data, sort_keys=True, default=str).encode('utf-8') + b'\n')
+
+    def write(self, graph):
+        self._write_({'format': jsonl_format, 'version': 1,
+                      'graph': {'name': graph.get_name().strip('"'), 'type': graph.obj_dict.get('type', 'graph'),
+                                'attributes': dict(graph.obj_dict.get('attributes', {}))}})
+
+        for name, attributes in iter_nodes(graph):
+            self._write_({'node': name, 'attributes': dict(attributes)})
+
+        for source, destination, attributes in iter_edges(graph):
+            self._write_({'edge': [source, destination], 'attributes': dict(attributes)})
+
+
+def _write_varint_(stream, value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            break
+    stream.write(bytes(out))
+
+
+def _read_varint_(stream):
+    value = 0
+    shift = 0
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            raise TopoStreamError('The binary topology ends in the middle of a record')
+
+        byte = ord(byte)
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value
+        shift += 7
+
+
+class BinaryWriter(object):
+    """
+    Class Name:         BinaryWriter
+    Description:        Writes a topology in a compact binary format.  After
+                        the magic bytes, every record is a type byte and its
+                        fields:
+
+                            S   - string for the string table
+                            G   - graph name, type and attributes
+                            N   - node name and attributes
+                            E   - edge source, destination and attributes
+                            Z   - end of the topology
+
+                        Numbers are varints and strings a varint length and
+                        UTF-8 bytes.  Attribute names and short values are
+                        written once to the string table and then referred
+                        to by their index.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.strings = {}
+
+    def _string_(self, value):
+        data = value.encode('utf-8')
+        _write_varint_(self.stream, len(data))
+        self.stream.write(data)
+
+    def _interned_(self, value):
+        # Returns the index of a string in the table, adding it first if
+        # there is room.  None means it has to be written inline.
+        index = self.strings.get(value)
+        if index is None and len(self.strings) < max_string_table and len(value) <= max_interned_length:
+            index = self.strings[value] = len(self.strings)
+            self.stream.write(b'S')
+            self._string_(value)
+
+        return index
+
+    @staticmethod
+    def _normalize_(value):
+        # Everything that isn't one of the value types is written as text
+        if value is None or isinstance(value, (bool, int, float, list, dict, tuple)):
+            return value
+
+        return _text_(value) if isinstance(value, bytes) else '{0}'.format(value)
+
+    def _value_(self, value):
+        if value is None:
+            self.stream.write(b'n')
+        elif isinstance(value, bool):
+            self.stream.write(b'T' if value else b'F')
+        elif isinstance(value, int):
+            self.stream.write(b'i')
+            _write_varint_(self.stream, (value << 1) if value >= 0 else ((-value << 1) - 1))
+        elif isinstance(value, float):
+            self.stream.write(b'f' + _double_.pack(value))
+        elif isinstance(value, (list, dict, tuple)):
+            self.stream.write(b'j')
+            self._string_(json.dumps(value, default=str))
+        else:
+            index = self.strings.get(value)
+            if index is None:
+                self.stream.write(b't')
+                self._string_(value)
+            else:
+                self.stream.write(b's')
+                _write_varint_(self.stream, index)
+
+    def _record_(self, kind, names, attributes):
+        # The string table records have to come before the record that uses
+        # them, so the keys and values are interned first
+        items = [(self._normalize_(key), self._normalize_(value)) for key, value in attributes.items()]
+        for key, value in items:
+            self._interned_(key)
+            if value is not None and not isinstance(value, (bool, int, float, list, dict, tuple)):
+                self._interned_(value)
+
+        self.stream.write(kind)
+        for name in names:
+            self._string_(name)
+
+        _write_varint_(self.stream, len(items))
+        for key, value in items:
+            self._value_(key)
+            self._value_(value)
+
+    def write(self, graph):
+        self.stream.write(binary_magic)
+        self._record_(b'G', [graph.get_name().strip('"'), graph.obj_dict.get('type', 'graph')],
+                      graph.obj_dict.get('attributes', {}))
+
+        for name, attributes in iter_nodes(graph):
+            self._record_(b'N', [name], attributes)
+
+        for source, destination, attributes in iter_edges(graph):
+            self._record_(b'E', [source, destination], attributes)
+
+        self.stream.write(b'Z')
+
+
+writers = {'dot': DotWriter, 'jsonl': JsonLinesWriter, 'bin': BinaryWriter}
+
+
+def _dot_value_(token):
+    if token.startswith('"'):
+        value = token[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+
+        # The lists and dicts that DotWriter writes as JSON
+        if value[:1] in ['[', '{']:
+            try:
+                return json.loads(value)
+            except ValueError:
+                pass
+
+        return value
+
+    return token
+
+
+def iter_dot(stream):
+    """
+    Function Name:      iter_dot
+
+    Parameters:         stream
+                         - Binary file object with DOT text from DotWriter
+
+    Description:        Read the records of a DOT topology a line at a time.
+                        Only the subset of DOT that DotWriter writes (one
+                        statement per line) is understood, use DotTopo for
+                        other DOT files.
+
+    Returns:            generator
+                         - ('graph', name, type, attributes),
+                           ('node', name, attributes) and
+                           ('edge', source, destination, attributes)
+    """
+    for number, line in enumerate(stream, 1):
+        line = _text_(line).strip()
+        if not line or line.startswith('//') or line.startswith('#') or line == '}':
+            continue
+
+        tokens = []
+        position = 0
+        while position < len(line):
+            match = _dot_token_.match(line, position)
+            if not match or match.end() == position:
+                raise TopoStreamError('Can\'t read line {0}: {1}'.format(number, line))
+            position = match.end()
+            tokens.append(match.group(match.lastindex))
+
+        if tokens[-1] == ';':
+            tokens.pop()
+
+        if tokens[-1] == '{':
+            graph_type = tokens[0]
+            if graph_type == 'strict':
+                graph_type = tokens[1]
+            yield ('graph', _dot_value_(tokens[-2]) if len(tokens) > 2 else 'G', graph_type, {})
+            continue
+
+        attributes = {}
+        if '[' in tokens:
+            start = tokens.index('[')
+            attr_tokens = [t for t in tokens[start + 1:-1] if t != ',']
+            for i in range(0, len(attr_tokens), 3):
+                if attr_tokens[i + 1] != '=':
+                    raise TopoStreamError('Can\'t read the attributes on line {0}: {1}'.format(number, line))
+                attributes[_dot_value_(attr_tokens[i])] = _dot_value_(attr_tokens[i + 2])
+            tokens = tokens[:start]
+
+        if '--' in tokens or '->' in tokens:
+            split = tokens.index('--') if '--' in tokens else tokens.index('->')
+            ends = [':'.join(_dot_value_(t) for t in part if t != ':') for part in (tokens[:split], tokens[split + 1:])]
+            yield ('edge', ends[0], ends[1], attributes)
+        elif tokens == ['graph']:
+            yield ('graph', None, None, attributes)
+        else:
+            yield ('node', _dot_value_(tokens[0]), attributes)
+
+
+def iter_jsonl(stream):
+    """
+    Function Name:      iter_jsonl
+
+    Parameters:         stream
+                         - Binary file object with JSON lines from
+                           JsonLinesWriter
+
+    Description:        Read the records of a JSON lines topology a line at
+                        a time
+
+    Returns:            generator
+                         - Same records as 'iter_dot'
+    """
+    for number, line in enumerate(stream, 1):
+        line = _text_(line).strip()
+        if not line:
+            continue
+
+        data = json.loads(line)
+        if 'node' in data:
+            yield ('node', data['node'], data.get('attributes', {}))
+        elif 'edge' in data:
+            yield ('edge', data['edge'][0], data['edge'][1], data.get('attributes', {}))
+        elif data.get('format') == jsonl_format:
+            graph = data.get('graph', {})
+            yield ('graph', graph.get('name', 'G'), graph.get('type', 'graph'), graph.get('attributes', {}))
+        else:
+            raise TopoStreamError('Line {0} isn\'t a node, edge or header'.format(number))
+
+
+def iter_binary(stream):
+    """
+    Function Name:      iter_binary
+
+    Parameters:         stream
+                         - Binary file object from BinaryWriter
+
+    Description:        Read the records of a binary topology one at a time
+
+    Returns:            generator
+                         - Same records as 'iter_dot'
+    """
+    if stream.read(len(binary_magic)) != binary_magic:
+        raise TopoStreamError('This isn\'t a binary topology')
+
+    strings = []
+
+    def read_string():
+        length = _read_varint_(stream)
+        return stream.read(length).decode('utf-8')
+
+    def read_value():
+        tag = stream.read(1)
+        if tag == b's':
+            return strings[_read_varint_(stream)]
+        elif tag == b't':
+            return read_string()
+        elif tag == b'i':
+            value = _read_varint_(stream)
+            return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+        elif tag == b'f':
+            return _double_.unpack(stream.read(_double_.size))[0]
+        elif tag == b'j':
+            return json.loads(read_string())
+        elif tag == b'n':
+            return None
+        elif tag in [b'T', b'F']:
+            return tag == b'T'
+
+        raise TopoStreamError('Unknown value type {0!r}'.format(tag))
+
+    def read_attributes():
+        return dict((read_value(), read_value()) for _ in range(_read_varint_(stream)))
+
+    while True:
+        kind = stream.read(1)
+        if kind == b'S':
+            strings.append(read_string())
+        elif kind == b'G':
+            name, graph_type = read_string(), read_string()
+            yield ('graph', name, graph_type, read_attributes())
+        elif kind == b'N':
+            name = read_string()
+            yield ('node', name, read_attributes())
+        elif kind == b'E':
+            source, destination = read_string(), read_string()
+            yield ('edge', source, destination, read_attributes())
+        elif kind in [b'Z', b'']:
+            return
+        else:
+            raise TopoStreamError('Unknown record type {0!r}'.format(kind))
+
+
+readers = {'dot': iter_dot, 'jsonl': iter_jsonl, 'bin': iter_binary}
+
+
+class _BufferedOutput_(object):
+    # The writers write a record at a time, which is slow on a GzipFile,
+    # so the records are collected into blocks of 'size' bytes
+    def __init__(self, stream, size=65536):
+        self.stream = stream
+        self.size = size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write(bytes(self.buffer))
+            self.buffer = bytearray()
+
+
+def _open_(path_or_stream, mode, compressed):
+    if hasattr(path_or_stream, 'read' if mode == 'rb' else 'write'):
+        stream = path_or_stream
+        if compressed:
+            stream = gzip.GzipFile(fileobj=stream, mode=mode)
+        return stream, stream is not path_or_stream
+
+    if compressed:
+        return gzip.open(path_or_stream, mode), True
+
+    return io.open(path_or_stream, mode), True
+
+
+def write_topology(topology, path_or_stream, fmt=None, compress=None):
+    """
+    Function Name:      write_topology
+
+    Parameters:         topology
+                         - DotTopo (or pydot.Dot) to write
+                        path_or_stream
+                         - File name or binary file object
+                        fmt
+                         - 'dot', 'jsonl' or 'bin'.  By default it is worked
+                           out from the file name, or 'dot'.
+                        compress
+                         - gzip the output.  By default only file names that
+                           end with '.gz' are.
+
+    Description:        Write a topology a node and an edge at a time, so
+                        the whole text is never in memory
+    """
+    graph = getattr(topology, 'graph', topology)
+    name = path_or_stream if isinstance(path_or_stream, str) else ''
+    fmt, compressed = get_format(name, fmt)
+    if compress is not None:
+        compressed = compress
+
+    stream, close = _open_(path_or_stream, 'wb', compressed)
+    try:
+        output = _BufferedOutput_(stream)
+        writers[fmt](output).write(graph)
+        output.flush()
+    finally:
+        if close:
+            stream.close()
+        else:
+            stream.flush()
+
+
+def iter_topology(path_or_stream, fmt=None, compress=None):
+    """
+    Function Name:      iter_topology
+
+    Parameters:         path_or_stream
+                         - File name or binary file object
+                        fmt
+                         - 'dot', 'jsonl' or 'bin', see 'write_topology'
+                        compress
+                         - The input is gzipped, see 'write_topology'
+
+    Description:        Read the records of a topology one at a time
+
+    Returns:            generator
+                         - Same records as 'iter_dot'
+    """
+    name = path_or_stream if isinstance(path_or_stream, str) else ''
+    fmt, compressed = get_format(name, fmt)
+    if compress is not None:
+        compressed = compress
+
+    stream, close = _open_(path_or_stream, 'rb', compressed)
+    try:
+        for record in readers[fmt](stream):
+            yield record
+    finally:
+        if close:
+            stream.close()
+
+
+def read_topology(path_or_stream, fmt=None, compress=None):
+    """
+    Function Name:      read_topology
+
+    Parameters:         path_or_stream
+                         - File name or binary file object
+                        fmt
+                         - 'dot', 'jsonl' or 'bin', see 'write_topology'
+                        compress
+                         - The input is gzipped, see 'write_topology'
+
+    Description:        Read a topology written by 'write_topology'.  The
+                        nodes and edges are put straight into the graph as
+                        they are read.
+
+    Returns:            DotTopo
+    """
+    from simulator.DotTopo import DotTopo
+
+    topology = DotTopo()
+    graph = topology.graph
+    parent = graph.get_parent_graph()
+
+    # Copy the pydot bookkeeping of a node and an edge instead of creating
+    # pydot objects, which is slow in older versions of pydot
+    node_proto = pydot.Node('proto').obj_dict
+    edge_proto = pydot.Edge('a:b', 'c:d').obj_dict
+
+    for record in iter_topology(path_or_stream, fmt, compress):
+        if record[0] == 'node':
+            obj_dict = dict(node_proto)
+            obj_dict.update({'name': quote_name(str(record[1])), 'attributes': _plain_(record[2]),
+                             'parent_graph': parent, 'sequence': graph.get_next_sequence_number()})
+            graph.obj_dict['nodes'].setdefault(obj_dict['name'], []).append(obj_dict)
+        elif record[0] == 'edge':
+            points = (quote_name(str(record[1])), quote_name(str(record[2])))
+            obj_dict = dict(edge_proto)
+            obj_dict.update({'points': points, 'attributes': _plain_(record[3]),
+                             'parent_graph': parent, 'sequence': graph.get_next_sequence_number()})
+            graph.obj_dict['edges'].setdefault(points, []).append(obj_dict)
+        else:
+            if record[1] is not None:
+                graph.set_name(str(record[1]))
+                graph.obj_dict['type'] = str(record[2])
+            graph.obj_dict['attributes'].update(_plain_(record[3]))
+
+    return topology
+
+
+def _plain_(attributes):
+    # JSON gives unicode keys on Python 2, which pydot's string checks
+    # don't accept
+    return dict((str(key), str(value) if isinstance(value, type(u'')) and str is bytes else value)
+                for key, value in attributes.items())
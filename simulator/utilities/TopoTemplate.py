@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+import copy
+import logging
+from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.TopoStream import quote_name, unquote_name, split_end, default_statements
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+log = getLogger(__name__)
+
+
+class TemplateError(Exception):
+    pass
+
+
+class SharedAttributes(MutableMapping):
+    """
+    Class Name:         SharedAttributes
+    Description:        Attributes of a node or edge of a template instance.
+                        The attributes of the template are shared by all of
+                        its instances and only the ones that an instance sets
+                        (or deletes) are stored for it.  Lists and dicts are
+                        copied the first time they are read, so changing them
+                        in place doesn't change the other instances.
+
+                        pydot only uses the attributes as a mapping, and
+                        copying or serializing them gives a plain dict.
+    """
+    def __init__(self, shared, local=None):
+        self.shared = shared
+        self.local = local if local is not None else {}
+        self.deleted = None
+
+    def __getitem__(self, key):
+        if key in self.local:
+            return self.local[key]
+
+        if self.deleted and key in self.deleted:
+            raise KeyError(key)
+
+        value = self.shared[key]
+        if isinstance(value, (list, dict, set)):
+            value = self.local[key] = copy.copy(value)
+
+        return value
+
+    def __setitem__(self, key, value):
+        self.local[key] = value
+
+        if self.deleted:
+            self.deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+
+        self.local.pop(key, None)
+        if key in self.shared:
+            if self.deleted is None:
+                self.deleted = set()
+            self.deleted.add(key)
+
+    def __contains__(self, key):
+        if key in self.local:
+            return True
+
+        return key in self.shared and not (self.deleted and key in self.deleted)
+
+    def __iter__(self):
+        for key in self.shared:
+            if key not in self.local and not (self.deleted and key in self.deleted):
+                yield key
+
+        for key in self.local:
+            yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def copy(self):
+        return dict(self)
+
+
+class TopoTemplate(object):
+    """
+    Class Name:         TopoTemplate
+    Description:        A sub-topology (e.g. a pod) that is defined once and
+                        added to a topology many times.  Every instance gets
+                        its own node names (the template names with a prefix)
+                        and node IDs, and shares the attributes of the
+                        template until it changes them (see SharedAttributes).
+                        The nodes and edges are put straight into the graph,
+                        so an instance costs a few small dictionaries per node
+                        and edge instead of new pydot objects.
+
+                        The boundary links connect an instance to the rest of
+                        the topology.  They are pairs of 'node:interface'
+                        ends, the first one in the template and the second
+                        one outside of it, e.g.
+
+                            ('leaf1:swp49', 'spine1:swp{index}')
+
+                        The outside end is formatted with the 'index' and
+                        'prefix' of the instance.
+    """
+    def __init__(self, topology, name='pod', boundary=None):
+        """
+        Method Name:    __init__
+
+        Parameters:     topology
+                          - DotTopo or pydot.Dot with the nodes and links of
+                            the template.  They are copied, so changing it
+                            later doesn't change the template.
+                        name
+                          - Name of the template, used in the default prefix
+                            of the instances
+                        boundary
+                          - Default boundary links of the instances
+        """
+        graph = getattr(topology, 'graph', topology)
+
+        self.name = name
+        self.boundary = list(boundary or [])
+        self.nodes = []
+        self.edges = []
+
+        ids = []
+        for node in graph.get_nodes():
+            node_name = unquote_name(node.get_name())
+            if node_name in default_statements:
+                # Default attribute statements aren't nodes
+                continue
+
+            attributes = dict(node.get_attributes())
+            node_id = attributes.pop('id', None)
+            try:
+                node_id = int(str(node_id).strip('"'))
+            except ValueError:
+                node_id = None
+            ids.append(node_id)
+
+            # The prototype is only used to copy the pydot bookkeeping of a
+            # node, so it doesn't depend on the version of pydot
+            proto = dict(node.obj_dict)
+            proto.update({'attributes': None, 'sequence': None, 'parent_graph': None})
+            self.nodes.append((node_name, node_id, attributes, proto))
+
+        node_names = set(name for name, _, _, _ in self.nodes)
+        for edge in graph.get_edges():
+            src, sintf = split_end(edge.get_source())
+            dst, dintf = split_end(edge.get_destination())
+            if sintf is None or dintf is None:
+                raise TemplateError('The link {0} -- {1} of the template {2} doesn\'t name its interfaces'.format(
+                                    edge.get_source(), edge.get_destination(), name))
+
+            if src not in node_names or dst not in node_names:
+                raise TemplateError('The link {0} -- {1} of the template {2} leaves it, make it a boundary link'.format(
+                                    edge.get_source(), edge.get_destination(), name))
+
+            proto = dict(edge.obj_dict)
+            proto.update({'attributes': None, 'sequence': None, 'parent_graph': None})
+            self.edges.append((src, sintf, dst, dintf, dict(edge.get_attributes()), proto))
+
+        # Nodes without an ID are numbered after the ones with one, and the
+        # instances keep the spacing of the IDs
+        known = [i for i in ids if i is not None]
+        first = min(known) if known else 1
+        next_id = (max(known) + 1) if known else first
+        for i, (node_name, node_id, attributes, proto) in enumerate(self.nodes):
+            if node_id is None:
+                self.nodes[i] = (node_name, next_id, attributes, proto)
+                next_id += 1
+
+        self.id_span = next_id - first
+        self.first_id = first
+
+    def get_prefix(self, index):
+        return '{0}{1}_'.format(self.name, index)
+
+    def instantiate(self, topology, prefix, id_offset, index=0, boundary=None):
+        """
+        Method Name:    instantiate
+
+        Parameters:     topology
+                          - DotTopo to add the instance to
+                        prefix
+                          - Prefix of the node names of the instance
+                        id_offset
+                          - ID of the first node of the instance
+                        index
+                          - Index of the instance, used to format the
+                            boundary links
+                        boundary
+                          - Boundary links, the template's by default
+
+        Description:    Add one instance of the template to a topology
+
+        Returns:        dict
+                          - {template node name: instance node name}
+        """
+        graph = topology.graph
+        nodes = graph.obj_dict['nodes']
+        parent = graph.get_parent_graph()
+
+        names = dict((name, '{0}{1}'.format(prefix, name)) for name, _, _, _ in self.nodes)
+        for name in names.values():
+            if quote_name(name) in nodes:
+                raise TemplateError('The node {0} is already in the topology'.format(name))
+
+        for name, node_id, attributes, proto in self.nodes:
+            obj_dict = dict(proto)
+            obj_dict['name'] = quote_name(names[name])
+            obj_dict['attributes'] = SharedAttributes(attributes, {'id': id_offset + node_id - self.first_id})
+            obj_dict['parent_graph'] = parent
+            obj_dict['sequence'] = graph.get_next_sequence_number()
+            nodes[obj_dict['name']] = [obj_dict]
+
+        for src, sintf, dst, dintf, attributes, proto in self.edges:
+            points = (quote_name('{0}:{1}'.format(names[src], sintf)), quote_name('{0}:{1}'.format(names[dst], dintf)))
+            self._add_edge_(graph, points, SharedAttributes(attributes), proto)
+
+        for inside, outside in (self.boundary if boundary is None else boundary):
+            self._stitch_(topology, names, inside, outside.format(index=index, prefix=prefix))
+
+        return names
+
+    def _add_edge_(self, graph, points, attributes, proto):
+        obj_dict = dict(proto)
+        obj_dict['points'] = points
+        obj_dict['attributes'] = attributes
+        obj_dict['parent_graph'] = graph.get_parent_graph()
+        obj_dict['sequence'] = graph.get_next_sequence_number()
+        graph.obj_dict['edges'].setdefault(points, []).append(obj_dict)
+
+    def _stitch_(self, topology, names, inside, outside):
+        node, intf = split_end(inside)
+        outside_node, outside_intf = split_end(outside)
+        if intf is None or outside_intf is None:
+            raise TemplateError('The boundary link {0} -- {1} doesn\'t name its interfaces'.format(inside, outside))
+
+        if node not in names:
+            raise TemplateError('The boundary link {0} -- {1} doesn\'t start in the template {2}'.format(
+                                inside, outside, self.name))
+
+        # pydot keeps the name of the outside node the way it was parsed,
+        # which may be quoted
+        for outside_name in [outside_node, '"{0}"'.format(outside_node)]:
+            if topology.get_node_from_name(outside_name):
+                break
+        else:
+            raise TemplateError('The boundary link {0} -- {1} ends at {2}, which isn\'t in the topology'.format(
+                                inside, outside, outside_node))
+
+        # The outside interfaces are usually only known once the number of
+        # instances is, so they are added to the node when they are missing
+        topology.add_interface(outside_name, outside_intf)
+        topology.add_link(names[node], intf, outside_name, outside_intf)
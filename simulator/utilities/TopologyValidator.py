@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+import logging
+from collections import namedtuple
+from simulator.utilities.LogWrapper import getLogger
+from simulator.utilities.AddressAllocator import max_node_id, max_intf_id
+from simulator.utilities.TopoStream import unquote_name, split_end, unquote_end
+
+log = getLogger(__name__)
+
+# 'check' is the name of the check that failed, 'subject' the node or link
+# that it failed for
+Problem = namedtuple('Problem', ['check', 'subject', 'message'])
+
+
+class TopologyValidationError(Exception):
+    def __init__(self, problems):
+        self.problems = problems
+        super(TopologyValidationError, self).__init__(
+            'The topology has {0} problem(s):\n  {1}'.format(len(problems),
+                                                            '\n  '.join(p.message for p in problems)))
+
+
+def _unquote_(value):
+    # pydot quotes the attributes that it parses when they need it, e.g.
+    # labels with '|' in them
+    if value is None:
+        return None
+
+    return str(value).strip('"')
+
+
+class TopologyValidator(object):
+    """
+    Class Name:         TopologyValidator
+    Description:        Checks a topology before anything is started for it.
+                        The node and link indexes are built with one pass over
+                        the nodes and one over the edges, and every check works
+                        from them, so the whole topology is checked in
+                        O(nodes + edges).  All of the problems are reported at
+                        once instead of failing on the first one.
+
+                        The checks are:
+
+                            names       - every node name is used once
+                            ids         - every node has a numeric 'id' that no
+                                          other node has
+                            addresses   - the id and the interfaces of every
+                                          node fit in its MAC addresses
+                            vm_types    - every 'vm_type' is known
+                            links       - both ends of a link are
+                                          'node:interface', the node exists,
+                                          the interface is in the node's label
+                                          and no other link uses it
+                            ports       - there are enough free UDP ports for
+                                          every node
+                            images      - every image is in the image depot
+                            disks       - the disk settings of every node are
+                                          valid
+    """
+    def __init__(self, topology, vm_types=None, get_image_name=None, find_image=None,
+                 free_ports=None, ports_per_node=0, get_disk=None):
+        """
+        Method Name:    __init__
+
+        Parameters:     topology
+                          - DotTopo instance to check
+                        vm_types
+                          - Names of the known VM types.  Not checked if None.
+                        get_image_name
+                          - Function that returns the name of the image of a
+                            pydot.Node
+                        find_image
+                          - Function that returns the path of an image name,
+                            or None if it isn't there.  Images aren't checked
+                            if either function is None.
+                        free_ports
+                          - Number of free UDP ports.  Not checked if None.
+                        ports_per_node
+                          - UDP ports that every node needs on top of one for
+                            every interface
+                        get_disk
+                          - Function that returns the disk settings of a
+                            pydot.Node and raises an exception if they are
+                            wrong.  Not checked if None.
+        """
+        self.topology = topology
+        self.vm_types = vm_types
+        self.get_image_name = get_image_name
+        self.find_image = find_image
+        self.free_ports = free_ports
+        self.ports_per_node = ports_per_node
+        self.get_disk = get_disk
+        self.problems = []
+
+    def _add_(self, check, subject, message):
+        self.problems.append(Problem(check, subject, message))
+
+    def _index_nodes_(self):
+        # {name: set of interface names}, plus the checks that only need
+        # the node itself
+        interfaces = {}
+        ids = {}
+        images = {}
+
+        for node in self.topology.get_nodes():
+            name = unquote_name(node.get_name())
+
+            if name in interfaces:
+                self._add_('names', name, 'The node name {0} is used more than once'.format(name))
+                continue
+
+            label = _unquote_(node.get_label())
+            interfaces[name] = set(label.split('|')) if label else set()
+
+            if len(interfaces[name]) > max_intf_id + 1:
+                self._add_('addresses', name, '{0} has {1} interfaces, only {2} get a MAC address'.format(
+                           name, len(interfaces[name]), max_intf_id + 1))
+
+            node_id = _unquote_(node.get('id'))
+            try:
+                node_id = int(node_id)
+            except (TypeError, ValueError):
+                self._add_('ids', name, '{0} has no numeric id ({1})'.format(name, node_id))
+            else:
+                if node_id < 0 or node_id > max_node_id:
+                    self._add_('addresses', name, '{0} has the id {1}, which is out of range (0-{2})'.format(
+                               name, node_id, max_node_id))
+
+                if node_id in ids:
+                    self._add_('ids', name, '{0} has the same id {1} as {2}'.format(name, node_id, ids[node_id]))
+                else:
+                    ids[node_id] = name
+
+            vm_type = _unquote_(node.get('vm_type'))
+            if self.vm_types is not None and vm_type and vm_type not in self.vm_types:
+                self._add_('vm_types', name, '{0} has the unknown vm_type {1} (known types: {2})'.format(
+                           name, vm_type, ', '.join(sorted(self.vm_types))))
+                continue
+
+            if self.get_disk:
+                try:
+                    self.get_disk(node)
+                except Exception as e:
+                    self._add_('disks', name, 'The disk settings of {0} are wrong: {1}'.format(name, e))
+
+            if self.get_image_name:
+                try:
+                    image = _unquote_(self.get_image_name(node))
+                except Exception as e:
+                    self._add_('images', name, 'Couldn\'t work out the image of {0}: {1}'.format(name, e))
+                else:
+                    # Nodes that aren't VMs (e.g. network namespaces) have
+                    # no image
+                    if image:
+                        images.setdefault(image, []).append(name)
+
+        return interfaces, images
+
+    def _check_links_(self, interfaces):
+        used = {}
+
+        for edge in self.topology.graph.get_edges():
+            ends = [edge.get_source(), edge.get_destination()]
+            link = '{0} -- {1}'.format(*[unquote_end(end) for end in ends])
+
+            for end in ends:
+                node, intf = split_end(end)
+                end = unquote_end(end)
+                if intf is None:
+                    self._add_('links', link, 'The link {0} doesn\'t name an interface of {1}'.format(link, end))
+                    continue
+
+                if node not in interfaces:
+                    self._add_('links', link, 'The link {0} uses the node {1}, which doesn\'t exist'.format(link, node))
+                elif intf not in interfaces[node]:
+                    self._add_('links', link, 'The link {0} uses {1}, which isn\'t in the label of {2}'.format(
+                               link, intf, node))
+                elif end in used:
+                    self._add_('links', link, '{0} is used by the links {1} and {2}'.format(end, used[end], link))
+                else:
+                    used[end] = link
+
+    def _check_ports_(self, interfaces):
+        needed = sum(len(intfs) + self.ports_per_node for intfs in interfaces.values())
+
+        if needed > self.free_ports:
+            self._add_('ports', None, 'The topology needs {0} UDP ports but only {1} are free'.format(
+                       needed, self.free_ports))
+
+    def _check_images_(self, images):
+        # Every image is only looked up once, however many nodes use it
+        for image, names in sorted(images.items()):
+            try:
+                path = self.find_image(image)
+            except Exception as e:
+                path = None
+                error = str(e)
+            else:
+                error = 'it isn\'t in the image depot'
+
+            if not path:
+                self._add_('images', image, 'The image {0} of {1} node(s) ({2}) can\'t be used: {3}'.format(
+                           image, len(names), ', '.join(names[:5]) + (', ...' if len(names) > 5 else ''), error))
+
+    def validate(self):
+        """
+        Method Name:    validate
+
+        Parameters:     None
+
+        Description:    Run all of the checks
+
+        Returns:        list
+                          - Problem for everything that is wrong, empty if
+                            the topology can be started
+        """
+        self.problems = []
+
+        interfaces, images = self._index_nodes_()
+        self._check_links_(interfaces)
+
+        if self.free_ports is not None:
+            self._check_ports_(interfaces)
+
+        if self.get_image_name and self.find_image:
+            self._check_images_(images)
+
+        return self.problems
+
+    def check(self):
+        """
+        Method Name:    check
+
+        Parameters:     None
+
+        Description:    Run all of the checks and raise a
+                        TopologyValidationError with every problem if any
+                        of them failed
+        """
+        problems = self.validate()
+
+        if problems:
+            raise TopologyValidationError(problems)
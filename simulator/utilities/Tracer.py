@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import threading
+import contextlib
+import logging
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+from simulator.utilities.LogWrapper import getLogger
+
+log = getLogger(__name__)
+
+
+class Span(object):
+    """
+    Class Name:         Span
+    Description:        A single timed phase of the simulator.  Spans nest,
+                        the span that was open when this one started is its
+                        parent.
+    """
+    def __init__(self, phase, node=None, parent=None, labels=None):
+        self.phase = phase
+        self.node = node
+        self.parent = parent
+        self.labels = labels or {}
+        self.thread = threading.current_thread().ident
+        self.start = time.time()
+        self.end = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    @property
+    def depth(self):
+        depth = 0
+        parent = self.parent
+        while parent:
+            depth += 1
+            parent = parent.parent
+
+        return depth
+
+    def to_dict(self):
+        return {'phase': self.phase,
+                'node': self.node,
+                'labels': self.labels,
+                'start': self.start,
+                'end': self.end,
+                'duration': self.duration,
+                'depth': self.depth}
+
+
+class Tracer(object):
+    """
+    Class Name:         Tracer
+    Description:        Collects nested timed spans of the simulator's
+                        phases (DOT parsing, image depot scans, port
+                        allocation, overlay creation, VM launches...).
+                        Subscribers are called for every event:
+
+                            callback(event, payload)
+
+                        'span_start' and 'span_end' events pass the Span as
+                        the payload.  Other parts of the simulator may emit
+                        their own events with 'emit'.
+    """
+    def __init__(self):
+        self.spans = []
+        self.subscribers = []
+        self.epoch = time.time()
+        self._lock = threading.Lock()
+
+        # The open spans of every thread, or of every asyncio task when
+        # contextvars is available, so concurrent simulations in one event
+        # loop don't become each other's parents
+        if contextvars:
+            self._open_spans_ = contextvars.ContextVar('open_spans', default=())
+        else:
+            self._local = threading.local()
+
+    def _get_open_spans_(self):
+        if contextvars:
+            return self._open_spans_.get()
+
+        return getattr(self._local, 'stack', ())
+
+    def _set_open_spans_(self, spans):
+        if contextvars:
+            self._open_spans_.set(spans)
+        else:
+            self._local.stack = spans
+
+    def subscribe(self, callback):
+        """
+        Method Name:    subscribe
+
+        Parameters:     callback
+                          - Callable that is passed (event, payload)
+
+        Description:    Subscribe to the events of this tracer
+        """
+        if callback not in self.subscribers:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def emit(self, event, payload=None):
+        for callback in list(self.subscribers):
+            try:
+                callback(event, payload)
+            except Exception as e:
+                log.warn('Trace subscriber {0} failed on {1}: {2}'.format(callback, event, e))
+
+    @contextlib.contextmanager
+    def span(self, phase, node=None, **labels):
+        """
+        Method Name:    span
+
+        Parameters:     phase
+                          - Name of the phase being timed
+                        node
+                          - Name of the node the phase is for, if any
+                        labels
+                          - Any other labels to attach to the span
+
+        Description:    Context manager that times the code inside it
+        """
+        open_spans = self._get_open_spans_()
+        span = Span(phase, node=node, parent=open_spans[-1] if open_spans else None, labels=labels)
+
+        with self._lock:
+            self.spans.append(span)
+
+        self._set_open_spans_(open_spans + (span,))
+        self.emit('span_start', span)
+
+        try:
+            yield span
+        finally:
+            span.end = time.time()
+            self._set_open_spans_(open_spans)
+            self.emit('span_end', span)
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+        self.epoch = time.time()
+
+    def export_chrome_trace(self, path):
+        """
+        Method Name:    export_chrome_trace
+
+        Parameters:     path
+                          - File to write the trace to
+
+        Description:    Write the spans in the Chrome trace event format,
+                        which can be loaded in chrome://tracing or Perfetto
+        """
+        events = []
+        for span in list(self.spans):
+            args = dict(span.labels)
+            if span.node:
+                args['node'] = span.node
+
+            events.append({'name': span.phase,
+                           'cat': 'pydotsim',
+                           'ph': 'X',
+                           'ts': int((span.start - self.epoch) * 1e6),
+                           'dur': int(span.duration * 1e6),
+                           'pid': os.getpid(),
+                           'tid': span.thread,
+                           'args': args})
+
+        with open(path, 'w') as stream:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, stream)
+
+        log.debug('Wrote {0} spans to {1}'.format(len(events), path))
+
+    def summary(self):
+        """
+        Method Name:    summary
+
+        Parameters:     None
+
+        Description:    Build a table of the time spent in every phase
+
+        Returns:        str
+        """
+        phases = {}
+        order = []
+        for span in list(self.spans):
+            if span.phase not in phases:
+                phases[span.phase] = {'count': 0, 'total': 0.0, 'max': 0.0, 'depth': span.depth}
+                order.append(span.phase)
+
+            stats = phases[span.phase]
+            stats['count'] += 1
+            stats['total'] += span.duration
+            stats['max'] = max(stats['max'], span.duration)
+
+        lines = ['{0:32s} {1:>7s} {2:>11s} {3:>11s} {4:>11s}'.format('phase', 'count', 'total (s)',
+                                                                    'mean (ms)', 'max (ms)')]
+        for phase in order:
+            stats = phases[phase]
+            lines.append('{0:32s} {1:7d} {2:11.3f} {3:11.2f} {4:11.2f}'.format(
+                         ('  ' * stats['depth'] + phase)[:32], stats['count'], stats['total'],
+                         stats['total'] / stats['count'] * 1000, stats['max'] * 1000))
+
+        return '\n'.join(lines)
+
+
+_default_tracer = Tracer()
+
+
+def get_tracer():
+    """
+    Function Name:      get_tracer
+
+    Parameters:         None
+
+    Description:        Get the process wide tracer.  The topology, the
+                        simulator and the builders all use it unless they
+                        are given their own.
+
+    Returns:            Tracer
+    """
+    return _default_tracer
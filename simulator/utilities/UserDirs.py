@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import os
+import stat
+import logging
+from simulator.utilities.LogWrapper import getLogger
+
+log = getLogger(__name__)
+
+
+class UnsafeDirectory(Exception):
+    pass
+
+
+def user_tmp_dir(name, uid=None):
+    """
+    Function Name:      user_tmp_dir
+
+    Parameters:         name
+                         - Name of the directory, e.g. 'plan_cache'
+                        uid
+                         - Owner of the directory, the current user by
+                           default
+
+    Description:        Path of a directory in /tmp that only one user uses.
+                        /tmp is shared by every user, so files that are
+                        later trusted (plans whose command lines are run as
+                        root, saved VM states) are never kept in a directory
+                        that another user could have created.
+
+    Returns:            str
+    """
+    return '/tmp/{0}-{1}'.format(name, os.getuid() if uid is None else uid)
+
+
+def make_private_dir(path, mode=0o700):
+    """
+    Function Name:      make_private_dir
+
+    Parameters:         path
+                         - Directory to create or check
+                        mode
+                         - Permissions of a new directory.  Other users may
+                           be allowed to read it (e.g. 0o755 for the socket of
+                           a daemon), but never to write to it.
+
+    Description:        Create a directory that only the current user can
+                        write to.  A directory that already exists must
+                        belong to the current user and must not be writable
+                        by anyone else, otherwise UnsafeDirectory is raised.
+
+    Returns:            str
+                         - The path
+    """
+    if not os.path.isdir(path):
+        log.debug('Creating the directory, {0}, since it didn\'t exist'.format(path))
+        try:
+            os.makedirs(path, mode & ~(stat.S_IWGRP | stat.S_IWOTH))
+        except OSError:
+            # Created by a concurrent run, it's checked below
+            if not os.path.isdir(path):
+                raise
+
+    st = os.lstat(path)
+    if stat.S_ISLNK(st.st_mode) or st.st_uid != os.getuid():
+        raise UnsafeDirectory('{0} doesn\'t belong to UID {1}'.format(path, os.getuid()))
+
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise UnsafeDirectory('{0} is writable by other users'.format(path))
+
+    return path
+
+
+def is_owned(path, allow_root=False):
+    """
+    Function Name:      is_owned
+
+    Parameters:         path
+                         - File to check
+                        allow_root
+                         - Files that root created for the user (e.g. with
+                           the PrivHelper) are accepted as well
+
+    Description:        Check that a file belongs to the current user and
+                        isn't a symbolic link
+
+    Returns:            bool
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+
+    return not stat.S_ISLNK(st.st_mode) and (st.st_uid == os.getuid() or (allow_root and st.st_uid == 0))
+
+
+def give_to_user(path, uid, gid=None):
+    """
+    Function Name:      give_to_user
+
+    Parameters:         path
+                         - File or directory that a root process created
+                           for a user
+                        uid/gid
+                         - Owner to give it to
+
+    Description:        Change the owner of a file that root created on
+                        behalf of a user (e.g. the state of a simulation that
+                        the host daemon started), so the user can replace it
+                        later.  Symbolic links and files with more than one
+                        hard link are left alone, the user could have put
+                        them there to get any file of the host.
+    """
+    flags = os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_NONBLOCK', 0)
+    try:
+        fd = os.open(path, flags)
+    except OSError as e:
+        log.debug('Not changing the owner of {0}: {1}'.format(path, e))
+        return
+
+    try:
+        st = os.fstat(fd)
+        if st.st_uid == uid:
+            return
+
+        if stat.S_ISDIR(st.st_mode) or (stat.S_ISREG(st.st_mode) and st.st_nlink == 1):
+            os.fchown(fd, uid, gid if gid is not None else -1)
+        else:
+            log.warn('Not changing the owner of {0}, it isn\'t a plain file'.format(path))
+    finally:
+        os.close(fd)
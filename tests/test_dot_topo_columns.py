@@ -0,0 +1,21 @@
+from simulator.DotTopo import DotTopo
+
+quoted_topology = '''graph G {
+a [id=1];
+"b-1" [id=2];
+a:swp1 -- "b-1":swp1;
+}'''
+
+
+def test_link_column_keys_of_quoted_node_names():
+    topo = DotTopo(graph=quoted_topology)
+
+    assert list(topo.get_link_attribute_column('mtu')) == [('a:swp1', 'b-1:swp1')]
+
+    # The keys that were read, and the ends that pydot has, select the link
+    assert topo.set_link_attribute_column('mtu', {('a:swp1', 'b-1:swp1'): 9000}) == 1
+    edge = topo.graph.get_edges()[0]
+    assert topo.set_link_attribute_column('speed', {(edge.get_source(), edge.get_destination()): 100}) == 1
+
+    assert topo.get_link_attribute_column('mtu') == {('a:swp1', 'b-1:swp1'): 9000}
+    assert topo.get_link_attribute_column('speed') == {('a:swp1', 'b-1:swp1'): 100}
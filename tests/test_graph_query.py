@@ -0,0 +1,18 @@
+from simulator.DotTopo import DotTopo
+
+quoted_topology = '''graph G {
+a [id=1];
+"b-1" [id=2];
+"c-1" [id=3];
+a:swp1 -- "b-1":swp1;
+"b-1":swp2 -- "c-1":swp1;
+}'''
+
+
+def test_links_to_quoted_node_names():
+    topo = DotTopo(graph=quoted_topology)
+
+    assert topo.query.neighbors('a') == ['b-1']
+    assert sorted(topo.query.neighbors('b-1')) == ['a', 'c-1']
+    assert topo.query.degree('b-1') == 2
+    assert topo.query.shortest_path('a', 'c-1') == ['a', 'b-1', 'c-1']
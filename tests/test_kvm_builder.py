@@ -0,0 +1,27 @@
+from simulator.DotTopo import DotTopo
+from simulator.builders.kvm_builder import KvmBuilder
+from simulator.benchmarks.generators import FakeImageDepot
+from simulator.utilities.ImageDepot import ImageDepot
+from simulator.utilities.PortResourceCheck import PortResourceCheck
+
+
+def test_quoted_node_names(tmpdir):
+    topo = DotTopo(graph='graph G { "a-1" [id=1, label="swp1", image="cumulus-1.0.0"]; '
+                         'b [id=2, label="swp1", image="cumulus-1.0.0"]; "a-1":swp1 -- b:swp1; }')
+
+    with FakeImageDepot(vm_types=['cumulus'], versions=1) as fake:
+        builder = KvmBuilder(topo, str(tmpdir.mkdir('sim')) + '/', ImageDepot(fake.depot))
+        builder.plan_cache.directory = str(tmpdir.mkdir('plans'))
+        builder.port_check = PortResourceCheck(start=62000, end=62100, directory=str(tmpdir.join('ports')))
+
+        assert builder.validate() == []
+        plan = builder.compile_plan()
+        builder.port_check.release_port(plan.get_ports(), sim_dir=builder.sim_dir)
+
+    assert sorted(plan.nodes) == ['a-1', 'b']
+    assert [link.get_source() for link in builder.nodes['a-1'].links] == [topo.graph.get_edges()[0].get_source()]
+    assert builder.nodes['a-1']._get_link_peers_()[0][:2] == ('swp1', 'b:swp1')
+
+    link = plan.links[0]
+    assert link['local_port'] in plan.nodes['a-1']['ports']
+    assert link['remote_port'] in plan.nodes['b']['ports']
@@ -0,0 +1,50 @@
+import os
+import threading
+
+from simulator.DotTopo import DotTopo
+from simulator.builders.kvm_builder import KvmBuilder
+from simulator.utilities.SimState import read_state, write_state, update_state
+
+
+def test_concurrent_updates_are_not_lost(tmpdir):
+    sim_dir = str(tmpdir)
+    write_state(sim_dir, {'count': 0})
+
+    def increment(state):
+        state['count'] += 1
+        return state
+
+    def worker():
+        for _ in range(50):
+            update_state(sim_dir, increment)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert read_state(sim_dir) == {'count': 200}
+    assert not [name for name in os.listdir(sim_dir) if name.endswith('.tmp')]
+
+
+def test_record_launch_keeps_restarts_of_earlier_stages(tmpdir):
+    sim_dir = str(tmpdir)
+    # The state of an earlier simulation in the same directory
+    write_state(sim_dir, {'nodes': {'a': {'pid': 7, 'restarts': 3}, 'b': {'pid': 8}}})
+
+    builder = KvmBuilder(DotTopo(graph='graph G { a [id=1]; b [id=2]; }'), sim_dir, None)
+    builder.record_launch([101, None], final=False)
+    assert read_state(sim_dir)['nodes'] == {'a': {'pid': 101, 'udp_ports': None},
+                                            'b': {'pid': None, 'udp_ports': None}}
+
+    # The supervisor restarts 'a' while the next stage is started
+    def restart(state):
+        state['nodes']['a'].update(pid=202, restarts=1)
+        return state
+
+    update_state(sim_dir, restart)
+    builder.record_launch([101, 102], final=False)
+
+    assert read_state(sim_dir)['nodes'] == {'a': {'pid': 202, 'restarts': 1, 'udp_ports': None},
+                                            'b': {'pid': 102, 'udp_ports': None}}
@@ -0,0 +1,65 @@
+import io
+import pydot
+import pytest
+from simulator.DotTopo import DotTopo
+from simulator.utilities.TopoStream import iter_edges, iter_nodes, split_end
+
+# Node names that DOT has to quote
+quoted_topology = '''graph G {
+a [id=1, vm_type=cumulus];
+"leaf-1" [id=2, vm_type=cumulus];
+"b 2" [id=3];
+a:swp1 -- "leaf-1":swp1;
+"leaf-1":"swp-2" -- "b 2":swp1;
+}'''
+
+
+def _structure_(graph):
+    nodes = sorted(name for name, _ in iter_nodes(graph))
+    edges = sorted((source, destination) for source, destination, _ in iter_edges(graph))
+    return nodes, edges
+
+
+@pytest.mark.parametrize('end, expected', [
+    ('a:swp1', ('a', 'swp1')),
+    ('"leaf-1":swp1', ('leaf-1', 'swp1')),
+    ('"leaf-1":"swp-2"', ('leaf-1', 'swp-2')),
+    ('"leaf-1:swp1"', ('leaf-1', 'swp1')),
+    ('"c:x":swp1', ('c:x', 'swp1')),
+    ('a', ('a', None)),
+])
+def test_split_end(end, expected):
+    assert split_end(end) == expected
+
+
+def test_iter_edges_unquotes_node_names():
+    topo = DotTopo(graph=quoted_topology)
+
+    assert _structure_(topo.graph)[1] == [('a:swp1', 'leaf-1:swp1'), ('leaf-1:swp-2', 'b 2:swp1')]
+
+
+@pytest.mark.parametrize('fmt', ['dot', 'jsonl', 'bin'])
+def test_round_trip_quoted_node_names(fmt):
+    topo = DotTopo(graph=quoted_topology)
+
+    stream = io.BytesIO()
+    topo.write_to_file(stream, fmt=fmt)
+    stream.seek(0)
+
+    copy = DotTopo()
+    copy.read_from_file(stream, fmt=fmt)
+
+    assert _structure_(copy.graph) == _structure_(topo.graph)
+
+
+def test_dot_output_is_parsed_by_pydot():
+    stream = io.BytesIO()
+    DotTopo(graph=quoted_topology).write_to_file(stream, fmt='dot')
+
+    # Old versions of pydot lose the edges of unicode text on Python 2
+    data = stream.getvalue()
+    graph = pydot.graph_from_dot_data(data if isinstance(data, str) else data.decode('utf-8'))
+    graph = graph[0] if isinstance(graph, list) else graph
+
+    # No node is made up from a mangled end of an edge
+    assert _structure_(graph) == _structure_(DotTopo(graph=quoted_topology).graph)
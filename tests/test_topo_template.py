@@ -0,0 +1,19 @@
+from simulator.DotTopo import DotTopo
+from simulator.utilities.TopoStream import unquote_end
+from simulator.utilities.TopoTemplate import TopoTemplate
+
+
+def test_quoted_node_names():
+    pod = DotTopo(graph='graph G { "leaf-1" [id=1, label="swp1|swp2"]; "srv-1" [id=2, label="eth0"]; '
+                        '"leaf-1":swp1 -- "srv-1":eth0; }')
+    template = TopoTemplate(pod, boundary=[('leaf-1:swp2', '"spine-1":swp{index}')])
+
+    fabric = DotTopo(graph='graph G { "spine-1" [id=100]; }')
+    for i in range(2):
+        template.instantiate(fabric, template.get_prefix(i), 1 + 2 * i, index=i + 1)
+
+    assert sorted((unquote_end(edge.get_source()), unquote_end(edge.get_destination()))
+                  for edge in fabric.graph.get_edges()) == [('pod0_leaf-1:swp1', 'pod0_srv-1:eth0'),
+                                                            ('pod0_leaf-1:swp2', 'spine-1:swp1'),
+                                                            ('pod1_leaf-1:swp1', 'pod1_srv-1:eth0'),
+                                                            ('pod1_leaf-1:swp2', 'spine-1:swp2')]
@@ -0,0 +1,32 @@
+from simulator.DotTopo import DotTopo
+from simulator.builders.kvm_builder import get_disk_profile
+from simulator.utilities.TopologyValidator import TopologyValidator
+
+topology = '''graph G {
+a [id=1, label="swp1", disk_profile="fast"];
+b [id=8388608, label="swp1", disk_aio="native"];
+c [id=3, label="swp1", disk_profile="ci"];
+a:swp1 -- b:swp1;
+}'''
+
+
+def get_disk(node):
+    overrides = dict((option, node.get('disk_' + option).strip('"'))
+                     for option in ['aio'] if node.get('disk_' + option))
+    return get_disk_profile((node.get('disk_profile') or 'default').strip('"'), overrides)
+
+
+def test_addresses_and_disks_are_checked_before_allocation():
+    problems = TopologyValidator(DotTopo(graph=topology), get_disk=get_disk).validate()
+
+    assert sorted((p.check, p.subject) for p in problems) == [('addresses', 'b'), ('disks', 'a'), ('disks', 'b')]
+
+
+def test_quoted_node_names_and_vm_types():
+    topo = DotTopo(graph='graph G { "a-1" [id=1, label="swp1", vm_type="cumulus"]; '
+                         'b [id=2, label="swp1|swp2", vm_type=cumulus]; "a-1":swp1 -- b:swp1; b:swp2 -- "c-1":swp1; }')
+
+    problems = TopologyValidator(topo, vm_types=['cumulus']).validate()
+
+    assert [(p.check, p.subject) for p in problems] == [('links', 'b:swp2 -- c-1:swp1')]
+    assert 'uses the node c-1,' in problems[0].message